@@ -0,0 +1,189 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _notification_dispatcher import wait_with_timer
+import atexit
+import threading
+import time
+
+#############################################################################
+# Location batching constants
+
+LOCATION_BATCH_MAX_SIZE = 100           # Most ContributedAssetLocations sent in one POST
+LOCATION_BATCH_MAX_AGE_SECONDS = 5.0    # Longest a reading waits before it is sent
+LOCATION_BUFFER_MAX_SIZE = 1000         # Readings buffered before add() blocks the producer
+
+# Writers that may still hold buffered readings - sent when due by a single flusher thread, which
+# only runs while there are any. The writers share the condition it waits on.
+_open_writers = set()
+_condition = threading.Condition()
+_flusher = None
+
+#############################################################################
+# Buffers the locations reported for one asset and POSTs them as a single array
+#
+# The asset locations endpoint takes an array of ContributedAssetLocation objects, so readings are
+# accumulated and sent together once there are max_batch_size of them or the oldest is
+# max_age_seconds old. When max_buffered readings are waiting (e.g. the API is slow), add() blocks
+# until a flush makes room. Writers are flushed when the process shuts down.
+#
+# Every writer is flushed by the same background thread, however many assets there are.
+
+class AssetLocationWriter:
+
+    #############################################################################
+    def __init__(self, demo_helper, asset_locations_uri, max_batch_size=LOCATION_BATCH_MAX_SIZE,
+                 max_age_seconds=LOCATION_BATCH_MAX_AGE_SECONDS, max_buffered=LOCATION_BUFFER_MAX_SIZE):
+
+        self.demo_helper = demo_helper
+        self.asset_locations_uri = asset_locations_uri
+        self.max_batch_size = max_batch_size
+        self.max_age_seconds = max_age_seconds
+        self.max_buffered = max(max_buffered, max_batch_size)
+
+        self._buffer = []               # (added at, location) - oldest first
+        self._retry_at = None
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        self._condition = _condition
+
+        with self._condition:
+            _open_writers.add(self)
+            start_flusher()
+
+    #############################################################################
+    def add(self, location):
+
+        with self._condition:
+            if self._closed:
+                raise ValueError("Asset location writer for {} is closed".format(self.asset_locations_uri))
+
+            # Backpressure - wait for the flusher to make room
+            while len(self._buffer) >= self.max_buffered:
+                self._condition.notify_all()
+                self._condition.wait()
+
+            # The flusher needs to know when the buffer becomes due
+            if not self._buffer:
+                self._condition.notify_all()
+            self._buffer.append((time.time(), location))
+
+            if len(self._buffer) >= self.max_batch_size:
+                self._condition.notify_all()
+
+    #############################################################################
+    # Send everything buffered so far - in batches of at most max_batch_size
+    def flush(self):
+
+        with self._flush_lock:
+            while True:
+                with self._condition:
+                    batch = [location for _, location in self._buffer[:self.max_batch_size]]
+                    if not batch:
+                        return
+
+                # The batch is only removed from the buffer once it is sent - if the POST fails the
+                # readings stay at the front of the buffer for the next flush, which is due as soon as
+                # the oldest reading left is max_age_seconds old
+                self.demo_helper.process_http_oauth_post_request(self.asset_locations_uri, batch,
+                                                                 "Asset locations updated ({} readings)".format(len(batch)))
+
+                with self._condition:
+                    del self._buffer[:len(batch)]
+                    self._retry_at = None
+                    self._condition.notify_all()
+
+    #############################################################################
+    # Flush whatever is left and stop buffering - if the flush fails the writer stays open, so the
+    # flusher keeps retrying its readings
+    def close(self):
+
+        while True:
+            try:
+                self.flush()
+            except Exception:
+                with self._condition:
+                    self._retry_at = time.time() + self.max_age_seconds
+                raise
+
+            # Readings added while flushing are flushed too before the writer closes
+            with self._condition:
+                if not self._buffer:
+                    self._closed = True
+                    _open_writers.discard(self)
+                    self._condition.notify_all()
+                    return
+
+    #############################################################################
+    # Called by the flusher - after a failed flush it waits max_age_seconds before trying again
+    def _flush_in_background(self):
+
+        try:
+            self.flush()
+        except Exception as failure:
+            self.demo_helper.logger.info("ERROR   - Could not send asset locations to {} - {}".format(self.asset_locations_uri, failure))
+
+            with self._condition:
+                self._retry_at = time.time() + self.max_age_seconds
+
+    #############################################################################
+    # Called with the condition held - when the buffer is next due to be flushed (None if it is empty),
+    # now if it is full
+    def _get_due_at(self, now):
+
+        if self._closed or not self._buffer:
+            return None
+
+        oldest_added_at, _ = self._buffer[0]
+        due_at = now if len(self._buffer) >= self.max_batch_size else oldest_added_at + self.max_age_seconds
+        return max(due_at, self._retry_at or 0)
+
+#############################################################################
+# Called with the condition held
+def start_flusher():
+
+    global _flusher
+
+    if _flusher is None:
+        _flusher = threading.Thread(target=flush_writers_when_due)
+        _flusher.daemon = True
+        _flusher.start()
+
+#############################################################################
+# The flusher thread - flushes each writer once it is due, until there are no writers left
+def flush_writers_when_due():
+
+    global _flusher
+
+    while True:
+        with _condition:
+            while True:
+                if not _open_writers:
+                    _flusher = None
+                    return
+
+                now = time.time()
+                due_times = [(writer, writer._get_due_at(now)) for writer in _open_writers]
+                due_writers = [writer for writer, due_at in due_times if due_at is not None and due_at <= now]
+                if due_writers:
+                    break
+
+                due_ats = [due_at for _, due_at in due_times if due_at is not None]
+                wait_with_timer(_condition, max(min(due_ats) - now, 0.01) if due_ats else None)
+
+        for writer in due_writers:
+            writer._flush_in_background()
+
+#############################################################################
+# Make sure buffered readings aren't lost when the process exits
+
+@atexit.register
+def close_open_writers():
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+#############################################################################
@@ -0,0 +1,134 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _common_setup import *
+from _demo_helper import DemoHelper
+from _tracing import bind_to_current_span
+from multiprocessing.pool import ThreadPool
+import threading
+
+#############################################################################
+# Concurrency constants
+
+ASYNC_THREAD_POOL_SIZE = 16         # Threads available to run pending work
+ASYNC_MAX_CONCURRENT_REQUESTS = 8   # Global limit on HTTP requests in flight at once
+
+#############################################################################
+# Shared by every AsyncDemoHelper - so the request limit is global, and the threads survive warm invocations
+
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+_request_semaphore = threading.BoundedSemaphore(ASYNC_MAX_CONCURRENT_REQUESTS)
+_request_slot_state = threading.local()
+
+#############################################################################
+def get_thread_pool():
+
+    global _thread_pool
+
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPool(ASYNC_THREAD_POOL_SIZE)
+        return _thread_pool
+
+#############################################################################
+# DemoHelper whose calls can be started without waiting for them to finish
+#
+# The Lambda runtime this demo targets (Python 2.7) has no asyncio, so the *_async methods start
+# their work on a shared thread pool and hand back a pending result straight away. Independent
+# calls can then run at the same time, and gather() waits for all of them - much like
+# asyncio.gather would. Every HTTP request, whichever thread sends it, goes through a global
+# semaphore so a burst of pending work can't flood the API.
+
+class AsyncDemoHelper(DemoHelper):
+
+    #############################################################################
+    # The thread pool is started along with the rest of what is built once per container
+    def prepare(self):
+
+        DemoHelper.prepare(self)
+        get_thread_pool()
+
+    #############################################################################
+    # Start function(*args) on the thread pool - returns a pending result to pass to wait/gather
+    # The work is done on behalf of the same button as the caller
+    def submit(self, function, *args):
+
+        iot_button_serial_number = self.iot_button_serial_number
+
+        @bind_to_current_span
+        def run_for_button():
+            self.set_thread_serial_number(iot_button_serial_number)
+            try:
+                return function(*args)
+            finally:
+                self.set_thread_serial_number(None)
+
+        return get_thread_pool().apply_async(run_for_button)
+
+    #############################################################################
+    # Wait for a pending result - plain values are passed through, so callers can hand
+    # either a value or a pending value to the *_async methods
+    def wait(self, pending_or_value):
+
+        if hasattr(pending_or_value, 'get') and hasattr(pending_or_value, 'ready'):
+            return pending_or_value.get()
+
+        return pending_or_value
+
+    #############################################################################
+    # Wait for several pending results - returns their values in the order given
+    def gather(self, *pending_results):
+        return [self.wait(pending_result) for pending_result in pending_results]
+
+    #############################################################################
+    # Every request is limited by the global request semaphore - only while it is being sent, so a
+    # request waiting on the scheduler (for a token, or to be retried) doesn't hold up the others.
+    # A request sent while sending another (e.g. the upload source a PUT streams from) shares its
+    # slot - waiting for a second one could deadlock.
+    def send_scheduled_request(self, method, url, send_request, streamed=False):
+
+        def send_request_when_allowed(timeout):
+            if getattr(_request_slot_state, 'holding', False):
+                return send_request(timeout)
+
+            with _request_semaphore:
+                _request_slot_state.holding = True
+                try:
+                    return send_request(timeout)
+                finally:
+                    _request_slot_state.holding = False
+
+        return DemoHelper.send_scheduled_request(self, method, url, send_request_when_allowed, streamed)
+
+    #############################################################################
+    # Pending equivalents of the request helpers
+    def process_http_oauth_get_request_async(self, *args, **kwargs):
+        return self.submit(lambda: self.process_http_oauth_get_request(*args, **kwargs))
+
+    def process_http_oauth_post_request_async(self, *args, **kwargs):
+        return self.submit(lambda: self.process_http_oauth_post_request(*args, **kwargs))
+
+    def process_http_oauth_put_request_async(self, *args, **kwargs):
+        return self.submit(lambda: self.process_http_oauth_put_request(*args, **kwargs))
+
+    def process_http_oauth_delete_request_async(self, *args, **kwargs):
+        return self.submit(lambda: self.process_http_oauth_delete_request(*args, **kwargs))
+
+    #############################################################################
+    # The org and the contribution definitions (needed for the notification that follows) don't
+    # depend on each other, so both are looked up at the same time - and both waited for before the
+    # field is looked up or POSTed, which then finds the org cached
+    def create_field_async(self, field_name):
+
+        demo_org_uri = self.submit(self.get_demo_org_uri)
+        contribution_definitions_uri = self.submit(self.get_relationship_uri, BASE_URI, "contributionDefinitions")
+
+        def create_field_once_resolved():
+            self.gather(demo_org_uri, contribution_definitions_uri)
+            return self.create_field(field_name)
+
+        return self.submit(create_field_once_resolved)
+
+#############################################################################
@@ -0,0 +1,75 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import json
+import os
+import threading
+
+#############################################################################
+# Records which pieces of a long running job are done, in a JSON file, so a re-run after a crash
+# can skip them
+#
+# Every record() rewrites the file atomically (write a temp file, then rename it over the old one)
+# so the checkpoint on disk is always complete - never half written.
+
+class Checkpoint:
+
+    #############################################################################
+    def __init__(self, file_path):
+
+        self.file_path = file_path
+        self._completed = dict()
+        self._lock = threading.Lock()
+
+        self.load()
+
+    #############################################################################
+    # The value recorded for key - or None if it isn't done yet
+    def get(self, key):
+
+        with self._lock:
+            return self._completed.get(key)
+
+    #############################################################################
+    def record(self, key, value):
+
+        with self._lock:
+            self._completed[key] = value
+            self.save()
+
+    #############################################################################
+    def __len__(self):
+
+        with self._lock:
+            return len(self._completed)
+
+    #############################################################################
+    def load(self):
+
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+
+        try:
+            with open(self.file_path) as checkpoint_file:
+                completed = json.load(checkpoint_file)
+        except (IOError, OSError, ValueError):
+            # Unreadable checkpoint - start over rather than fail the job
+            return
+
+        with self._lock:
+            self._completed.update(completed)
+
+    #############################################################################
+    # Called with the lock held
+    def save(self):
+
+        if not self.file_path:
+            return
+
+        temp_file_path = "{}.{}".format(self.file_path, os.getpid())
+        with open(temp_file_path, 'w') as checkpoint_file:
+            json.dump(self._completed, checkpoint_file, indent=1, sort_keys=True)
+        os.rename(temp_file_path, self.file_path)
+
+#############################################################################
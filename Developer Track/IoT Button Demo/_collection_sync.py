@@ -0,0 +1,135 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import threading
+from collections import OrderedDict
+
+#############################################################################
+# Deere ETag constants - see the Best Practices notebook
+
+DEERE_SIGNATURE_HEADER = 'x-deere-signature'
+INITIAL_DEERE_SIGNATURE = 'nil'     # Asks the API to start tracking changes for a collection
+
+#############################################################################
+# The result of syncing a collection - the objects added/changed/removed since the last sync plus
+# the current contents (values) of the collection
+
+class CollectionDiff:
+
+    #############################################################################
+    def __init__(self, added, changed, removed, values):
+
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+        self.values = values
+
+    #############################################################################
+    def is_unchanged(self):
+        return not (self.added or self.changed or self.removed)
+
+#############################################################################
+# Keeps the last x-deere-signature and a snapshot for each synced collection uri
+#
+# The first sync of a collection (signature 'nil') returns the full collection. After that the API
+# answers 304 if nothing changed, or 200 with only the objects that changed since the signature
+# was issued - those are merged into the snapshot and reported as a CollectionDiff.
+
+class CollectionSync:
+
+    #############################################################################
+    def __init__(self):
+
+        self._collections = dict()
+        self._lock = threading.RLock()
+
+    #############################################################################
+    def get_signature(self, collection_uri):
+
+        with self._lock:
+            collection = self._collections.get(collection_uri)
+            return collection['signature'] if collection else INITIAL_DEERE_SIGNATURE
+
+    #############################################################################
+    # The collection hasn't changed (304) - answer from the snapshot
+    def apply_unchanged(self, collection_uri):
+
+        with self._lock:
+            collection = self._collections.get(collection_uri)
+            values = list(collection['snapshot'].values()) if collection else []
+
+        return CollectionDiff([], [], [], values)
+
+    #############################################################################
+    # Merge the objects returned with a 200 into the snapshot and store the new signature
+    def apply_changes(self, collection_uri, signature, changed_values):
+
+        added = []
+        changed = []
+        removed = []
+
+        with self._lock:
+            collection = self._collections.setdefault(collection_uri, {'signature': INITIAL_DEERE_SIGNATURE, 'snapshot': OrderedDict()})
+            snapshot = collection['snapshot']
+
+            for value in changed_values:
+                key = get_snapshot_key(value)
+
+                if is_removed_value(value):
+                    if key in snapshot:
+                        removed.append(snapshot.pop(key))
+                elif key not in snapshot:
+                    snapshot[key] = value
+                    added.append(value)
+                elif snapshot[key] != value:
+                    snapshot[key] = value
+                    changed.append(value)
+
+            # Only move the signature forward once the changes are in the snapshot
+            if signature:
+                collection['signature'] = signature
+
+            values = list(snapshot.values())
+
+        return CollectionDiff(added, changed, removed, values)
+
+    #############################################################################
+    # Forget an object we removed ourselves so that it isn't served from the snapshot
+    def remove_value(self, collection_uri, value):
+
+        with self._lock:
+            collection = self._collections.get(collection_uri)
+            if collection:
+                collection['snapshot'].pop(get_snapshot_key(value), None)
+
+    #############################################################################
+    def invalidate(self, collection_uri):
+
+        with self._lock:
+            self._collections.pop(collection_uri, None)
+
+#############################################################################
+# Objects are identified by their self link, falling back to their id
+# Objects can also be synced as resources (see _resources) - which have their links indexed already
+def get_snapshot_key(value):
+
+    if not isinstance(value, dict):
+        return value.get_link('self') or value.id
+
+    for link in value.get('links', []):
+        if link['rel'] == 'self':
+            return link['uri']
+
+    return value.get('id')
+
+#############################################################################
+# Changed objects which no longer exist come back flagged rather than missing
+def is_removed_value(value):
+
+    if not isinstance(value, dict):
+        return value.removed
+
+    return value.get('archived') is True or value.get('deleted') is True or value.get('status') in ('DELETED', 'ARCHIVED')
+
+#############################################################################
@@ -4,11 +4,13 @@
 
 import sys
 sys.path.insert(0, './python_modules')
-from requests_oauthlib.oauth1_session import OAuth1Session
+
+# Imported eagerly, unlike requests_oauthlib (see _transport.get_oauth_session) - every press sends
+# its requests through it and _transport/_request_scheduler use its classes, so deferring it would
+# only move its import from the container's startup into the first press
 import requests
 import datetime
 import os
-import pprint
 import json
 import logging
 import random
@@ -26,8 +28,11 @@ DEFAULT_LONGITUDE = "8.476208999999999"  # Used if Google Maps cannot resolve th
 
 GOOGLE_MAPS_KEY = 'UPDATE YOUR GOOGLE MAPS KEY HERE'
 
-# Root URI
-BASE_URI = 'https://sandboxapi.deere.com/platform/'
+# Root URI - MYJOHNDEERE_BASE_URI points the demo at another API (e.g. the fake server used by benchmark.py)
+BASE_URI = os.environ.get('MYJOHNDEERE_BASE_URI', 'https://sandboxapi.deere.com/platform/')
+
+# Google Maps geocoding endpoint
+GOOGLE_MAPS_GEOCODE_URI = os.environ.get('GOOGLE_MAPS_GEOCODE_URI', 'https://maps.googleapis.com/maps/api/geocode/json')
 
 # OAuth Constants
 CLIENT_KEY = 'UPDATE YOUR CLIENT APP CREDENTIALS HERE'
@@ -43,4 +48,87 @@ MAP_LAYER_CONTRIBUTION_DEFINITION = 'UPDATE YOUR CLIENT APP CONTRIBUTION CREDENT
 ASSET_CONTRIBUTION_DEFINITION = 'UPDATE YOUR CLIENT APP CONTRIBUTION CREDENTIALS HERE!'
 
 #############################################################################
+# Startup Constants
+
+# Build the sessions and logger and load the link bundle when a handler module is loaded (the Lambda
+# init phase) rather than on the first press - set MYJOHNDEERE_COLD_START_PRELOAD=0 to do it per press
+COLD_START_PRELOAD = os.environ.get('MYJOHNDEERE_COLD_START_PRELOAD', '1') != '0'
+
+# Links that don't change between deployments, seeded into the link cache of a cold container so its
+# first press doesn't have to fetch them - see _link_bundle and cold_start.py --write-link-bundle
+LINK_BUNDLE_FILE = os.environ.get('MYJOHNDEERE_LINK_BUNDLE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'link_bundle.json'))
+
+#############################################################################
+# Cache Constants
+
+LINK_CACHE_MAX_ENTRIES = 512
+LINK_CACHE_TTL_SECONDS = 60 * 60
+LINK_CACHE_FILE = "/tmp/myjohndeere_link_cache.json"  # Reused by warm Lambda containers - set to "" to only cache in memory
+
+RESOURCE_DIRECTORY_MAX_AGE_SECONDS = 15 * 60  # How long a local field/asset index is trusted before it is re-listed
+
+GEOCODE_CACHE_MAX_ENTRIES = 1024
+GEOCODE_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60       # Google Maps allows geocode results to be cached for up to 30 days
+GEOCODE_CACHE_NEGATIVE_TTL_SECONDS = 60 * 60        # Addresses that fell back to DEFAULT_LATITUDE/DEFAULT_LONGITUDE
+GEOCODE_CACHE_FILE = "/tmp/myjohndeere_geocode_cache.json"  # Set to "" to only cache in memory
+
+CREATED_RESOURCE_CACHE_MAX_ENTRIES = 1024
+CREATED_RESOURCE_CACHE_TTL_SECONDS = 24 * 60 * 60   # Locations of the fields/assets/map layer summaries we created
+CREATED_RESOURCE_CACHE_FILE = "/tmp/myjohndeere_created_resources.json"  # Set to "" to only cache in memory
+
+#############################################################################
+# Transport Constants
+
+TRANSPORT_DEFAULT_POOL_SIZE = 4     # Keep-alive connections per host for hosts not listed below
+
+TRANSPORT_HOST_POOL_SIZES = {
+    'sandboxapi.deere.com': 10,
+    'maps.googleapis.com': 2,
+}
+
+#############################################################################
+# Request Body Constants
+
+JSON_ENCODER = os.environ.get('MYJOHNDEERE_JSON_ENCODER', "auto")   # "auto" (ujson if it is installed) or "json" - see _json_encoding
+
+#############################################################################
+# Traversal Planning Constants
+
+# Ask for only the links (showLinks) the handlers follow - see _traversal_planner
+TRAVERSAL_PLANNER_ENABLED = os.environ.get('MYJOHNDEERE_TRAVERSAL_PLANNER', '1') != '0'
+TRAVERSAL_LISTED_LINKS_MAX_ENTRIES = 1024   # Listed resources whose links are kept, so following one doesn't need a GET
+
+#############################################################################
+# Outbox Constants
+
+# Record presses in a local outbox and acknowledge them straight away - they are replayed against the API in the
+# background (see _outbox). Set MYJOHNDEERE_OUTBOX=1 to turn it on
+OUTBOX_ENABLED = os.environ.get('MYJOHNDEERE_OUTBOX', '0') == '1'
+OUTBOX_FILE = os.environ.get('MYJOHNDEERE_OUTBOX_FILE', "/tmp/myjohndeere_outbox.sqlite")  # Put it on storage that outlives the container (e.g. EFS) to keep presses across cold starts
+
+#############################################################################
+# Request Scheduling Constants
+
+REQUEST_RATE_PER_SECOND = 10.0              # Sustained requests per second per host
+REQUEST_BURST_SIZE = 20                     # Requests per host that can be sent back to back
+REQUEST_MIN_RATE_PER_SECOND = 0.5           # Floor for the rate after repeated 429s
+REQUEST_RATE_RECOVERY_PER_SUCCESS = 0.5     # Rate added back for each successful request after a 429
+
+REQUEST_MAX_RETRIES = 5
+REQUEST_DEFAULT_RETRY_AFTER_SECONDS = 1.0   # Used when a 429 doesn't say how long to wait
+REQUEST_BACKOFF_BASE_SECONDS = 0.5          # 5xx/connection error backoff - doubled for every retry
+REQUEST_BACKOFF_MAX_SECONDS = 30.0
+REQUEST_DEADLINE_SECONDS = 25.0             # Time allowed for a request including all of its retries
+
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5       # Consecutive failures before we stop calling a host
+CIRCUIT_BREAKER_RESET_SECONDS = 30.0        # How long to stop calling it for
+
+#############################################################################
+# Tracing Constants
+
+TRACE_FILE = os.environ.get('MYJOHNDEERE_TRACE_FILE', "")              # Each invocation's span tree is appended here - "" to not export
+TRACE_FORMAT = os.environ.get('MYJOHNDEERE_TRACE_FORMAT', "jsonl")     # "jsonl" (a span per line) or "chrome" (chrome://tracing, Perfetto)
+LATENCY_HISTOGRAM_MAX_SAMPLES = 1000                                   # Most recent request times kept per endpoint
+
+#############################################################################
 
@@ -3,6 +3,25 @@
 # of the MIT license.  See the LICENSE file for details.
 
 from _common_setup import *
+from _persistent_cache import PersistentLRUCache
+from _resource_directory import ResourceDirectory
+from _collection_sync import CollectionSync, DEERE_SIGNATURE_HEADER
+from _transport import get_oauth_session, get_plain_session, get_connection_stats
+from _request_scheduler import RequestScheduler, RequestFailedError
+from _idempotent_create import IdempotentCreator
+from _notification_dispatcher import NotificationDispatcher, get_send_failure
+from _outbox import Outbox
+from _link_bundle import load_link_bundle, LINK_BUNDLE_CATALOG_RELATIONSHIPS, LINK_BUNDLE_ORGANIZATION_RELATIONSHIPS
+from _json_encoding import encode_json, PayloadTemplate, Slot
+from _json_stream import CollectionPageStream, JSON_STREAM_CHUNK_SIZE
+from _resources import Resource, Organization, Field, Notification
+from _traversal_planner import TraversalPlanner
+from _tracing import trace_request, record_response, on_body_read, record_body_read, record_cache_hit, bind_to_current_span, set_current_span_attributes, LATENCY_HISTOGRAMS
+from multiprocessing.pool import ThreadPool
+from contextlib import contextmanager
+import re
+import threading
+import time
 
 #############################################################################
 # HTTPS Request Header constants
@@ -26,64 +45,261 @@ FILE_RESOURCE_PUT_HEADER = {
 }
 
 #############################################################################
+# Payload templates - see _json_encoding.PayloadTemplate
 
-class DemoHelper:
+NOTIFICATION_PAYLOAD_TEMPLATE = PayloadTemplate({
+    "links": [
+        {
+            "rel": "source",
+            "uri": Slot('contribution_definition_uri')
+        }
+    ],
+    "eventAssociation": {
+        "links": [
+            {
+                "rel": "targetResource",
+                "uri": Slot('field_uri')
+            }
+        ]
+    },
+    "title": Slot('title'),
+    "text": Slot('text'),
+    "severity": Slot('severity'),
+    "eventType": Slot('event_type'),
+    "additionalDetails": [
+        {
+            "name": "some details",
+            "value": "some value"
+        }
+    ],
+    "timeRange": {
+        "startDate": Slot('start_date'),
+        "endDate": Slot('end_date')
+    }
+})
+
+#############################################################################
+# Collection paging constants
+
+COLLECTION_PAGE_SIZE = 100      # Largest page size the API allows
+COLLECTION_MAX_WORKERS = 4      # Upper bound on the number of pages requested in parallel
+
+#############################################################################
+# Notification cleanup constants
+
+NOTIFICATION_DELETE_MAX_WORKERS = 8     # Notification DELETEs sent at the same time
+
+#############################################################################
+# Batch constants
+
+BATCH_MAX_WORKERS = 8               # Button presses (or buttons) processed at the same time within a batch
+BATCH_SERIAL_NUMBER = 'BATCH'       # Logged for work that isn't specific to a single button
+
+#############################################################################
+# Traversal planning constants
+
+# The paths every handler follows - to the contribution definitions and notification events, and to
+# the field each notification is posted on
+DEMO_TRAVERSAL_PATHS = (('contributionDefinitions',), ('notificationEvents',), ('organizations', 'fields'))
+
+#############################################################################
+# Link cache constants
+
+# Statuses which tell us a cached link no longer points at a live resource
+STALE_LINK_STATUS_CODES = (404, 410)
+
+# Pseudo relationship used to cache the demo org found in the organization list
+DEMO_ORG_RELATIONSHIP = 'demoOrganization'
+
+# Keyed by (resource_uri, relationship) - lives at module level so it survives warm Lambda invocations
+LINK_CACHE = PersistentLRUCache(LINK_CACHE_MAX_ENTRIES, LINK_CACHE_TTL_SECONDS, LINK_CACHE_FILE)
+
+# Name -> uri indexes of the org's fields and assets - also kept across warm Lambda invocations
+RESOURCE_DIRECTORY = ResourceDirectory(RESOURCE_DIRECTORY_MAX_AGE_SECONDS)
+
+# Last x-deere-signature and snapshot of each synced collection
+COLLECTION_SYNC = CollectionSync()
+
+# Geocoded GPS coordinates keyed by normalized address
+GEOCODE_CACHE = PersistentLRUCache(GEOCODE_CACHE_MAX_ENTRIES, GEOCODE_CACHE_TTL_SECONDS, GEOCODE_CACHE_FILE)
+
+# Locations of the resources we created, keyed by (serial number, kind, title, collection uri)
+IDEMPOTENT_CREATOR = IdempotentCreator(PersistentLRUCache(CREATED_RESOURCE_CACHE_MAX_ENTRIES, CREATED_RESOURCE_CACHE_TTL_SECONDS, CREATED_RESOURCE_CACHE_FILE))
+
+# Rate limiting, retries and circuit breaking - shared by every thread so that they all back off together
+REQUEST_SCHEDULER = RequestScheduler()
+
+# showLinks for the links the handlers follow - each handler adds its own paths (see DemoHelper.plan_traversal)
+TRAVERSAL_PLANNER = TraversalPlanner(BASE_URI, TRAVERSAL_PLANNER_ENABLED, TRAVERSAL_LISTED_LINKS_MAX_ENTRIES)
+
+for traversal_path in DEMO_TRAVERSAL_PATHS:
+    TRAVERSAL_PLANNER.add_path(*traversal_path)
+
+#############################################################################
+
+class DemoHelper(object):
+
+    #############################################################################
+    def __init__(self):
+
+        # Worker threads processing a batch each work on behalf of their own button
+        self._thread_state = threading.local()
+        self._iot_button_serial_number = ""
+
+        # Coalesces the notifications queued by this helper's handler - see queue_notification
+        self.notification_dispatcher = NotificationDispatcher(self)
+
+        # Records the handler's presses to be replayed in the background, if it opens one - see open_outbox
+        self.outbox = None
+
+        # Handlers create their helper at module load - the Lambda init phase
+        self._prepared = False
+        if COLD_START_PRELOAD:
+            self.prepare()
+
+    #############################################################################
+    # The serial number of the button being processed on the current thread - falls back to the one given to setup()
+    @property
+    def iot_button_serial_number(self):
+        return getattr(self._thread_state, 'iot_button_serial_number', None) or self._iot_button_serial_number
+
+    @iot_button_serial_number.setter
+    def iot_button_serial_number(self, iot_button_serial_number):
+        self._iot_button_serial_number = iot_button_serial_number
+
+    #############################################################################
+    def set_thread_serial_number(self, iot_button_serial_number):
+        self._thread_state.iot_button_serial_number = iot_button_serial_number
 
     #############################################################################
     def setup(self, iot_button_serial_number):
 
-        # Setup the OAuth session
-        self.oauth_session = OAuth1Session(CLIENT_KEY, client_secret=CLIENT_SECRET,
-                                      resource_owner_key=OAUTH_TOKEN,
-                                      resource_owner_secret=OAUTH_TOKEN_SECRET)
+        self.prepare()
+
+        self.iot_button_serial_number = iot_button_serial_number
+        set_current_span_attributes(iot_button_serial_number=iot_button_serial_number)
+
+        # Note - the link cache is intentionally not reset here so that it outlives a single invocation
+        self.link_cache = LINK_CACHE
+        self.geocode_cache = GEOCODE_CACHE
+        self.resource_directory = RESOURCE_DIRECTORY
+        self.collection_sync = COLLECTION_SYNC
+        self.request_scheduler = REQUEST_SCHEDULER
+        self.idempotent_creator = IDEMPOTENT_CREATOR
+        self.traversal_planner = TRAVERSAL_PLANNER
+
+    #############################################################################
+    # Everything that is the same for every invocation - done once per container
+    def prepare(self):
+
+        if self._prepared:
+            return
+
+        # Setup the OAuth session - pooled and reused (along with its open connections) across warm invocations
+        self.oauth_session = get_oauth_session(CLIENT_KEY, CLIENT_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET)
+
+        # Session for the non-MyJohnDeere calls (Google Maps, demo images)
+        self.http_session = get_plain_session()
 
         # Setup the logger
         logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s')
         self.logger = logging.getLogger()
         self.logger.setLevel(logging.INFO)
 
-        self.iot_button_serial_number = iot_button_serial_number
-
         # For the purpose of this demo, avoid going through a proxy to avoid authentication requirements
         if 'https_proxy' in os.environ:
             os.environ.pop('https_proxy')
 
-        self.link_dictionary = dict()
+        # A cold container doesn't have to look up the catalog and organization links first
+        load_link_bundle(LINK_CACHE)
+
+        self._prepared = True
 
     #############################################################################
     # HTTPS GET Request Helper
-    def process_http_oauth_get_request(self, url, custom_text, expected_status=200):
-        return self.process_http_request(
-                    self.oauth_session.get(url, headers=DEFAULT_GET_REQUEST_HEADERS),
-                    custom_text,
-                    expected_status)
+    # With stream the body is only read when the caller reads it (e.g. see open_collection_page) - the
+    # caller must read it or close the response
+    def process_http_oauth_get_request(self, url, custom_text, expected_status=200, headers=DEFAULT_GET_REQUEST_HEADERS, stream=False):
+        http_response = self.send_scheduled_request('GET', url, lambda timeout: self.oauth_session.get(url, headers=headers, timeout=timeout, stream=stream), stream)
+        try:
+            return self.process_http_request(http_response, custom_text, expected_status)
+        except RequestFailedError:
+            # Nothing is going to read the body of a streamed response that failed - let its connection go
+            if stream:
+                http_response.close()
+            raise
+
+    #############################################################################
+    # HTTP(S) GET Request Helper for a url off the API (e.g. an upload source) - sent without OAuth,
+    # but scheduled, retried and traced like any other request. With stream the caller must read the
+    # body or close the response
+    def process_http_get_request(self, url, custom_text, expected_status=200, stream=False):
+        http_response = self.send_scheduled_request('GET', url, lambda timeout: self.http_session.get(url, timeout=timeout, stream=stream), stream)
+        try:
+            return self.process_http_request(http_response, custom_text, expected_status)
+        except RequestFailedError:
+            if stream:
+                http_response.close()
+            raise
 
     #############################################################################
     # HTTPS POST Request Helper
+    # body is encoded as compact JSON (see _json_encoding) - it can also be a filled PayloadTemplate
     def process_http_oauth_post_request(self, url, body, custom_text, expected_status=201):
+        data = encode_json(body)
         return self.process_http_request(
-                    self.oauth_session.post(url, headers=DEFAULT_POST_REQUEST_HEADERS, data=json.dumps(body, indent=4)),
+                    self.send_scheduled_request('POST', url, lambda timeout: self.oauth_session.post(url, headers=DEFAULT_POST_REQUEST_HEADERS, data=data, timeout=timeout)),
                     custom_text,
                     expected_status)
 
     #############################################################################
     # HTTPS PUT Request Helper
+    # body can also be a function returning the body - it is called for every attempt, so a stream
+    # (which can only be read once) is opened fresh whenever the request is retried
     def process_http_oauth_put_request(self, url, body, custom_text, expected_status=203):
+        get_body = body if callable(body) else lambda: body
         return self.process_http_request(
-                    self.oauth_session.put(url, headers=FILE_RESOURCE_PUT_HEADER, data=body),
+                    self.send_scheduled_request('PUT', url, lambda timeout: self.oauth_session.put(url, headers=FILE_RESOURCE_PUT_HEADER, data=get_body(), timeout=timeout)),
                     custom_text,
                     expected_status)
 
     #############################################################################
     # HTTPS DELETE Request Helper
     def process_http_oauth_delete_request(self, url, custom_text, expected_status=204):
-        return self.process_http_request(
-                    self.oauth_session.delete(url, headers=DEFAULT_DELETE_REQUEST_HEADERS),
+        http_response = self.process_http_request(
+                    self.send_scheduled_request('DELETE', url, lambda timeout: self.oauth_session.delete(url, headers=DEFAULT_DELETE_REQUEST_HEADERS, timeout=timeout)),
                     custom_text,
                     expected_status)
 
+        # Keep the local field/asset indexes in step with our own deletes
+        self.resource_directory.remove_uri(url)
+        self.idempotent_creator.forget_uri(url)
+
+        return http_response
+
+    #############################################################################
+    # Send a request through the request scheduler - traced, with its time recorded against its endpoint.
+    # The bytes of a GET count towards the traversal planner's stats - for a streamed response, the
+    # ones decoded once it has been read
+    def send_scheduled_request(self, method, url, send_request, streamed=False):
+
+        with trace_request(method, url) as request_span:
+            http_response = self.request_scheduler.send(url, send_request, idempotent=(method != 'POST'))
+            record_response(request_span, http_response, streamed)
+
+        if method == 'GET':
+            record_bytes_received = lambda bytes_received: self.traversal_planner.record_response(url, bytes_received)
+            if streamed:
+                on_body_read(http_response, record_bytes_received)
+            else:
+                record_bytes_received(len(http_response.content or ''))
+
+        return http_response
+
     #############################################################################
     # Generic HTTPS Request Helper
+    # Note - expected_status can also be a tuple of acceptable statuses
+    # Raises a RequestFailedError if the response doesn't have the expected status (after any retries)
     def process_http_request(self, http_response, custom_text, expected_status):
 
         result_string = "{}:{} - {} - {} - {}".format( \
@@ -93,16 +309,408 @@ class DemoHelper:
             http_response.reason, \
             custom_text)
 
-        if expected_status == http_response.status_code:
+        if http_response.status_code in (expected_status if isinstance(expected_status, tuple) else (expected_status,)):
             log_message = "{} - SUCCESS - {}".format(self.iot_button_serial_number, result_string)
             self.logger.info(log_message)
         else:
             log_message = "{} - ERROR   - {}".format(self.iot_button_serial_number, result_string)
             self.logger.info(log_message)
-            exit(log_message)
+
+            # Don't let a later invocation follow a link to a resource that is gone
+            # (the uri it is known by is without the query a planned request adds - see plan_traversal)
+            if http_response.status_code in STALE_LINK_STATUS_CODES:
+                stale_uri = vars(http_response.request)['url'].split('?')[0]
+                self.invalidate_links(stale_uri)
+                self.resource_directory.remove_uri(stale_uri)
+                self.idempotent_creator.forget_uri(stale_uri)
+
+            raise RequestFailedError(log_message, http_response)
 
         return http_response
 
+    #############################################################################
+    # Call function(item) for every item on a bounded thread pool, on behalf of the current button
+    #
+    # A failing item doesn't stop the others - returns a (result, failure) pair for every item, in
+    # the order given, where failure is the exception raised (or None).
+    def map_concurrently(self, function, items, max_workers):
+
+        items = list(items)
+        if not items:
+            return []
+
+        iot_button_serial_number = self.iot_button_serial_number
+
+        @bind_to_current_span
+        def call_for_item(item):
+            self.set_thread_serial_number(iot_button_serial_number)
+            try:
+                return (function(item), None)
+            except Exception as failure:
+                return (None, failure)
+            finally:
+                self.set_thread_serial_number(None)
+
+        with finishing_thread_pool(min(max_workers, len(items))) as thread_pool:
+            return thread_pool.map(call_for_item, items)
+
+    #############################################################################
+    # Process a batch of button press events - e.g. an SQS event whose Records each carry a
+    # {serialNumber, clickType} body, or simply a list of press events
+    #
+    # The presses are grouped by serial number. prepare_button(serial_number) is called once per
+    # button to resolve whatever its presses share (e.g. its field) and process_press(press_event,
+    # prepared) once per press, all on a bounded worker pool. If ordered is set, each button's
+    # presses are processed one after the other (still in parallel with other buttons) - and once one
+    # of them fails the button's later presses fail too, so that they are redelivered after it.
+    #
+    # The notifications the presses queue are sent before returning - a press whose notification
+    # couldn't be sent has failed, even though process_press returned.
+    #
+    # Returns the outcome of every record, plus the SQS partial batch response (batchItemFailures)
+    # so that only the failed records are redelivered.
+    def process_event_batch(self, batch_event, prepare_button, process_press, ordered=False, max_workers=BATCH_MAX_WORKERS):
+
+        batch_records = get_batch_records(batch_event)
+
+        records_by_serial_number = dict()
+        for batch_record in batch_records:
+            records_by_serial_number.setdefault(batch_record['press_event']['serialNumber'], []).append(batch_record)
+
+        self.logger.info("{} - Batch of {} press events received for {} buttons".format(
+            self.iot_button_serial_number, len(batch_records), len(records_by_serial_number)))
+
+        # Resolve the links every press needs once for the whole batch, rather than once per worker
+        self.get_demo_org_uri()
+        self.get_relationship_uri(BASE_URI, "contributionDefinitions")
+
+        results = dict()
+        queued_notifications_by_record_id = dict()
+
+        @bind_to_current_span
+        def run_for_button(serial_number, function, *args):
+            self.set_thread_serial_number(serial_number)
+            try:
+                return function(*args)
+            finally:
+                self.set_thread_serial_number(None)
+
+        def process_record(batch_record, prepared):
+            try:
+                if isinstance(prepared, Exception):
+                    raise prepared
+                self.take_queued_notifications()
+                run_for_button(batch_record['press_event']['serialNumber'], process_press, batch_record['press_event'], prepared)
+                results[batch_record['record_id']] = {'itemIdentifier': batch_record['record_id'], 'status': 'SUCCESS'}
+            except Exception as failure:
+                fail_record(batch_record, failure)
+            finally:
+                queued_notifications_by_record_id[batch_record['record_id']] = self.take_queued_notifications()
+
+        def fail_record(batch_record, failure):
+            self.logger.info("{} - ERROR   - Press event {} failed - {}".format(
+                batch_record['press_event']['serialNumber'], batch_record['record_id'], failure))
+            results[batch_record['record_id']] = {'itemIdentifier': batch_record['record_id'], 'status': 'FAILED', 'error': str(failure)}
+
+        def prepare(serial_number):
+            try:
+                return run_for_button(serial_number, prepare_button, serial_number)
+            except Exception as failure:
+                # Every press for this button fails with the same error
+                return failure
+
+        def process_button(serial_number):
+            prepared = prepare(serial_number)
+            for batch_record in records_by_serial_number[serial_number]:
+                process_record(batch_record, prepared)
+
+                if results[batch_record['record_id']]['status'] != 'SUCCESS' and not isinstance(prepared, Exception):
+                    prepared = RequestFailedError("An earlier press of {} failed".format(serial_number))
+
+        with finishing_thread_pool(max(min(max_workers, len(batch_records)), 1)) as thread_pool:
+            if ordered:
+                thread_pool.map(process_button, records_by_serial_number.keys())
+            else:
+                serial_numbers = records_by_serial_number.keys()
+                prepared_by_serial_number = dict(zip(serial_numbers, thread_pool.map(prepare, serial_numbers)))
+                thread_pool.map(lambda batch_record: process_record(batch_record, prepared_by_serial_number[batch_record['press_event']['serialNumber']]),
+                                batch_records)
+
+        # Send the presses' (merged) notifications, and fail the presses whose notification wasn't sent
+        if any(queued_notifications_by_record_id.values()):
+            if not self.notification_dispatcher.flush():
+                self.logger.info("{} - ERROR   - Timed out sending queued notifications".format(self.iot_button_serial_number))
+
+            for batch_record in batch_records:
+                send_failure = get_send_failure(queued_notifications_by_record_id[batch_record['record_id']])
+                if send_failure is not None and results[batch_record['record_id']]['status'] == 'SUCCESS':
+                    fail_record(batch_record, RequestFailedError("Could not send notification - {}".format(send_failure)))
+
+        record_results = [results[batch_record['record_id']] for batch_record in batch_records]
+
+        return {
+            'results': record_results,
+            'batchItemFailures': [{'itemIdentifier': result['itemIdentifier']} for result in record_results if result['status'] != 'SUCCESS'],
+        }
+
+    #############################################################################
+    # With OUTBOX_ENABLED, have the handler's presses recorded and acknowledged straight away, then
+    # replayed in the background - see _outbox. replay_batch(batch_event) is the handler's own batch
+    # path, called with an SQS style batch of the recorded presses. get_compaction_key(press_event)
+    # names what a press supersedes the earlier presses of its button for (None for nothing).
+    def open_outbox(self, kind, replay_batch, get_compaction_key=None):
+
+        if not OUTBOX_ENABLED:
+            return
+
+        def replay_as_batch(batch_event):
+            self.set_thread_serial_number(BATCH_SERIAL_NUMBER)
+            try:
+                return replay_batch(batch_event)
+            finally:
+                self.set_thread_serial_number(None)
+
+        self.outbox = Outbox(self, OUTBOX_FILE, kind, replay_as_batch, get_compaction_key)
+
+    #############################################################################
+    # Record a press event (or a batch of them) in the outbox - returns what the handler returns for it
+    #
+    # Each press is stamped with when it was pressed (pressedAt), as it may be replayed a good while later.
+    def record_in_outbox(self, event):
+
+        start_time = time.time()
+        pressed_at = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+        batch_records = get_batch_records(event) if is_batch_event(event) else [{'record_id': None, 'press_event': event}]
+        press_events = [dict(batch_record['press_event'], pressedAt=batch_record['press_event'].get('pressedAt', pressed_at)) for batch_record in batch_records]
+
+        compacted_count = self.outbox.append(press_events)
+
+        self.logger.info("{} - Outbox - {} press events recorded in {:.1f} ms - {} earlier presses superseded".format(
+            self.iot_button_serial_number, len(press_events), (time.time() - start_time) * 1000.0, compacted_count))
+
+        if not is_batch_event(event):
+            return 'SUCCESS'
+
+        return {
+            'results': [{'itemIdentifier': batch_record['record_id'], 'status': 'SUCCESS'} for batch_record in batch_records],
+            'batchItemFailures': [],
+        }
+
+    #############################################################################
+    # Declare a path of links the handler follows - the relationships followed one after the other from
+    # the API catalog, e.g. ('organizations', 'fields', 'mapLayerSummaries'). The GETs along it then only
+    # ask for the links it needs (showLinks) - see _traversal_planner.
+    def plan_traversal(self, *relationships):
+
+        TRAVERSAL_PLANNER.add_path(*relationships)
+
+    #############################################################################
+    # Log how many requests so far asked for only the links they needed (and the bytes received for
+    # them), the bytes received for the requests without a plan, and how many requests weren't needed at all
+    def log_traversal_plan_stats(self):
+
+        traversal_plan_stats = self.traversal_planner.get_stats()
+        self.logger.info("{} - Traversal plan - {} planned requests, {} bytes received ({:.0f} per request) - "
+                         "{} unplanned requests, {} bytes received ({:.0f} per request) - {} requests saved by listed links".format(
+            self.iot_button_serial_number,
+            traversal_plan_stats['planned_requests'],
+            traversal_plan_stats['planned_bytes'],
+            float(traversal_plan_stats['planned_bytes']) / traversal_plan_stats['planned_requests'] if traversal_plan_stats['planned_requests'] else 0.0,
+            traversal_plan_stats['unplanned_requests'],
+            traversal_plan_stats['unplanned_bytes'],
+            float(traversal_plan_stats['unplanned_bytes']) / traversal_plan_stats['unplanned_requests'] if traversal_plan_stats['unplanned_requests'] else 0.0,
+            traversal_plan_stats['requests_saved']))
+
+    #############################################################################
+    # Log how many requests so far were able to reuse an already open connection
+    def log_connection_stats(self):
+
+        connection_stats = get_connection_stats()
+        self.logger.info("{} - Connections - {} requests - {} new connections - {} reused".format(
+            self.iot_button_serial_number,
+            connection_stats['requests'],
+            connection_stats['new_connections'],
+            connection_stats['reused_connections']))
+
+    #############################################################################
+    # Log the p50/p95/p99 request times of every endpoint called so far (across warm invocations)
+    def log_latency_histograms(self):
+
+        for endpoint, percentiles in sorted(LATENCY_HISTOGRAMS.get_percentiles().items()):
+            self.logger.info("{} - Latency - {} - {} requests - p50 {:.0f} ms - p95 {:.0f} ms - p99 {:.0f} ms".format(
+                self.iot_button_serial_number, endpoint, percentiles['count'], percentiles['p50'], percentiles['p95'], percentiles['p99']))
+
+    #############################################################################
+    # Drop any cached link that was resolved from, or points at, the given uri
+    def invalidate_links(self, uri):
+
+        # Strip matrix (;count=100) and query parameters so we match the uri as it was cached
+        resource_uri = uri.split('?')[0].split(';')[0]
+
+        invalidated_count = self.link_cache.invalidate_matching(
+            lambda key, value: key[0] == resource_uri or value == resource_uri)
+        self.traversal_planner.forget(resource_uri)
+
+        if invalidated_count > 0:
+            self.logger.info("{} - Invalidated {} cached link(s) for - {}".format(self.iot_button_serial_number, invalidated_count, resource_uri))
+
+    #############################################################################
+    # Lazily yield every value of a collection across all of its pages
+    #
+    # When the collection reports its total, the remaining pages are requested in parallel
+    # (bounded by max_workers) as soon as the first page arrives. Otherwise the nextPage links are
+    # followed, with the next page prefetched on a background thread while the caller consumes
+    # the current one. Values are always yielded in collection order, and closing the generator
+    # early (e.g. breaking out of a for loop) stops any pages that haven't been requested yet.
+    # Pass first_page if the first page has already been retrieved (or opened).
+    #
+    # The first page is decoded as it arrives, so its first values are yielded before the rest of it
+    # has been read - see open_collection_page. With a resource_type (see _resources) the values are
+    # yielded as resources of that type rather than dicts.
+    def iterate_collection_values(self, collection_uri, custom_text, page_size=COLLECTION_PAGE_SIZE, max_workers=COLLECTION_MAX_WORKERS,
+                                  headers=DEFAULT_GET_REQUEST_HEADERS, first_page=None, resource_type=None):
+
+        if first_page is None:
+            first_page = self.open_collection_page(build_collection_page_uri(collection_uri, 0, page_size), custom_text, headers, resource_type)
+
+        try:
+            for value in self._iterate_collection_pages(collection_uri, custom_text, page_size, max_workers, headers, first_page, resource_type):
+                yield value
+        finally:
+            if isinstance(first_page, CollectionPageStream):
+                first_page.close()
+
+    #############################################################################
+    def _iterate_collection_pages(self, collection_uri, custom_text, page_size, max_workers, headers, first_page, resource_type):
+
+        total = first_page.get('total')
+
+        if total is not None:
+            remaining_page_uris = [build_collection_page_uri(collection_uri, start, page_size) for start in range(page_size, total, page_size)]
+            worker_count = min(max_workers, len(remaining_page_uris))
+        else:
+            remaining_page_uris = []
+            worker_count = 1 if get_link(first_page, 'nextPage') else 0
+
+        if worker_count < 1:
+            for value in first_page['values']:
+                yield value
+            return
+
+        with finishing_thread_pool(worker_count) as thread_pool:
+            if total is not None:
+
+                # Fan out the start=/count= windows - imap hands back the pages in order
+                pending_pages = thread_pool.imap(bind_to_current_span(lambda page_uri: self.get_collection_page(page_uri, custom_text, headers, resource_type)), remaining_page_uris)
+
+                for value in first_page['values']:
+                    yield value
+
+                for page in pending_pages:
+                    for value in page['values']:
+                        yield value
+            else:
+
+                # Follow the nextPage links - always keep one page in flight
+                page = first_page
+                while page is not None:
+                    next_page_uri = get_link(page, 'nextPage')
+                    pending_page = thread_pool.apply_async(bind_to_current_span(self.get_collection_page), (next_page_uri, custom_text, headers, resource_type)) if next_page_uri else None
+
+                    for value in page['values']:
+                        yield value
+
+                    page = pending_page.get() if pending_page else None
+
+    #############################################################################
+    # GET a single page of a collection as JSON - with a resource_type, its values are resources of that type
+    def get_collection_page(self, page_uri, custom_text, headers=DEFAULT_GET_REQUEST_HEADERS, resource_type=None):
+        return self.open_collection_page(page_uri, custom_text, headers, resource_type).read()
+
+    #############################################################################
+    # GET a page of a collection to be decoded as it arrives - see _json_stream.CollectionPageStream
+    # The caller must read it to the end or close it
+    def open_collection_page(self, page_uri, custom_text, headers=DEFAULT_GET_REQUEST_HEADERS, resource_type=None):
+        return open_collection_page_stream(self.process_http_oauth_get_request(self.traversal_planner.plan(page_uri), custom_text, headers=headers, stream=True),
+                                           resource_type)
+
+    #############################################################################
+    # The first value of a collection that matches - the pages are requested one at a time and decoded
+    # as they arrive, and nothing more is read once a value matches. With a resource_type, matches is
+    # given (and this returns) resources of that type. Returns None if no value matches.
+    def find_collection_value(self, collection_uri, matches, custom_text, resource_type=None, page_size=COLLECTION_PAGE_SIZE):
+
+        page_uri = build_collection_page_uri(collection_uri, 0, page_size)
+
+        while page_uri:
+            page = self.open_collection_page(page_uri, custom_text, resource_type=resource_type)
+            try:
+                for value in page['values']:
+                    if matches(value):
+                        return value
+
+                page_uri = get_link(page, 'nextPage')
+            finally:
+                page.close()
+
+        return None
+
+    #############################################################################
+    # Bring our snapshot of a collection up to date using the Deere ETag (x-deere-signature)
+    #
+    # Returns a CollectionDiff - if the API answers 304 the diff is empty and the values come
+    # straight from the snapshot, otherwise only the objects that changed are applied to it.
+    # With a resource_type, the snapshot holds resources of that type - a collection must always be
+    # synced as the same type.
+    def sync_collection(self, collection_uri, custom_text, page_size=COLLECTION_PAGE_SIZE, resource_type=None):
+
+        signature_headers = dict(DEFAULT_GET_REQUEST_HEADERS)
+        signature_headers[DEERE_SIGNATURE_HEADER] = self.collection_sync.get_signature(collection_uri)
+
+        http_response = self.process_http_oauth_get_request(self.traversal_planner.plan(build_collection_page_uri(collection_uri, 0, page_size)), custom_text,
+                                                            (200, 304), signature_headers, stream=True)
+
+        if http_response.status_code == 304:
+            http_response.close()
+            record_cache_hit('collection_sync', collection_uri)
+            return self.collection_sync.apply_unchanged(collection_uri)
+
+        changed_values = list(self.iterate_collection_values(collection_uri, custom_text, page_size, headers=signature_headers,
+                                                             first_page=open_collection_page_stream(http_response, resource_type), resource_type=resource_type))
+
+        return self.collection_sync.apply_changes(collection_uri, http_response.headers.get(DEERE_SIGNATURE_HEADER), changed_values)
+
+    #############################################################################
+    # Find the self uri of the resource with the given name (or title - see the resource_type's name_key)
+    # in a collection
+    #
+    # The collection is synced the first time it is used and indexed locally, after that a lookup is
+    # a local probe. Re-syncing a stale index only downloads what changed (if anything).
+    # Returns "" if there is no such resource.
+    def find_resource_uri(self, collection_uri, resource_type, name, custom_text):
+
+        if not self.resource_directory.is_populated(collection_uri):
+            resources = self.sync_collection(collection_uri, custom_text, resource_type=resource_type).values
+            self.resource_directory.populate(collection_uri, [(getattr(resource, resource_type.name_key), resource.get_link('self')) for resource in resources])
+
+            # Following a link from one of them later doesn't need a GET of it - if the plan listed its links
+            for resource in resources:
+                self.traversal_planner.remember_listed_links(resource)
+        else:
+            record_cache_hit('resource_directory', collection_uri)
+
+        return self.resource_directory.lookup(collection_uri, name)
+
+    #############################################################################
+    # Create a resource in collection_uri only once per button - create() is called at most once
+    # (concurrent callers wait for it) and the uri it returns is reused by every later call
+    def create_or_get(self, kind, title, collection_uri, create):
+
+        client_key = (self.iot_button_serial_number, kind, title, collection_uri)
+
+        return self.idempotent_creator.create_or_get(client_key, create)
+
     #############################################################################
     # For the purpose of this demo - lets just key off the first organization
     # Note - that you can override the org with the ORG_OVERRIDE constant
@@ -113,16 +721,19 @@ class DemoHelper:
 
         if "" == ORG_OVERRIDE:
 
-            http_response = self.process_http_oauth_get_request(organizations_uri, "Getting list of orgs")
-            json_response = http_response.json()
+            # The demo org is resolved on almost every call - reuse the one we found last time if we can
+            demo_org_link = self.link_cache.get((organizations_uri, DEMO_ORG_RELATIONSHIP)) or ""
 
-            # Return the first org found
-            if json_response['total'] > 0:
-                link_list = json_response['values'][0]['links']
-                for link in link_list:
-                    if link['rel'] == 'self':
-                        demo_org_link = link['uri']
-                        break
+            if not demo_org_link:
+
+                # Return the first org found - only the first one is requested
+                demo_org = self.find_collection_value(organizations_uri, lambda organization: True, "Getting list of orgs", Organization, 1)
+                if demo_org is not None:
+                    demo_org_link = demo_org.get_link('self')
+                    self.traversal_planner.remember_listed_links(demo_org)
+
+                if demo_org_link:
+                    self.link_cache.put((organizations_uri, DEMO_ORG_RELATIONSHIP), demo_org_link)
         else:
             demo_org_link = "{}/{}".format(organizations_uri, str(ORG_OVERRIDE))
 
@@ -131,42 +742,72 @@ class DemoHelper:
     #################################################, ############################
     def get_relationship_uri(self, resource_uri, relationship):
 
-        relationship_link = ""
-
-        # First check to see if we already have the relationship uri in cached in our dictionary
-        if self.link_dictionary.has_key(resource_uri):
-            if self.link_dictionary[resource_uri].has_key(relationship):
-                relationship_link = self.link_dictionary[resource_uri][relationship]
-        else:
-            self.link_dictionary[resource_uri] = dict()
+        # First check to see if we already have the relationship uri cached - possibly from a previous invocation
+        relationship_link = self.link_cache.get((resource_uri, relationship)) or ""
+        if relationship_link:
+            record_cache_hit('link', relationship)
 
-        # If we couldn't find a cached relationship link - go find it...
+        # If we couldn't find a cached relationship link - go find it (unless the resource was listed with it)...
         if relationship_link == "":
 
-            http_response = self.process_http_oauth_get_request(resource_uri, "Getting relationship links")
-            json_response = http_response.json()
+            links = self.traversal_planner.links_listed(resource_uri, relationship)
+            if links is not None:
+                record_cache_hit('listed_link', relationship)
+            else:
+                http_response = self.process_http_oauth_get_request(self.traversal_planner.plan(resource_uri, (relationship,)), "Getting relationship links")
+                links = Resource.from_json(http_response.json()).links
 
-            if json_response['links'] > 0:
-                link_list = json_response['links']
-                for link in link_list:
-                    if link['rel'] == relationship:
-                        relationship_link = link['uri']
-                        break
+            # Cache every link on the resource - the other relationships are usually needed soon after
+            self.link_cache.put_many([((resource_uri, rel), uri) for rel, uri in links.items()])
+            relationship_link = links.get(relationship, "")
 
-        if relationship_link != "":
-            self.link_dictionary[resource_uri][relationship] = relationship_link
-        else:
+        if relationship_link == "":
             log_message = "{} - ERROR   - Could not find relationship link for - {}:{}".format(self.iot_button_serial_number, resource_uri, relationship)
             self.logger.info(log_message)
-            exit(log_message)
+            raise RequestFailedError(log_message)
 
         return relationship_link
 
     #############################################################################
+    # Resolve the links worth shipping in the link bundle - see _link_bundle and cold_start.py
+    def resolve_link_bundle(self):
+
+        links = [[BASE_URI, relationship, self.get_relationship_uri(BASE_URI, relationship)] for relationship in LINK_BUNDLE_CATALOG_RELATIONSHIPS]
+
+        demo_org_uri = self.get_demo_org_uri()
+        if "" == ORG_OVERRIDE:
+            links.append([self.get_relationship_uri(BASE_URI, 'organizations'), DEMO_ORG_RELATIONSHIP, demo_org_uri])
+
+        links.extend([demo_org_uri, relationship, self.get_relationship_uri(demo_org_uri, relationship)] for relationship in LINK_BUNDLE_ORGANIZATION_RELATIONSHIPS)
+
+        return links
+
+    #############################################################################
+    # Cache the links that came with a listed resource under its self uri, so that following one of
+    # them later doesn't need another GET - returns the self uri ("" if the resource has none)
+    def cache_links(self, resource):
+
+        self_uri = resource.get_link('self')
+
+        if self_uri:
+            self.link_cache.put_many([((self_uri, rel), uri) for rel, uri in resource.links.items()])
+
+        return self_uri
+
+    #############################################################################
+    # The demo only ever geocodes a handful of fixed locations - answer from the cache where we can
     def determine_gps_coordinates(self, location):
 
-        url = "https://maps.googleapis.com/maps/api/geocode/json?address={}&key={}".format(location, GOOGLE_MAPS_KEY)
-        http_response = self.process_http_request(requests.get(url), "GPS coordinates retrieved from GoogleMaps", 200)
+        cache_key = ('geocode', normalize_address(location))
+        gps = self.geocode_cache.get(cache_key)
+        if gps is not None:
+            record_cache_hit('geocode', location)
+            return dict(gps)
+
+        url = "{}?address={}&key={}".format(GOOGLE_MAPS_GEOCODE_URI, location, GOOGLE_MAPS_KEY)
+        http_response = self.process_http_request(
+            self.send_scheduled_request('GET', url, lambda timeout: self.http_session.get(url, timeout=timeout)),
+            "GPS coordinates retrieved from GoogleMaps", 200)
         json_response = http_response.json()
 
         if len(json_response['results']) > 0 and \
@@ -174,39 +815,53 @@ class DemoHelper:
                 json_response['results'][0]['geometry']['location']['lng']:
             latitude = str(json_response['results'][0]['geometry']['location']['lat'])
             longitude = str(json_response['results'][0]['geometry']['location']['lng'])
+            cache_ttl_seconds = GEOCODE_CACHE_TTL_SECONDS
         else:
-            self.logger.info("{} - ERROR   - Could not lookup GPS coordinate for {} - using default location".format(iot_button.serial_number, location))
+            self.logger.info("{} - ERROR   - Could not lookup GPS coordinate for {} - using default location".format(self.iot_button_serial_number, location))
             location = "Default location"
             latitude = DEFAULT_LATITUDE
             longitude = DEFAULT_LONGITUDE
-            print json.dumps(json_response, indent=4)
+            self.logger.debug("{} - Geocode response - {}".format(self.iot_button_serial_number, json.dumps(json_response)))
+
+            # Negative cache - retry the address sooner than one that resolved
+            cache_ttl_seconds = GEOCODE_CACHE_NEGATIVE_TTL_SECONDS
 
         #self.logger.info("{} - {} GPS Coordinates - {}, {}".format(self.iot_button_serial_number, location, latitude, longitude))
 
-        return {"lat":latitude, "lon":longitude}
+        gps = {"lat":latitude, "lon":longitude}
+        self.geocode_cache.put(cache_key, dict(gps), cache_ttl_seconds)
+
+        return gps
+
+    #############################################################################
+    # Geocode several locations up front (in parallel) so that later presses are served from the cache
+    def prewarm_geocode_cache(self, locations, max_workers=COLLECTION_MAX_WORKERS):
+
+        uncached_locations = [location for location in set(locations)
+                              if self.geocode_cache.get(('geocode', normalize_address(location))) is None]
+
+        if uncached_locations:
+            with finishing_thread_pool(min(max_workers, len(uncached_locations))) as thread_pool:
+                thread_pool.map(bind_to_current_span(self.determine_gps_coordinates), uncached_locations)
+
+        return len(uncached_locations)
 
     #############################################################################
     def create_field(self, field_name):
 
-        field_uri = ""
         expanded_field_name = "Field - {}".format(field_name)
 
         # Get the list of fields for this org
         fields_uri = self.get_relationship_uri(self.get_demo_org_uri(), "fields")
-        http_response = self.process_http_oauth_get_request(fields_uri + ';count=100', "Field list retrieved")
-        json_response = http_response.json()
+
+        return self.create_or_get("fields", expanded_field_name, fields_uri,
+                                  lambda: self.find_or_post_field(fields_uri, expanded_field_name))
+
+    #############################################################################
+    def find_or_post_field(self, fields_uri, expanded_field_name):
 
         # Check to see if the field already exists
-        if json_response['total'] > 0:
-            field_list = json_response['values']
-            for field in field_list:
-                if field['name'] == expanded_field_name:
-                    if field['links'] > 0:
-                        link_list = field['links']
-                        for link in link_list:
-                            if link['rel'] == "self":
-                                field_uri = link['uri']
-                                break
+        field_uri = self.find_resource_uri(fields_uri, Field, expanded_field_name, "Field list retrieved")
 
         # If the field doesn't exist - create it
         if not field_uri:
@@ -232,6 +887,7 @@ class DemoHelper:
             # Post the new field - retrieve the GUID from the header
             http_response = self.process_http_oauth_post_request(fields_uri, body, "Field created")
             field_uri = http_response.headers['Location']
+            self.resource_directory.add(fields_uri, expanded_field_name, field_uri)
 
 
         return field_uri
@@ -248,57 +904,196 @@ class DemoHelper:
         start_date = datetime.datetime.utcnow()
         end_date = start_date + datetime.timedelta(days=1)
 
-        body = {
-            "links": [
-                {
-                    "rel": "source",
-                    "uri": notification_contribution_definition_uri
-                }
-            ],
-            "eventAssociation": {
-                "links": [
-                    {
-                        "rel": "targetResource",
-                        "uri": field_uri
-                    }
-                ]
-            },
-            "title": notification_title,
-            "text": notification_details['text'],
-            "severity": notification_details['severity'],
-            "eventType": notification_details['type'],
-            "additionalDetails": [
-                {
-                    "name": "some details",
-                    "value": "some value"
-                }
-            ],
-            "timeRange": {
-                "startDate": start_date.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-                "endDate": end_date.strftime("%Y-%m-%dT%H:%M:%S.000Z")
-            }
-        }
+        body = NOTIFICATION_PAYLOAD_TEMPLATE.fill(
+            contribution_definition_uri=notification_contribution_definition_uri,
+            field_uri=field_uri,
+            title=notification_title,
+            text=notification_details['text'],
+            severity=notification_details['severity'],
+            event_type=notification_details['type'],
+            start_date=start_date.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            end_date=end_date.strftime("%Y-%m-%dT%H:%M:%S.000Z"))
 
         # Post the notification for the given field
         notification_events_uri = self.get_relationship_uri(BASE_URI, 'notificationEvents')
         self.process_http_oauth_post_request(notification_events_uri, body, "Notification created")
 
     #################################################################################
-    def delete_notifications(self, notification_title):
+    # Queue a notification to be sent in the background - identical notifications queued close
+    # together are merged into one (see NotificationDispatcher). Call flush_notifications before
+    # the handler returns.
+    #
+    # The notification is remembered for the thread that queued it, so that flush_notifications (or
+    # process_event_batch, for a press) can fail if it wasn't sent.
+    def queue_notification(self, field_uri, notification_title, notification_details):
+
+        queued_notification = self.notification_dispatcher.queue(field_uri, notification_title, notification_details)
+        self._thread_state.queued_notifications = self.take_queued_notifications() + [queued_notification]
+
+    #################################################################################
+    # The notifications this thread queued since it last took them
+    def take_queued_notifications(self):
+
+        queued_notifications = getattr(self._thread_state, 'queued_notifications', None) or []
+        self._thread_state.queued_notifications = []
+        return queued_notifications
+
+    #################################################################################
+    # Send everything queued - raises if a notification this thread queued wasn't sent. A single press
+    # calls it straight after queueing, so its notification isn't merged with other presses' (see
+    # _notification_dispatcher)
+    def flush_notifications(self):
+
+        queued_notifications = self.take_queued_notifications()
+
+        if not self.notification_dispatcher.flush():
+            self.logger.info("{} - ERROR   - Timed out sending queued notifications".format(self.iot_button_serial_number))
+
+        send_failure = get_send_failure(queued_notifications)
+        if send_failure is not None:
+            raise RequestFailedError("Could not send notification - {}".format(send_failure))
+
+    #################################################################################
+    # Delete every active notification matching all of the filters given:
+    #
+    #   notification_title - part of the title
+    #   severity           - LOW, MEDIUM or HIGH
+    #   created_after/created_before - ISO 8601 UTC strings (e.g. "2018-10-17T00:00:00.000Z") compared
+    #                        with the start of the notification's time range
+    #
+    # Every page of notifications is synced (only what changed since the last sync is downloaded)
+    # and the DELETEs are sent max_workers at a time. With dry_run nothing is deleted - returns
+    # the number of notifications that match (or were deleted).
+    def delete_notifications(self, notification_title=None, severity=None, created_after=None, created_before=None,
+                             dry_run=False, max_workers=NOTIFICATION_DELETE_MAX_WORKERS):
 
-        # Get the list of active notificaitons
+        # Get the list of active notificaitons - only downloads the notifications that changed since last time
         demo_org_uri = self.get_demo_org_uri()
         notifications_uri = self.get_relationship_uri(demo_org_uri, 'notifications')
-        http_response = self.process_http_oauth_get_request(notifications_uri, "Existing notification events retrieved")
-        json_response = http_response.json()
+        notification_list = self.sync_collection(notifications_uri, "Existing notification events retrieved", resource_type=Notification).values
 
-        # Look through all the active notifications and delete any that have the title we're looking for
-        if json_response['total'] > 0:
-            notification_list = json_response['values']
-            for notification in notification_list:
-                #if notification_title in notification['title']:
-                notifications_events_uri = self.get_relationship_uri(BASE_URI, 'notificationEvents')
-                notifications_to_delete_uri = "{}/{}".format(notifications_events_uri, notification['sourceEvent'])
-                self.process_http_oauth_delete_request(notifications_to_delete_uri, "Notification deleted", 202)
+        # Look through all the active notifications for the ones we're looking for
+        notifications_to_delete = [notification for notification in notification_list
+                                   if is_matching_notification(notification, notification_title, severity, created_after, created_before)]
 
-    #################################################################################
+        if dry_run:
+            self.logger.info("{} - Dry run - {} of {} notifications would be deleted".format(
+                self.iot_button_serial_number, len(notifications_to_delete), len(notification_list)))
+            return len(notifications_to_delete)
+
+        notifications_events_uri = self.get_relationship_uri(BASE_URI, 'notificationEvents')
+
+        def delete_notification(notification):
+            notifications_to_delete_uri = "{}/{}".format(notifications_events_uri, notification.source_event)
+            self.process_http_oauth_delete_request(notifications_to_delete_uri, "Notification deleted", 202)
+            self.collection_sync.remove_value(notifications_uri, notification)
+
+        deleted_notifications = self.map_concurrently(delete_notification, notifications_to_delete, max_workers)
+        deleted_count = len([failure for _, failure in deleted_notifications if failure is None])
+
+        self.logger.info("{} - Deleted {} of {} matching notifications".format(
+            self.iot_button_serial_number, deleted_count, len(notifications_to_delete)))
+
+        return deleted_count
+
+#############################################################################
+# A thread pool that is closed once the block is done with it - or terminated if the block failed
+# (or a generator using it was closed early), which cancels whatever it still has queued
+#
+# Python 2's terminate() - and close() + join() - wait for the pool's handler thread, which only
+# checks in every 100ms, so ending every pool that way added up to 100ms to each call. Once all of
+# its work is done close() is enough, the worker threads exit by themselves.
+@contextmanager
+def finishing_thread_pool(worker_count):
+
+    thread_pool = ThreadPool(worker_count)
+    try:
+        yield thread_pool
+    except BaseException:
+        thread_pool.terminate()
+        raise
+
+    thread_pool.close()
+
+#############################################################################
+# Build the uri for one page of a collection - replaces any existing start/count matrix parameters
+def build_collection_page_uri(collection_uri, start, count):
+
+    uri_and_query = collection_uri.split('?', 1)
+    uri = re.sub(r';(start|count)=\d+', '', uri_and_query[0])
+    uri = "{};start={};count={}".format(uri, start, count)
+
+    if len(uri_and_query) > 1:
+        uri = "{}?{}".format(uri, uri_and_query[1])
+
+    return uri
+
+#############################################################################
+def open_collection_page_stream(http_response, resource_type=None):
+
+    def close_response(bytes_read):
+        http_response.close()
+        record_body_read(http_response, bytes_read)
+
+    return CollectionPageStream(http_response.iter_content(JSON_STREAM_CHUNK_SIZE), close=close_response, resource_type=resource_type)
+
+#############################################################################
+# A batch is either an SQS style {'Records': [...]} event or a plain list of press events
+def is_batch_event(event):
+    return isinstance(event, list) or 'Records' in event
+
+#############################################################################
+# Unwrap the press events in a batch - each with an identifier for reporting its outcome
+def get_batch_records(batch_event):
+
+    batch_records = []
+
+    if isinstance(batch_event, list):
+        for index, press_event in enumerate(batch_event):
+            batch_records.append({'record_id': str(index), 'press_event': press_event})
+    else:
+        for index, record in enumerate(batch_event['Records']):
+            press_event = record.get('body', record)
+            if isinstance(press_event, basestring):
+                press_event = json.loads(press_event)
+            batch_records.append({'record_id': record.get('messageId', str(index)), 'press_event': press_event})
+
+    return batch_records
+
+#############################################################################
+# Notifications (see _resources.Notification) must match every filter given (None matches anything)
+def is_matching_notification(notification, notification_title=None, severity=None, created_after=None, created_before=None):
+
+    if notification_title is not None and notification_title not in notification.title:
+        return False
+
+    if severity is not None and notification.severity != severity:
+        return False
+
+    # ISO 8601 UTC timestamps in the same format compare correctly as strings
+    start_date = notification.start_date
+
+    if created_after is not None and not start_date >= created_after:
+        return False
+
+    if created_before is not None and not start_date < created_before:
+        return False
+
+    return True
+
+#############################################################################
+# "  Mannheim ,Germany " and "mannheim, germany" are the same place
+def normalize_address(address):
+    return re.sub(r'\s+', ' ', re.sub(r'\s*,\s*', ', ', address.strip().lower()))
+
+#############################################################################
+# Find the uri for a given relationship in a JSON object's link list
+def get_link(json_object, relationship):
+
+    for link in json_object.get('links', []):
+        if link['rel'] == relationship:
+            return link['uri']
+
+    return ""
+
+#################################################################################
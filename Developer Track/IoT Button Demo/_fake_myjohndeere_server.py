@@ -0,0 +1,463 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from collections import OrderedDict
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urlparse
+
+#############################################################################
+# Fake server constants
+
+FAKE_ORGANIZATION_ID = '4321'
+FAKE_DEFAULT_PAGE_SIZE = 10         # Page size when a list request doesn't ask for one (same as the API)
+FAKE_MAX_PAGE_SIZE = 100
+FAKE_GEOCODE_LOCATION = {'lat': 49.4728807, 'lng': 8.476208999999999}
+
+DEERE_SIGNATURE_HEADER = 'x-deere-signature'
+
+# The collections under each kind of resource - a collection's name is also the rel of its link
+CHILD_COLLECTIONS = {
+    'organization': ('fields', 'assets', 'notifications'),
+    'field': ('mapLayerSummaries',),
+    'mapLayerSummary': ('mapLayers',),
+    'mapLayer': ('fileResources',),
+    'asset': ('locations',),
+}
+
+# Stand-ins for the links the API sends with each kind of resource that the demo never follows - they
+# make the fake's responses about as large as the API's, which is what showLinks saves on
+OTHER_LINKS = {
+    'catalog': ('currentUser', 'currentToken', 'agencies', 'equipmentMakes', 'equipmentTypes', 'machineMeasurementDefinitions',
+                'preferences', 'files', 'machines', 'partnerships', 'contributionProducts', 'flagCategories'),
+    'organization': ('machines', 'wdtCapableMachines', 'files', 'transferableFiles', 'uploadFile', 'sendFileToMachine', 'farms',
+                     'clients', 'boundaries', 'flags', 'flagCategories', 'operators', 'users', 'staff', 'partnerships',
+                     'preferences', 'jobs', 'products', 'productPackages', 'fieldOperations'),
+    'field': ('clients', 'farms', 'boundaries', 'activeBoundary', 'simplifiedBoundaries', 'flags', 'owningOrganization',
+              'fieldOperation', 'notes'),
+    'asset': ('organization', 'contributionDefinition', 'lastKnownLocation', 'measurements'),
+    'mapLayerSummary': ('owningOrganization', 'contributionDefinition', 'field'),
+    'mapLayer': ('owningOrganization', 'contributionDefinition', 'mapLayerSummary'),
+    'fileResource': ('owningOrganization', 'mapLayer', 'uploadFile'),
+}
+
+# The members of a resource only sent when they are asked for with embed (e.g. a field's farms)
+EMBEDDABLE_MEMBERS = {
+    'field': ('farms', 'clients', 'activeBoundary'),
+}
+EMBEDDABLE_KEY = '_embeddable'      # Where a value keeps them - never sent as is
+
+# The kind of resource POSTed to a collection, and where it lives (None - beneath the collection)
+COLLECTION_ITEMS = {
+    'fields': ('field', None),
+    'assets': ('asset', 'assets'),
+    'mapLayerSummaries': ('mapLayerSummary', 'mapLayerSummaries'),
+    'mapLayers': ('mapLayer', 'mapLayers'),
+    'fileResources': ('fileResource', 'fileResources'),
+    'notificationEvents': ('notificationEvent', 'notificationEvents'),
+}
+
+#############################################################################
+# A local stand-in for the MyJohnDeere API (plus the Google Maps geocoder and the demo images)
+#
+# Serves the part of the link graph the demo uses - the catalog, one organization with its fields,
+# assets and notifications, map layer summaries -> map layers -> file resources, asset locations
+# and notification events - from memory, over plain HTTP on localhost. Creates answer 201 with a
+# Location header, lists are paged (;start=;count=) and support the x-deere-signature deltas the
+# way CollectionSync expects. GETs can ask for only some of the links (?showLinks=) and for the
+# embeddable members of the values (?embed=), as the API allows. Every request can be delayed (latency_seconds plus up to
+# latency_jitter_seconds) and answered 429 (with throttle_rate probability), so the effect of the
+# client's caching, batching and retry logic can be measured without a network. Requests to one
+# of failing_endpoints (e.g. "POST notificationEvents") are answered 500 - after they were acted
+# on, as a server error can be.
+#
+#   server = FakeMyJohnDeereServer(latency_seconds=0.02, throttle_rate=0.01)
+#   server.start()
+#   ... point BASE_URI at server.base_uri ...
+#   print server.get_stats()
+#   server.stop()
+
+class FakeMyJohnDeereServer:
+
+    #############################################################################
+    def __init__(self, port=0, latency_seconds=0.0, latency_jitter_seconds=0.0, throttle_rate=0.0, retry_after_seconds=0.1,
+                 existing_field_count=0, image_size=64 * 1024, seed=None, failing_endpoints=()):
+
+        self.port = port
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.throttle_rate = throttle_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.existing_field_count = existing_field_count
+        self.failing_endpoints = set(failing_endpoints)
+
+        self.image = '\x89PNG\r\n\x1a\n' + os.urandom(max(image_size - 8, 0))     # Only needs to look like an image
+
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._http_server = None
+
+        self.reset_stats()
+
+    #############################################################################
+    # Start serving on a background thread - the uris below are only known once it has started
+    def start(self):
+
+        self._http_server = _ThreadingHTTPServer(('127.0.0.1', self.port), _FakeRequestHandler)
+        self._http_server.fake_server = self
+
+        self.port = self._http_server.server_address[1]
+        self.root_uri = "http://127.0.0.1:{}".format(self.port)
+        self.base_uri = "{}/platform/".format(self.root_uri)
+        self.geocode_uri = "{}/maps/api/geocode/json".format(self.root_uri)
+        self.image_uri = "{}/images/demo.png".format(self.root_uri)
+
+        self._reset_resources()
+
+        server_thread = threading.Thread(target=self._http_server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        return self
+
+    #############################################################################
+    def stop(self):
+
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+
+    #############################################################################
+    # Back to the resources start() began with - e.g. to measure the same presses twice
+    def reset(self):
+
+        self._reset_resources()
+        self.reset_stats()
+
+    #############################################################################
+    # Requests served so far - in total, throttled (429) and by "METHOD kind" (e.g. "POST fields")
+    def get_stats(self):
+
+        with self._lock:
+            return {
+                'requests': self._stats['requests'],
+                'throttled': self._stats['throttled'],
+                'bytes_received': self._stats['bytes_received'],
+                'bytes_sent': self._stats['bytes_sent'],
+                'by_endpoint': dict(self._stats['by_endpoint'])
+            }
+
+    #############################################################################
+    def reset_stats(self):
+
+        with self._lock:
+            self._stats = {'requests': 0, 'throttled': 0, 'bytes_received': 0, 'bytes_sent': 0, 'by_endpoint': dict()}
+
+    #############################################################################
+    # Handle one request - returns (status, headers, body) and records it in the stats
+    def handle(self, method, uri, headers, body):
+
+        delay = self.latency_seconds + self._random.uniform(0, self.latency_jitter_seconds)
+        if delay > 0:
+            time.sleep(delay)
+
+        path, params = parse_request_uri(uri)
+
+        with self._lock:
+            throttled = self._random.random() < self.throttle_rate
+
+            if throttled:
+                endpoint = "{} throttled".format(method)
+                response = (429, {'Retry-After': str(self.retry_after_seconds)}, '')
+            else:
+                endpoint, response = self._route(method, path, params, headers, body)
+
+                if endpoint in self.failing_endpoints:
+                    response = json_response(500, {'message': "Failing {} on purpose".format(endpoint)})
+
+            self._stats['requests'] += 1
+            self._stats['throttled'] += 1 if throttled else 0
+            self._stats['bytes_received'] += len(body)
+            self._stats['bytes_sent'] += len(response[2])
+            self._stats['by_endpoint'][endpoint] = self._stats['by_endpoint'].get(endpoint, 0) + 1
+
+        return response
+
+    #############################################################################
+    # Called with the lock held - returns ("METHOD kind", (status, headers, body))
+    def _route(self, method, path, params, headers, body):
+
+        if path == '/maps/api/geocode/json':
+            return "GET geocode", json_response(200, {'status': 'OK', 'results': [{'geometry': {'location': FAKE_GEOCODE_LOCATION}}]})
+
+        if path.startswith('/images/'):
+            return "GET image", (200, {'Content-Type': 'image/png'}, self.image)
+
+        resource = self._resources.get(path)
+        collection = self._collections.get(path)
+
+        if method == 'GET' and resource is not None:
+            return "GET {}".format(resource['kind']), json_response(200, present_value(resource['value'], params))
+
+        if method == 'GET' and collection is not None:
+            return "GET {}".format(collection['name']), self._list(collection, params, headers)
+
+        if method == 'POST' and collection is not None and (collection['name'] in COLLECTION_ITEMS or collection['name'] == 'locations'):
+            return "POST {}".format(collection['name']), self._create(collection, json.loads(body or 'null'))
+
+        if method == 'PUT' and resource is not None and resource['kind'] == 'fileResource':
+            resource['uploaded_size'] = len(body)
+            return "PUT fileResource", (204, {}, '')
+
+        if method == 'DELETE' and resource is not None and resource['kind'] not in ('catalog', 'organization'):
+            self._delete(resource)
+            return "DELETE {}".format(resource['kind']), (202 if resource['kind'] == 'notificationEvent' else 204, {}, '')
+
+        return "{} unknown".format(method), json_response(404 if resource is None and collection is None else 405,
+                                                          {'errors': [{'message': "{} {}".format(method, path)}]})
+
+    #############################################################################
+    # A page of a collection - only what changed since the x-deere-signature sent, if one was
+    def _list(self, collection, params, headers):
+
+        signature = headers.get(DEERE_SIGNATURE_HEADER)
+        response_headers = {DEERE_SIGNATURE_HEADER: str(self._version)}
+
+        if signature and signature.isdigit():
+            changed_entries = [entry for entry in collection['entries'].values() if entry['version'] > int(signature)]
+            if not changed_entries:
+                return (304, response_headers, '')
+            values = [entry['value'] for entry in changed_entries]
+        else:
+            values = [entry['value'] for entry in collection['entries'].values() if not entry['value'].get('deleted')]
+
+        values = [present_value(value, params) for value in values]
+
+        # The file resources of a map layer are answered with the (first) file resource itself
+        if collection['name'] == 'fileResources':
+            return json_response(200, values[0] if values else {'values': [], 'links': []}, response_headers)
+
+        start = int(params.get('start', 0))
+        count = min(int(params.get('count', FAKE_DEFAULT_PAGE_SIZE)), FAKE_MAX_PAGE_SIZE)
+
+        links = [link('self', "{};start={};count={}".format(collection['uri'], start, count))]
+        if start + count < len(values):
+            links.append(link('nextPage', "{};start={};count={}".format(collection['uri'], start + count, count)))
+
+        return json_response(200, {'links': links, 'total': len(values), 'values': values[start:start + count]}, response_headers)
+
+    #############################################################################
+    def _create(self, collection, body):
+
+        # Asset locations are POSTed as an array of readings, and aren't resources of their own
+        if collection['name'] == 'locations':
+            for location in body:
+                self._add_entry(collection, "{}/{}".format(collection['path'], next(self._ids)), dict(location))
+            return (201, {}, '')
+
+        kind, items_path = COLLECTION_ITEMS[collection['name']]
+        resource_id = str(next(self._ids))
+        path = "{}/{}".format(collection['path'] if items_path is None else "/platform/{}".format(items_path), resource_id)
+
+        value = dict(body, id=resource_id)
+        value[EMBEDDABLE_KEY] = dict((name, value.pop(name)) for name in EMBEDDABLE_MEMBERS.get(kind, ()) if name in value)
+        resource = self._add_resource(kind, path, value, collection)
+
+        # An event raises a notification in the organization - deleting the event removes it again
+        if kind == 'notificationEvent':
+            notification = {
+                'id': resource_id,
+                'sourceEvent': resource_id,
+                'title': body.get('title'),
+                'text': body.get('text'),
+                'severity': body.get('severity'),
+                'timeRange': body.get('timeRange'),
+                'links': [link('self', "{}/platform/notifications/{}".format(self.root_uri, resource_id))]
+            }
+            resource['notification_entry'] = self._add_entry(self._collections[self._notifications_path], "/platform/notifications/" + resource_id, notification)
+
+        return (201, {'Location': resource['uri']}, '')
+
+    #############################################################################
+    # Deleted values stay in their collection flagged as deleted, so they show up in the deltas
+    def _delete(self, resource):
+
+        del self._resources[resource['path']]
+
+        for entry in (resource.get('entry'), resource.get('notification_entry')):
+            if entry is not None:
+                self._version += 1
+                entry['version'] = self._version
+                entry['value'] = {'id': entry['value'].get('id'), 'deleted': True, 'links': [l for l in entry['value']['links'] if l['rel'] == 'self']}
+
+    #############################################################################
+    def _add_resource(self, kind, path, value, collection=None):
+
+        uri = self.root_uri + path
+        value['links'] = [link('self', uri)] + [link(name, "{}/{}".format(uri.rstrip('/'), name)) for name in CHILD_COLLECTIONS.get(kind, ()) + OTHER_LINKS.get(kind, ())]
+
+        resource = {'kind': kind, 'path': path, 'uri': uri, 'value': value}
+        self._resources[path] = resource
+
+        for name in CHILD_COLLECTIONS.get(kind, ()):
+            self._add_collection(name, "{}/{}".format(path, name))
+
+        if collection is not None:
+            resource['entry'] = self._add_entry(collection, path, value)
+
+        return resource
+
+    #############################################################################
+    def _add_collection(self, name, path):
+        self._collections[path] = {'name': name, 'path': path, 'uri': self.root_uri + path, 'entries': OrderedDict()}
+
+    #############################################################################
+    def _add_entry(self, collection, path, value):
+
+        self._version += 1
+        entry = collection['entries'][path] = {'version': self._version, 'value': value}
+
+        return entry
+
+    #############################################################################
+    def _reset_resources(self):
+
+        with self._lock:
+            self._version = 0
+            self._resources = dict()
+            self._collections = dict()
+
+            organization_path = "/platform/organizations/{}".format(FAKE_ORGANIZATION_ID)
+            self._notifications_path = "{}/notifications".format(organization_path)
+
+            self._add_collection('organizations', '/platform/organizations')
+            self._add_collection('contributionDefinitions', '/platform/contributionDefinitions')
+            self._add_collection('notificationEvents', '/platform/notificationEvents')
+
+            self._add_resource('catalog', '/platform/', {'links': []})['value']['links'].extend(
+                link(name, "{}/platform/{}".format(self.root_uri, name)) for name in ('organizations', 'contributionDefinitions', 'notificationEvents'))
+
+            self._add_resource('organization', organization_path, {'id': FAKE_ORGANIZATION_ID, 'name': "Fake Organization"},
+                               self._collections['/platform/organizations'])
+
+            fields = self._collections["{}/fields".format(organization_path)]
+            for index in range(self.existing_field_count):
+                self._create(fields, {'name': "Field - Existing {}".format(index)})
+
+#############################################################################
+# One thread per connection - connections are kept alive, like the API's
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _FakeRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # Write each response in one go - header by header writes stall on Nagle/delayed ACKs (~40ms a request)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    #############################################################################
+    def handle_request(self, method):
+
+        body = self.read_body()
+        headers = dict((name.lower(), value) for name, value in self.headers.items())
+
+        try:
+            status, response_headers, response_body = self.server.fake_server.handle(method, self.path, headers, body)
+        except Exception as failure:
+            status, response_headers, response_body = json_response(500, {'errors': [{'message': str(failure)}]})
+
+        self.send_response(status)
+        for name, value in response_headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    #############################################################################
+    # Streamed uploads (see _upload_stream) arrive chunked when their length isn't known up front
+    def read_body(self):
+
+        if self.headers.getheader('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                chunk_size = int(self.rfile.readline().split(';')[0].strip(), 16)
+                if chunk_size == 0:
+                    while self.rfile.readline().strip():
+                        pass
+                    return ''.join(chunks)
+                chunks.append(self.rfile.read(chunk_size))
+                self.rfile.readline()
+
+        return self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+
+    #############################################################################
+    def log_message(self, format, *args):
+        pass
+
+#############################################################################
+# "/platform/organizations/4321/fields;start=0;count=100?showLinks=self" ->
+#   ("/platform/organizations/4321/fields", {'start': '0', 'count': '100', 'showLinks': 'self'})
+def parse_request_uri(uri):
+
+    parsed_uri = urlparse.urlparse(uri)
+    path_and_params = (parsed_uri.path + (';' + parsed_uri.params if parsed_uri.params else '')).split(';')
+
+    params = dict(param.split('=', 1) for param in path_and_params[1:] if '=' in param)
+    params.update(urlparse.parse_qsl(parsed_uri.query))
+    path = path_and_params[0] if path_and_params[0] == '/platform/' else path_and_params[0].rstrip('/')
+
+    return path, params
+
+#############################################################################
+# A value as a GET with these params sees it - only the links in showLinks, and the members in embed
+def present_value(value, params):
+
+    presented = dict((key, item) for key, item in value.items() if key != EMBEDDABLE_KEY)
+
+    if 'showLinks' in params and 'links' in value:
+        shown_links = params['showLinks'].split(',')
+        presented['links'] = [value_link for value_link in value['links'] if value_link['rel'] in shown_links]
+
+    if 'embed' in params:
+        embeddable = value.get(EMBEDDABLE_KEY, {})
+        presented.update((name, embeddable[name]) for name in params['embed'].split(',') if name in embeddable)
+
+    return presented
+
+#############################################################################
+def json_response(status, value, headers=None):
+
+    response_headers = {'Content-Type': 'application/vnd.deere.axiom.v3+json'}
+    response_headers.update(headers or {})
+
+    return (status, response_headers, json.dumps(value))
+
+#############################################################################
+def link(relationship, uri):
+    return {'@type': 'Link', 'rel': relationship, 'uri': uri}
+
+#############################################################################
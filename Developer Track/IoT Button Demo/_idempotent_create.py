@@ -0,0 +1,84 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _tracing import record_cache_hit
+import threading
+
+#############################################################################
+# A create that is in progress - the other callers with the same key wait for its outcome
+
+class _InFlightCreate:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.uri = None
+        self.failure = None
+
+#############################################################################
+# Makes creates idempotent - the same client key always ends up with the same resource
+#
+# The Location returned by a create is remembered under its client key, so later calls get the
+# cached uri without listing or POSTing again. Concurrent calls with the same key (e.g. two
+# presses racing) are single-flighted - only the first one creates, the others wait for it and
+# get the same uri (or the same failure).
+
+class IdempotentCreator:
+
+    #############################################################################
+    def __init__(self, location_cache):
+
+        self.location_cache = location_cache
+
+        self._in_flight = dict()
+        self._lock = threading.Lock()
+
+    #############################################################################
+    # create() does the actual create (or finds the existing resource) and returns its uri
+    def create_or_get(self, client_key, create):
+
+        uri = self.location_cache.get(client_key)
+        if uri:
+            record_cache_hit('created_resource', client_key)
+            return uri
+
+        with self._lock:
+            in_flight_create = self._in_flight.get(client_key)
+            is_creator = in_flight_create is None
+
+            if is_creator:
+                in_flight_create = self._in_flight[client_key] = _InFlightCreate()
+
+        if not is_creator:
+            in_flight_create.done.wait()
+
+            if in_flight_create.failure is not None:
+                raise in_flight_create.failure
+            return in_flight_create.uri
+
+        try:
+            # Another caller may have finished the create between our cache check and taking the lock
+            uri = self.location_cache.get(client_key) or create()
+
+            if uri:
+                self.location_cache.put(client_key, uri)
+
+            in_flight_create.uri = uri
+            return uri
+
+        except Exception as failure:
+            in_flight_create.failure = failure
+            raise
+
+        finally:
+            with self._lock:
+                del self._in_flight[client_key]
+            in_flight_create.done.set()
+
+    #############################################################################
+    # Forget a resource that no longer exists (we deleted it, or the API says it is gone) -
+    # returns the number of client keys that pointed at it
+    def forget_uri(self, uri):
+        return self.location_cache.invalidate_matching(lambda client_key, cached_uri: cached_uri == uri)
+
+#############################################################################
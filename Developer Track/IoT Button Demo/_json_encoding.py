@@ -0,0 +1,175 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _common_setup import *
+from json.encoder import encode_basestring_ascii
+import copy
+import re
+
+# A faster encoder, used when it is installed (and JSON_ENCODER allows it)
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+#############################################################################
+# JSON encoding constants
+
+JSON_SEPARATORS = (',', ':')    # No whitespace - the API doesn't need bodies to be readable
+UJSON_DOUBLE_PRECISION = 15     # Most digits ujson will keep - its default (9) would round coordinates
+
+# What a Slot is encoded as while a PayloadTemplate is built - "\x01<slot index>\x01"
+SLOT_MARKER_FORMAT = "\x01{}\x01"
+SLOT_MARKER_PATTERN = re.compile(r'"\\u0001(\d+)\\u0001"')
+
+#############################################################################
+# JSON that is already encoded - passed through as is by encode_json and PayloadTemplate.fill
+class JsonText(str):
+    pass
+
+#############################################################################
+# Encode a request body as compact JSON
+#
+# A list of JsonText (e.g. a batch of template payloads) is joined into an array without decoding
+# it again. Note - on Python 2 json.dumps only uses its C encoder when there is no indent, so the
+# indent=4 bodies used to be encoded in pure Python as well as being ~30% whitespace.
+def encode_json(body):
+
+    if isinstance(body, JsonText):
+        return body
+
+    if isinstance(body, list) and body and all(isinstance(item, JsonText) for item in body):
+        return JsonText("[" + ",".join(body) + "]")
+
+    return JsonText(_encode(body))
+
+#############################################################################
+# A slot value - strings and numbers (by far the most common) are encoded directly, as a call to
+# json.dumps costs more than encoding a whole payload's worth of them
+def encode_json_value(value):
+
+    value_type = type(value)
+
+    if value_type is JsonText:
+        return value
+
+    if value_type is str or value_type is unicode:
+        return encode_basestring_ascii(value)
+
+    if value_type is int or value_type is long:
+        return str(value)
+
+    # Same as json.dumps - NaN and infinity are left to it
+    if value_type is float and value - value == 0.0:
+        return repr(value)
+
+    return _encode(value)
+
+#############################################################################
+def get_json_encoder_name():
+    return "ujson" if _encode is _encode_ujson else "json"
+
+#############################################################################
+def _encode_json(value):
+    return json.dumps(value, separators=JSON_SEPARATORS)
+
+#############################################################################
+def _encode_ujson(value):
+    return ujson.dumps(value, escape_forward_slashes=False, double_precision=UJSON_DOUBLE_PRECISION)
+
+_encode = _encode_ujson if ujson is not None and JSON_ENCODER in ('auto', 'ujson') else _encode_json
+
+#############################################################################
+# A variable field of a PayloadTemplate
+class Slot:
+
+    #############################################################################
+    def __init__(self, name):
+        self.name = name
+
+#############################################################################
+# A payload shape encoded once, with only its variable fields (Slots) encoded per request
+#
+# The shape is any JSON-able structure with Slot('name') wherever a value varies - fill(name=value)
+# encodes just those values and splices them into the text encoded ahead of time:
+#
+#   NOTIFICATION_TEMPLATE = PayloadTemplate({"title": Slot('title'), "eventType": "ANNOUNCEMENT"})
+#   NOTIFICATION_TEMPLATE.fill(title="Field created")  ->  '{"title":"Field created","eventType":"ANNOUNCEMENT"}'
+#
+# Slot values can be any JSON-able value - a JsonText (e.g. another filled template) is spliced in
+# as is. partial() fills in some of the slots for good, e.g. the values that are the same for every
+# payload a device sends.
+
+class PayloadTemplate:
+
+    #############################################################################
+    def __init__(self, shape):
+
+        slots = []
+
+        # Stand in a marker string for every slot, encode the shape and split the text at the markers
+        def replace_slots(value):
+            if isinstance(value, Slot):
+                slots.append(value.name)
+                return SLOT_MARKER_FORMAT.format(len(slots) - 1)
+            if isinstance(value, dict):
+                return dict((key, replace_slots(item)) for key, item in value.items())
+            if isinstance(value, (list, tuple)):
+                return [replace_slots(item) for item in value]
+            return value
+
+        text = _encode_json(replace_slots(shape))
+
+        # In the order the markers ended up in the text - which needn't be the order the shape was walked in
+        slot_names = []
+        chunks = []
+        position = 0
+        for marker in SLOT_MARKER_PATTERN.finditer(text):
+            slot_names.append(slots[int(marker.group(1))])
+            chunks.append(text[position:marker.start()])
+            position = marker.end()
+        chunks.append(text[position:])
+
+        self._set_chunks(slot_names, chunks)
+
+    #############################################################################
+    # A copy of the template with the given slots filled in
+    def partial(self, **values):
+
+        slot_names = []
+        chunks = [self._chunks[0]]
+        for name, chunk in self._slots:
+            if name in values:
+                chunks[-1] += encode_json_value(values[name]) + chunk
+            else:
+                slot_names.append(name)
+                chunks.append(chunk)
+
+        template = copy.copy(self)
+        template._set_chunks(slot_names, chunks)
+
+        return template
+
+    #############################################################################
+    def fill(self, **values):
+
+        parts = [self._chunks[0]]
+        try:
+            for name, chunk in self._slots:
+                parts.append(encode_json_value(values[name]))
+                parts.append(chunk)
+        except KeyError:
+            raise KeyError("Payload template values missing - {}".format(", ".join(name for name in self.slot_names if name not in values)))
+
+        return JsonText("".join(parts))
+
+    #############################################################################
+    # chunks - the text before the first slot, then the text following each slot
+    def _set_chunks(self, slot_names, chunks):
+
+        self.slot_names = tuple(slot_names)
+        self._chunks = chunks
+        self._slots = zip(self.slot_names, chunks[1:])
+
+#############################################################################
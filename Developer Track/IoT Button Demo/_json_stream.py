@@ -0,0 +1,247 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from collections import deque
+import codecs
+import json
+import re
+
+#############################################################################
+# JSON streaming constants
+
+JSON_STREAM_CHUNK_SIZE = 64 * 1024      # Bytes read from the response at a time
+
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_json_decoder = json.JSONDecoder()
+_end_of_values = object()
+
+#############################################################################
+# A collection page ({"links": [...], "total": ..., "values": [...]}) decoded as it is read
+#
+# Only the value being decoded and the text not yet decoded are held in memory - each value is
+# decoded (json raw_decode) as soon as all of it has arrived and handed to the caller, cut down to
+# keys if they are given, before the next one is read. So a page of fields with their boundaries
+# embedded, which can be several MB, never has to be held as a whole, and a caller looking for one
+# value can stop reading (and close the response) as soon as it has found it.
+#
+# The other members of the page (links, total, ...) are decoded as they come - get() reads ahead
+# for one that is sent after the values, keeping the values passed over for values().
+#
+#   chunks        - iterable of the body's bytes, e.g. http_response.iter_content(JSON_STREAM_CHUNK_SIZE)
+#   keys          - the keys of each value to keep (None keeps them all)
+#   close         - called with the number of bytes read once the page has been read, or when values()
+#                   is closed early
+#   resource_type - a _resources.Resource subclass to hand out the values as - each keeps the text
+#                   it was decoded from (unless keys are given) rather than its dicts
+
+class CollectionPageStream:
+
+    #############################################################################
+    def __init__(self, chunks, keys=None, close=None, resource_type=None):
+
+        self.keys = keys
+        self.resource_type = resource_type
+        self.bytes_read = 0
+
+        self._chunks = iter(chunks)
+        self._close = close
+        self._utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._text = u""
+        self._index = 0                 # Where decoding carries on in _text
+        self._value_start = 0           # Where the value _decode last returned starts in _text
+        self._eof = False
+        self._members = dict()          # The members of the page other than values
+        self._passed_values = deque()   # Values read past by get() that values() hasn't handed out yet
+        self._in_values = False
+        self._finished = False
+
+        try:
+            self._expect('{')
+            self._read_members()
+        except Exception:
+            self.close()
+            raise
+
+    #############################################################################
+    def __getitem__(self, key):
+
+        if key == 'values':
+            return self.values()
+
+        if self.get(key, KeyError) is KeyError:
+            raise KeyError(key)
+
+        return self._members[key]
+
+    #############################################################################
+    def get(self, key, default=None):
+
+        if key not in self._members and not self._finished:
+            while self._in_values:
+                value = self._read_value()
+                if value is not _end_of_values:
+                    self._passed_values.append(value)
+
+        return self._members.get(key, default)
+
+    #############################################################################
+    # Yield the page's values in order - they can only be iterated once
+    def values(self):
+
+        try:
+            while self._passed_values:
+                yield self._passed_values.popleft()
+
+            while self._in_values:
+                value = self._read_value()
+                if value is not _end_of_values:
+                    yield value
+        finally:
+            if not self._finished:
+                self.close()
+
+    #############################################################################
+    # The whole page as a dict
+    def read(self):
+
+        values = list(self.values())
+
+        page = dict(self._members)
+        page['values'] = values
+
+        return page
+
+    #############################################################################
+    def close(self):
+
+        self._finished = True
+        self._in_values = False
+
+        if self._close is not None:
+            close, self._close = self._close, None
+            close(self.bytes_read)
+
+    #############################################################################
+    # Read the members up to the values (or the end of the page)
+    def _read_members(self):
+
+        while True:
+            next_character = self._peek()
+
+            if next_character == '}':
+                self._index += 1
+                self.close()
+                return
+
+            if next_character == ',':
+                self._index += 1
+                continue
+
+            key = self._decode()
+            self._expect(':')
+
+            if key == 'values':
+                self._expect('[')
+                self._in_values = True
+                return
+
+            self._members[key] = self._decode()
+
+    #############################################################################
+    # The next value of the values array - once there are no more it reads the members after them
+    # and returns _end_of_values
+    def _read_value(self):
+
+        next_character = self._peek()
+
+        if next_character == ',':
+            self._index += 1
+            next_character = self._peek()
+
+        if next_character == ']':
+            self._index += 1
+            self._in_values = False
+            self._read_members()
+            return _end_of_values
+
+        value = self._decode()
+        if not isinstance(value, dict):
+            return value
+
+        if self.keys is not None:
+            value = dict((key, value[key]) for key in self.keys if key in value)
+
+        if self.resource_type is not None:
+            text = self._text[self._value_start:self._index].encode('utf-8') if self.keys is None else None
+            value = self.resource_type.from_json(value, text)
+
+        return value
+
+    #############################################################################
+    # Decode the JSON value at _index - reading more of the body until all of it has arrived
+    def _decode(self):
+
+        self._peek()
+
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self._text, self._index)
+
+                # A number (or a literal) at the very end of the text may yet have more to come
+                if end < len(self._text) or self._eof:
+                    self._value_start = self._index
+                    self._index = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+
+            # Read at least as much again as is waiting to be decoded - so that a large value isn't
+            # decoded over and over as it arrives a chunk at a time
+            self._read(2 * (len(self._text) - self._index))
+
+    #############################################################################
+    # The next character that isn't whitespace - "" at the end of the body
+    def _peek(self):
+
+        while True:
+            self._index = JSON_WHITESPACE.match(self._text, self._index).end()
+
+            if self._index < len(self._text):
+                return self._text[self._index]
+            if self._eof:
+                return ""
+
+            self._read(1)
+
+    #############################################################################
+    def _expect(self, character):
+
+        next_character = self._peek()
+        if next_character != character:
+            raise ValueError("Expected '{}' in the collection page after {} bytes, found '{}'".format(character, self.bytes_read, next_character))
+
+        self._index += 1
+
+    #############################################################################
+    # Read from the body until at least minimum characters are waiting to be decoded (or it ends)
+    def _read(self, minimum):
+
+        # Let go of the text that has been decoded already
+        if self._index > 0:
+            self._text = self._text[self._index:]
+            self._index = 0
+
+        while len(self._text) < minimum and not self._eof:
+            chunk = next(self._chunks, None)
+
+            if chunk is None:
+                self._eof = True
+                self._text += self._utf8_decoder.decode(b"", True)
+            else:
+                self.bytes_read += len(chunk)
+                self._text += self._utf8_decoder.decode(chunk)
+
+#############################################################################
@@ -0,0 +1,58 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _common_setup import *
+
+#############################################################################
+# Link bundle constants
+
+# The relationships resolved into the bundle - on the API catalog, and on the demo organization
+LINK_BUNDLE_CATALOG_RELATIONSHIPS = ('organizations', 'contributionDefinitions', 'notificationEvents')
+LINK_BUNDLE_ORGANIZATION_RELATIONSHIPS = ('fields', 'assets', 'notifications')
+
+#############################################################################
+# Links resolved ahead of time and shipped along with the handlers
+#
+# A cold container starts with an empty link cache, so its first press has to GET the catalog and
+# the organization before it can do anything else. The bundle holds those (resource uri,
+# relationship) -> uri links - including the contribution definitions link the contribution
+# definition uris are built from - and is seeded into the link cache when the handler is loaded. A
+# bundled link that has gone stale is dropped like any other cached link the first time it
+# answers 404/410 (see DemoHelper.process_http_request). The bundle only applies to the API it was
+# resolved against:
+#
+#   {"base_uri": "https://sandboxapi.deere.com/platform/",
+#    "links": [["https://sandboxapi.deere.com/platform/", "organizations", "https://sandboxapi.deere.com/platform/organizations"], ...]}
+
+#############################################################################
+# Seed the links from the bundle the cache doesn't already hold - returns the number seeded
+def load_link_bundle(link_cache, file_path=LINK_BUNDLE_FILE, base_uri=BASE_URI):
+
+    if not file_path or not os.path.exists(file_path):
+        return 0
+
+    try:
+        with open(file_path) as link_bundle_file:
+            link_bundle = json.load(link_bundle_file)
+    except (IOError, ValueError) as failure:
+        logging.getLogger().info("ERROR   - Could not load link bundle {} - {}".format(file_path, failure))
+        return 0
+
+    if link_bundle.get('base_uri') != base_uri:
+        return 0
+
+    links = [((resource_uri, relationship), uri) for resource_uri, relationship, uri in link_bundle['links']
+             if link_cache.get((resource_uri, relationship)) is None]
+    link_cache.put_many(links)
+
+    return len(links)
+
+#############################################################################
+# links - [resource uri, relationship, uri] triples, see DemoHelper.resolve_link_bundle
+def save_link_bundle(links, file_path=LINK_BUNDLE_FILE, base_uri=BASE_URI):
+
+    with open(file_path, 'w') as link_bundle_file:
+        json.dump({'base_uri': base_uri, 'links': links}, link_bundle_file, indent=4)
+
+#############################################################################
@@ -0,0 +1,231 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _tracing import bind_to_current_span
+from collections import OrderedDict
+import atexit
+import threading
+import time
+
+#############################################################################
+# Notification dispatch constants
+
+NOTIFICATION_MERGE_WINDOW_SECONDS = 5.0     # Same field/title/severity notifications queued within this long are sent as one
+NOTIFICATION_FLUSH_TIMEOUT_SECONDS = 20.0   # Longest flush() waits for the queued notifications to be sent
+NOTIFICATION_MAX_WORKERS = 4                # Notifications POSTed at the same time
+
+# Dispatchers that may still hold queued notifications
+_open_dispatchers = set()
+
+#############################################################################
+# Coalesces notifications and sends them from a background thread
+#
+# Notifications for the same field, title and severity queued within merge_window_seconds of the
+# first one are sent as a single notification, whose text carries the number of events merged
+# into it - so someone hammering the button gets one notification instead of a storm of them.
+# flush() sends everything still queued straight away and waits for it - a Lambda handler must
+# call it before returning, as the process may be frozen (with the sender thread) once it has.
+#
+# So merging happens within a batch of presses (DemoHelper.process_event_batch), not across
+# invocations - a single press flushes its own notification before it returns. Presses are only
+# merged across invocations with OUTBOX_ENABLED, where a press is just recorded (durably) and the
+# outbox replays the presses recorded since as batches - see _outbox.
+#
+# queue() returns the queued notification - once sent, get_send_failure() tells whether it (and so
+# every event merged into it) made it to the API.
+
+class NotificationDispatcher:
+
+    #############################################################################
+    def __init__(self, demo_helper, merge_window_seconds=NOTIFICATION_MERGE_WINDOW_SECONDS):
+
+        self.demo_helper = demo_helper
+        self.merge_window_seconds = merge_window_seconds
+
+        self._queued = OrderedDict()    # Oldest first
+        self._sending_count = 0
+        self._flushes_waiting = 0
+        self._condition = threading.Condition()
+        self._sender = None
+        self._closed = False
+
+        _open_dispatchers.add(self)
+
+    #############################################################################
+    def queue(self, field_uri, notification_title, notification_details):
+
+        key = (field_uri, notification_title, notification_details['severity'])
+
+        with self._condition:
+            queued_notification = self._queued.get(key)
+
+            if queued_notification:
+                queued_notification['count'] += 1
+            else:
+                queued_notification = self._queued[key] = {
+                    'field_uri': field_uri,
+                    'title': notification_title,
+                    'details': notification_details,
+                    'count': 1,
+                    'queued_at': time.time(),
+                    'iot_button_serial_number': self.demo_helper.iot_button_serial_number,
+                    'send': bind_to_current_span(self._send),    # Traced as part of the invocation that queued it first
+                    'sent': False,
+                    'failure': None
+                }
+
+            # The sender is only started once there is something to send
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_when_due)
+                self._sender.daemon = True
+                self._sender.start()
+
+            self._condition.notify_all()
+
+            return queued_notification
+
+    #############################################################################
+    # Send everything queued without waiting out the merge window - returns False if it couldn't all
+    # be sent within timeout
+    def flush(self, timeout=NOTIFICATION_FLUSH_TIMEOUT_SECONDS):
+
+        deadline = time.time() + timeout
+
+        with self._condition:
+            self._flushes_waiting += 1
+            self._condition.notify_all()
+
+            try:
+                while (self._queued or self._sending_count) and time.time() < deadline:
+                    wait_with_timer(self._condition, deadline - time.time())
+
+                return not (self._queued or self._sending_count)
+
+            finally:
+                self._flushes_waiting -= 1
+
+    #############################################################################
+    # Send everything queued, then stop the sender thread
+    def close(self, timeout=NOTIFICATION_FLUSH_TIMEOUT_SECONDS):
+
+        self.flush(timeout)
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        if self._sender is not None:
+            self._sender.join(timeout)
+
+        _open_dispatchers.discard(self)
+
+    #############################################################################
+    def _send_when_due(self):
+
+        while True:
+            with self._condition:
+                due_notifications = self._take_due_notifications()
+
+                while not due_notifications:
+                    if self._closed:
+                        return
+
+                    timeout = None
+                    if self._queued:
+                        oldest_notification = next(iter(self._queued.values()))
+                        timeout = max(oldest_notification['queued_at'] + self.merge_window_seconds - time.time(), 0.01)
+
+                    wait_with_timer(self._condition, timeout)
+                    due_notifications = self._take_due_notifications()
+
+                self._sending_count += len(due_notifications)
+
+            sent_notifications = []
+            try:
+                sent_notifications = self.demo_helper.map_concurrently(lambda queued_notification: queued_notification['send'](queued_notification),
+                                                                       due_notifications, NOTIFICATION_MAX_WORKERS)
+
+                for queued_notification, (_, failure) in zip(due_notifications, sent_notifications):
+                    if failure is not None:
+                        self.demo_helper.logger.info("{} - ERROR   - Could not send notification - {} - {}".format(
+                            queued_notification['iot_button_serial_number'], queued_notification['title'], failure))
+
+            finally:
+                with self._condition:
+                    for queued_notification, (_, failure) in zip(due_notifications, sent_notifications):
+                        queued_notification['sent'] = failure is None
+                        queued_notification['failure'] = failure
+
+                    self._sending_count -= len(due_notifications)
+                    self._condition.notify_all()
+
+    #############################################################################
+    # Called with the condition held - everything is due while a flush is waiting
+    def _take_due_notifications(self):
+
+        now = time.time()
+        due_keys = [key for key, queued_notification in self._queued.items()
+                    if self._flushes_waiting or now - queued_notification['queued_at'] >= self.merge_window_seconds]
+
+        return [self._queued.pop(key) for key in due_keys]
+
+    #############################################################################
+    def _send(self, queued_notification):
+
+        notification_details = dict(queued_notification['details'])
+        if queued_notification['count'] > 1:
+            notification_details['text'] = "{} ({} times)".format(notification_details['text'], queued_notification['count'])
+
+        self.demo_helper.set_thread_serial_number(queued_notification['iot_button_serial_number'])
+        self.demo_helper.contribute_notification(queued_notification['field_uri'], queued_notification['title'], notification_details)
+
+#############################################################################
+# The first reason one of queued_notifications (as returned by queue()) wasn't sent - None if they
+# all were. Only meaningful once they have been flushed.
+def get_send_failure(queued_notifications):
+
+    for queued_notification in queued_notifications:
+        if not queued_notification['sent']:
+            return queued_notification['failure'] or "Notification {} was not sent".format(queued_notification['title'])
+
+    return None
+
+#############################################################################
+# Wait on condition (held by the caller) for a notify or for timeout seconds, whichever comes first
+#
+# On Python 2 a Condition.wait with a timeout polls - sleeping up to 50ms between checks - so a
+# notify can go unnoticed for that long, and every hand over between the handler and the sender
+# paid for it. Waiting without a timeout is woken straight away - a timer does the notify for the
+# timeout instead.
+def wait_with_timer(condition, timeout):
+
+    if timeout is None:
+        condition.wait()
+        return
+
+    def notify_condition():
+        with condition:
+            condition.notify_all()
+
+    timer = threading.Timer(max(timeout, 0), notify_condition)
+    timer.daemon = True
+    timer.start()
+    try:
+        condition.wait()
+    finally:
+        timer.cancel()
+
+#############################################################################
+# Make sure queued notifications aren't lost when the process exits - and that the sender threads
+# have stopped before the interpreter tears down the modules they use
+
+@atexit.register
+def close_open_dispatchers():
+    for dispatcher in list(_open_dispatchers):
+        try:
+            dispatcher.close()
+        except Exception:
+            pass
+
+#############################################################################
@@ -0,0 +1,355 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _notification_dispatcher import wait_with_timer
+from contextlib import contextmanager
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+#############################################################################
+# Outbox constants
+
+OUTBOX_DRAIN_WORKERS = 2                # Batches replayed at the same time - never two of the same button's
+OUTBOX_BATCH_MAX_SIZE = 25              # Most press events replayed as one batch
+OUTBOX_MAX_ATTEMPTS = 8                 # Replays of a press event before it is given up on (and kept as 'failed')
+OUTBOX_RETRY_BASE_SECONDS = 1.0         # Wait before the first retry - doubled for every retry after it
+OUTBOX_RETRY_MAX_SECONDS = 5 * 60.0
+OUTBOX_CLAIM_TIMEOUT_SECONDS = 5 * 60.0 # A batch claimed for longer than this is taken to be abandoned (its process died)
+OUTBOX_POLL_SECONDS = 1.0               # How often an idle worker looks for press events appended by other processes
+OUTBOX_FLUSH_TIMEOUT_SECONDS = 60.0     # Longest flush() waits for the outbox to empty
+
+# Outboxes whose drain workers may still be running
+_open_outboxes = set()
+
+#############################################################################
+# Press events recorded in a local SQLite file and replayed against the API in the background
+#
+# Every contribution a press makes is a chain of requests, so a slow (or down) API made the press
+# slow - or lost it. With the outbox the handler only appends the press event to the file, which
+# takes a few milliseconds, and acknowledges it. Drain workers then replay the recorded presses
+# through replay_batch - the handler's own batch path, given an SQS style {'Records': [...]}
+# event - and remove the ones that went through. A press that failed is retried later, with
+# exponential backoff, until it has been tried max_attempts times.
+#
+# A button's presses are replayed in the order they were recorded: a batch takes each button's
+# presses from its oldest one on, no batch is started for a button that already has one in
+# flight, and a press waiting for its retry holds back the button's later presses. Presses of
+# different buttons are replayed independently, several to a batch.
+#
+# get_compaction_key(press_event) lets a newer press supersede older ones. When a press with a
+# compaction key is appended, the button's presses with the same key still waiting (not in
+# flight) since its last press with any other key are dropped - e.g. repeated asset location
+# updates, where only the newest location matters.
+#
+# The file is written with synchronous=FULL, so a recorded press survives the process crashing
+# (or the Lambda container being frozen and reclaimed, if the file is on storage that outlives it,
+# such as EFS). Several processes can share a file. A batch whose process died before it finished
+# is replayed again once its claim times out, so replays are at least once - the creates they
+# make go through IdempotentCreator.
+
+class Outbox:
+
+    #############################################################################
+    # kind - names the handler whose presses these are, several handlers can share a file
+    def __init__(self, demo_helper, file_path, kind, replay_batch, get_compaction_key=None, drain_workers=OUTBOX_DRAIN_WORKERS,
+                 batch_max_size=OUTBOX_BATCH_MAX_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS):
+
+        self.demo_helper = demo_helper
+        self.file_path = file_path
+        self.kind = kind
+        self.replay_batch = replay_batch
+        self.get_compaction_key = get_compaction_key or (lambda press_event: None)
+        self.drain_workers = drain_workers
+        self.batch_max_size = batch_max_size
+        self.max_attempts = max_attempts
+
+        self._connection = open_outbox_file(file_path)
+        self._connection_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._closed = False
+
+        self.reset_stats()
+
+        _open_outboxes.add(self)
+
+    #############################################################################
+    # Record press events - all of them or none. Returns the number of waiting presses they superseded
+    def append(self, press_events):
+
+        compacted_count = 0
+        appended_at = time.time()
+
+        with self._transaction() as cursor:
+            for press_event in press_events:
+                compaction_key = self.get_compaction_key(press_event)
+
+                if compaction_key is not None:
+                    cursor.execute("DELETE FROM outbox_entries WHERE kind = ? AND device = ? AND compaction_key = ? AND state = 'pending' "
+                                   "AND id > (SELECT COALESCE(MAX(id), 0) FROM outbox_entries "
+                                   "WHERE kind = ? AND device = ? AND (compaction_key IS NULL OR compaction_key != ?))",
+                                   (self.kind, press_event['serialNumber'], compaction_key, self.kind, press_event['serialNumber'], compaction_key))
+                    compacted_count += cursor.rowcount
+
+                cursor.execute("INSERT INTO outbox_entries (kind, device, press_event, compaction_key, next_attempt_at, appended_at) VALUES (?, ?, ?, ?, ?, ?)",
+                               (self.kind, press_event['serialNumber'], json.dumps(press_event), compaction_key, appended_at, appended_at))
+
+        with self._condition:
+            self._stats['appended'] += len(press_events)
+            self._stats['compacted'] += compacted_count
+
+            # The workers are only started once there is something to replay
+            if not self._workers:
+                self._start_workers()
+
+            self._condition.notify_all()
+
+        return compacted_count
+
+    #############################################################################
+    # Wait for every press event recorded so far to be replayed (or given up on) - returns False if
+    # there are still some left after timeout
+    def flush(self, timeout=OUTBOX_FLUSH_TIMEOUT_SECONDS):
+
+        deadline = time.time() + timeout
+
+        with self._condition:
+            if not self._workers and self.get_backlog():
+                self._start_workers()
+
+            while self.get_backlog() and time.time() < deadline:
+                wait_with_timer(self._condition, min(deadline - time.time(), OUTBOX_POLL_SECONDS))
+
+        return not self.get_backlog()
+
+    #############################################################################
+    # Stop the drain workers once they have finished their batches - whatever is left stays in the file
+    def close(self, timeout=OUTBOX_FLUSH_TIMEOUT_SECONDS):
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        for worker in self._workers:
+            worker.join(timeout)
+
+        _open_outboxes.discard(self)
+
+    #############################################################################
+    # Press events waiting to be replayed or in flight, in every process sharing the file
+    def get_backlog(self):
+
+        with self._connection_lock:
+            return self._connection.execute("SELECT COUNT(*) FROM outbox_entries WHERE kind = ? AND state != 'failed'", (self.kind,)).fetchone()[0]
+
+    #############################################################################
+    def get_stats(self):
+
+        with self._condition:
+            return dict(self._stats)
+
+    #############################################################################
+    def reset_stats(self):
+        self._stats = {'appended': 0, 'compacted': 0, 'replayed': 0, 'retried': 0, 'failed': 0}
+
+    #############################################################################
+    # Called with the condition held
+    def _start_workers(self):
+
+        for _ in range(self.drain_workers):
+            worker = threading.Thread(target=self._drain)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    #############################################################################
+    def _drain(self):
+
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+
+            try:
+                entries = self._claim_batch()
+            except sqlite3.Error as failure:
+                self.demo_helper.logger.info("ERROR   - Outbox - could not read {} - {}".format(self.file_path, failure))
+                entries = []
+
+            if entries:
+                self._replay(entries)
+                continue
+
+            # Nothing due - wait for an append, the next retry or for another process to append
+            with self._condition:
+                if not self._closed:
+                    wait_with_timer(self._condition, self._get_idle_seconds())
+
+    #############################################################################
+    # Claim the oldest press events of the buttons that have nothing in flight and are due - returns
+    # the (id, press event) of each, oldest first
+    def _claim_batch(self):
+
+        now = time.time()
+
+        with self._transaction() as cursor:
+
+            # Batches of a process that died - replay them again
+            cursor.execute("UPDATE outbox_entries SET state = 'pending', claimed_by = NULL WHERE kind = ? AND state = 'sending' AND claimed_at < ?",
+                           (self.kind, now - OUTBOX_CLAIM_TIMEOUT_SECONDS))
+
+            # A button's oldest press not given up on is its head - the button is due if its head is waiting and due
+            entries = cursor.execute(
+                "SELECT id, press_event FROM outbox_entries WHERE kind = ? AND state = 'pending' AND device IN ("
+                "    SELECT device FROM outbox_entries AS head WHERE kind = ? AND state = 'pending' AND next_attempt_at <= ? "
+                "    AND NOT EXISTS (SELECT 1 FROM outbox_entries WHERE kind = head.kind AND device = head.device AND state != 'failed' AND id < head.id)) "
+                "ORDER BY id LIMIT ?",
+                (self.kind, self.kind, now, self.batch_max_size)).fetchall()
+
+            if entries:
+                cursor.execute("UPDATE outbox_entries SET state = 'sending', claimed_by = ?, claimed_at = ? WHERE id IN ({})".format(','.join('?' * len(entries))),
+                               [os.getpid(), now] + [entry_id for entry_id, _ in entries])
+
+        return entries
+
+    #############################################################################
+    # Replay a claimed batch - the presses that went through are removed, the others are retried later
+    #
+    # Only a press whose result says it succeeded went through - one the batch has no result for is
+    # retried too.
+    def _replay(self, entries):
+
+        batch_event = {'Records': [{'messageId': str(entry_id), 'body': press_event} for entry_id, press_event in entries]}
+
+        try:
+            batch_results = dict((result['itemIdentifier'], result) for result in self.replay_batch(batch_event)['results'])
+            failures = dict((str(entry_id), batch_results.get(str(entry_id), {}).get('error', "No result for the press event"))
+                            for entry_id, _ in entries if batch_results.get(str(entry_id), {}).get('status') != 'SUCCESS')
+        except Exception as failure:
+            failures = dict((str(entry_id), str(failure)) for entry_id, _ in entries)
+
+        replayed_ids = [entry_id for entry_id, _ in entries if str(entry_id) not in failures]
+        failed_ids = [entry_id for entry_id, _ in entries if str(entry_id) in failures]
+        given_up_count = 0
+
+        with self._transaction() as cursor:
+            if replayed_ids:
+                cursor.execute("DELETE FROM outbox_entries WHERE id IN ({})".format(','.join('?' * len(replayed_ids))), replayed_ids)
+
+            for entry_id in failed_ids:
+                attempts = cursor.execute("SELECT attempts FROM outbox_entries WHERE id = ?", (entry_id,)).fetchone()[0] + 1
+                state = 'failed' if attempts >= self.max_attempts else 'pending'
+
+                if state == 'failed':
+                    given_up_count += 1
+                    self.demo_helper.logger.info("{} - ERROR   - Outbox - giving up on press event {} after {} attempts - {}".format(
+                        self.demo_helper.iot_button_serial_number, entry_id, attempts, failures[str(entry_id)]))
+
+                cursor.execute("UPDATE outbox_entries SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL WHERE id = ?",
+                               (state, attempts, time.time() + get_retry_seconds(attempts), failures[str(entry_id)], entry_id))
+
+        self.demo_helper.logger.info("{} - Outbox - replayed {} press events - {} to retry, {} given up on".format(
+            self.demo_helper.iot_button_serial_number, len(replayed_ids), len(failed_ids) - given_up_count, given_up_count))
+
+        with self._condition:
+            self._stats['replayed'] += len(replayed_ids)
+            self._stats['retried'] += len(failed_ids) - given_up_count
+            self._stats['failed'] += given_up_count
+            self._condition.notify_all()
+
+    #############################################################################
+    # Until the next retry is due - or OUTBOX_POLL_SECONDS at the most
+    def _get_idle_seconds(self):
+
+        with self._connection_lock:
+            next_attempt_at = self._connection.execute("SELECT MIN(next_attempt_at) FROM outbox_entries WHERE kind = ? AND state = 'pending'",
+                                                       (self.kind,)).fetchone()[0]
+
+        if next_attempt_at is None:
+            return OUTBOX_POLL_SECONDS
+
+        return min(max(next_attempt_at - time.time(), 0.01), OUTBOX_POLL_SECONDS)
+
+    #############################################################################
+    # The other processes sharing the file wait for it - rather than fail - while it is written
+    @contextmanager
+    def _transaction(self):
+
+        with self._connection_lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+
+            cursor.execute("COMMIT")
+
+#############################################################################
+# Open (or create) an outbox file - the connection is shared by the threads of an Outbox, which
+# take turns with it
+def open_outbox_file(file_path):
+
+    connection = sqlite3.connect(file_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = FULL")
+
+    connection.execute("CREATE TABLE IF NOT EXISTS outbox_entries ("
+                       "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                       "kind TEXT NOT NULL, "
+                       "device TEXT NOT NULL, "
+                       "press_event TEXT NOT NULL, "
+                       "compaction_key TEXT, "
+                       "state TEXT NOT NULL DEFAULT 'pending', "    # 'pending', 'sending' or 'failed'
+                       "attempts INTEGER NOT NULL DEFAULT 0, "
+                       "next_attempt_at REAL NOT NULL, "
+                       "claimed_by INTEGER, "
+                       "claimed_at REAL, "
+                       "appended_at REAL NOT NULL, "
+                       "last_error TEXT)")
+    connection.execute("CREATE INDEX IF NOT EXISTS outbox_entries_by_device ON outbox_entries (kind, device, id)")
+
+    return connection
+
+#############################################################################
+# The number of press events of kind in each state - for looking at an outbox from outside the
+# processes using it
+#
+# Plus 'untried' - the number of buttons whose next press to replay hasn't been tried yet. Once it
+# and 'sending' are both 0, every press still waiting is waiting for a retry.
+def get_outbox_counts(file_path, kind):
+
+    connection = open_outbox_file(file_path)
+    try:
+        outbox_counts = dict(connection.execute("SELECT state, COUNT(*) FROM outbox_entries WHERE kind = ? GROUP BY state", (kind,)).fetchall())
+        outbox_counts['untried'] = connection.execute(
+            "SELECT COUNT(*) FROM outbox_entries AS head WHERE kind = ? AND state = 'pending' AND attempts = 0 "
+            "AND NOT EXISTS (SELECT 1 FROM outbox_entries WHERE kind = head.kind AND device = head.device AND state != 'failed' AND id < head.id)",
+            (kind,)).fetchone()[0]
+        return outbox_counts
+    finally:
+        connection.close()
+
+#############################################################################
+def get_retry_seconds(attempts):
+    return min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+
+#############################################################################
+# Stop the drain workers before the interpreter tears down the modules they use - the press events
+# they haven't replayed are picked up by the next process to open the file
+
+@atexit.register
+def close_open_outboxes():
+    for outbox in list(_open_outboxes):
+        try:
+            outbox.close(timeout=5.0)
+        except Exception:
+            pass
+
+#############################################################################
@@ -0,0 +1,159 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+#############################################################################
+# In-process LRU cache with a per entry time to live and an optional JSON file backing.
+#
+# Lambda keeps module level objects alive between invocations of a warm container, and /tmp
+# survives as long as the container does. Keeping the cache at module level and mirroring it
+# to a file in /tmp lets warm invocations skip the lookups a previous invocation already made.
+#
+# Keys are tuples of strings (so that they can round trip through JSON), values must be JSON
+# serializable.
+
+class PersistentLRUCache:
+
+    #############################################################################
+    def __init__(self, max_entries, ttl_seconds, file_path=""):
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.file_path = file_path
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.load()
+
+    #############################################################################
+    def get(self, key):
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[1] < time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Move the entry to the most recently used end of the LRU order
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+
+            return entry[0]
+
+    #############################################################################
+    def put(self, key, value, ttl_seconds=None):
+        self.put_many([(key, value)], ttl_seconds)
+
+    #############################################################################
+    # Store several (key, value) pairs with a single write to the backing file
+    def put_many(self, items, ttl_seconds=None):
+
+        if ttl_seconds is None:
+            ttl_seconds = self.ttl_seconds
+
+        expires_at = time.time() + ttl_seconds
+
+        with self._lock:
+            for key, value in items:
+                if key in self._entries:
+                    del self._entries[key]
+                self._entries[key] = (value, expires_at)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            self.save()
+
+    #############################################################################
+    def invalidate(self, key):
+
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self.save()
+
+    #############################################################################
+    # Remove every entry for which predicate(key, value) is true - returns the number removed
+    def invalidate_matching(self, predicate):
+
+        with self._lock:
+            stale_keys = [key for key, entry in self._entries.items() if predicate(key, entry[0])]
+            for key in stale_keys:
+                del self._entries[key]
+
+            if stale_keys:
+                self.save()
+
+        return len(stale_keys)
+
+    #############################################################################
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+            self.save()
+
+    #############################################################################
+    def __len__(self):
+        return len(self._entries)
+
+    #############################################################################
+    # Load any unexpired entries from the backing file (if one is configured)
+    def load(self):
+
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+
+        try:
+            with open(self.file_path, 'r') as cache_file:
+                stored_entries = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            # A missing or corrupt cache file just means a cold cache
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, value, expires_at in stored_entries:
+                if expires_at > now:
+                    self._entries[tuple(key)] = (value, expires_at)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    #############################################################################
+    # Write the cache to the backing file - write to a temp file first so that a concurrent reader
+    # never sees a partially written file
+    def save(self):
+
+        if not self.file_path:
+            return
+
+        with self._lock:
+            stored_entries = [[list(key), entry[0], entry[1]] for key, entry in self._entries.items()]
+
+        temp_file_path = "{}.{}.{}".format(self.file_path, os.getpid(), threading.current_thread().ident)
+        try:
+            with open(temp_file_path, 'w') as cache_file:
+                json.dump(stored_entries, cache_file)
+            os.rename(temp_file_path, self.file_path)
+        except (IOError, OSError):
+            # The file backing is only an optimization - never fail a request because of it
+            pass
+
+#############################################################################
@@ -0,0 +1,271 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _common_setup import *
+from requests.packages.urllib3.exceptions import NewConnectionError
+import random
+import threading
+import time
+import urlparse
+
+#############################################################################
+# Request failures
+#
+# Raised instead of exit() so that a failed request can be handled by the caller (or by a worker
+# thread's owner) rather than always ending the whole Lambda invocation.
+
+class RequestFailedError(Exception):
+
+    def __init__(self, message, http_response=None):
+        Exception.__init__(self, message)
+        self.http_response = http_response
+
+class CircuitOpenError(RequestFailedError):
+    pass
+
+class DeadlineExceededError(RequestFailedError):
+    pass
+
+#############################################################################
+# Token bucket - at most rate_per_second requests on average, with bursts of up to capacity
+#
+# A 429 pauses the bucket for the Retry-After period and halves the rate, every success after
+# that adds a little of the rate back (until it is back to max_rate_per_second) - so under burst
+# load we send as fast as the API lets us, without getting throttled harder.
+
+class TokenBucket:
+
+    #############################################################################
+    def __init__(self, rate_per_second, capacity):
+
+        self.max_rate_per_second = float(rate_per_second)
+        self.rate_per_second = float(rate_per_second)
+        self.capacity = float(capacity)
+
+        self._tokens = float(capacity)
+        self._last_refill = time.time()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    #############################################################################
+    # Take a token, waiting for one if need be - returns False if none is available before the deadline
+    def acquire(self, deadline):
+
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_second)
+                self._last_refill = now
+
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+
+                wait_seconds = max(self._paused_until - now, (1 - self._tokens) / self.rate_per_second)
+
+            if now + wait_seconds > deadline:
+                return False
+
+            time.sleep(wait_seconds)
+
+    #############################################################################
+    def throttle(self, retry_after_seconds):
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + retry_after_seconds)
+            self.rate_per_second = max(self.rate_per_second / 2, REQUEST_MIN_RATE_PER_SECOND)
+            self._tokens = 0.0
+
+    #############################################################################
+    def record_success(self):
+
+        with self._lock:
+            self.rate_per_second = min(self.rate_per_second + REQUEST_RATE_RECOVERY_PER_SUCCESS, self.max_rate_per_second)
+
+#############################################################################
+# Circuit breaker - after failure_threshold consecutive failures, fail fast for reset_seconds, then
+# let a single trial request through to see if the host has recovered
+#
+# The trial belongs to the thread that was let through - if its request ends without an outcome
+# being recorded (e.g. a 429), end_trial() lets the next request be the trial instead.
+
+class CircuitBreaker:
+
+    #############################################################################
+    def __init__(self, failure_threshold, reset_seconds):
+
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    #############################################################################
+    def allow_request(self):
+
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            if time.time() - self._opened_at < self.reset_seconds or self._trial_thread is not None:
+                return False
+
+            # Half open - let one trial request through
+            self._trial_thread = threading.current_thread()
+            return True
+
+    #############################################################################
+    # Called once the current thread's request is over, whatever became of it
+    def end_trial(self):
+
+        with self._lock:
+            if self._trial_thread is threading.current_thread():
+                self._trial_thread = None
+
+    #############################################################################
+    def record_success(self):
+
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._trial_thread = None
+
+    #############################################################################
+    def record_failure(self):
+
+        with self._lock:
+            self._consecutive_failures += 1
+            self._trial_thread = None
+
+            if self._opened_at is not None or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.time()
+
+#############################################################################
+# Sends every request through a per host token bucket and circuit breaker
+#
+# 429s are retried after their Retry-After, 5xx and connection errors are retried with jittered
+# exponential backoff, and no request (including its retries) outlives its deadline.
+#
+# A request that isn't idempotent (a POST creating a field, asset, map layer... or notification) is
+# only retried when the API can't have acted on it - after a 429, or a failure to connect. A 5xx or
+# a read timeout may come after the resource was created, so retrying those would create it twice.
+
+class RequestScheduler:
+
+    #############################################################################
+    def __init__(self):
+
+        self._token_buckets = dict()
+        self._circuit_breakers = dict()
+        self._lock = threading.Lock()
+
+    #############################################################################
+    def get_token_bucket(self, host):
+
+        with self._lock:
+            if host not in self._token_buckets:
+                self._token_buckets[host] = TokenBucket(REQUEST_RATE_PER_SECOND, REQUEST_BURST_SIZE)
+            return self._token_buckets[host]
+
+    #############################################################################
+    def get_circuit_breaker(self, host):
+
+        with self._lock:
+            if host not in self._circuit_breakers:
+                self._circuit_breakers[host] = CircuitBreaker(CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS)
+            return self._circuit_breakers[host]
+
+    #############################################################################
+    # send_request(timeout) sends the request and returns its response - it may be called more than
+    # once. Returns the final response (which the caller still needs to check), the number of retries
+    # is recorded on it as retry_count.
+    def send(self, url, send_request, deadline_seconds=REQUEST_DEADLINE_SECONDS, idempotent=True):
+
+        host = urlparse.urlparse(url).netloc
+        token_bucket = self.get_token_bucket(host)
+        circuit_breaker = self.get_circuit_breaker(host)
+        deadline = time.time() + deadline_seconds
+
+        attempt = 0
+        while True:
+
+            if not circuit_breaker.allow_request():
+                raise CircuitOpenError("Circuit open for {} - not sending {}".format(host, url))
+
+            try:
+                if not token_bucket.acquire(deadline):
+                    raise DeadlineExceededError("Deadline exceeded waiting to send {}".format(url))
+
+                try:
+                    http_response = send_request(max(deadline - time.time(), 0.1))
+                    failure = None
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as connection_failure:
+                    http_response = None
+                    failure = connection_failure
+
+                if http_response is not None and http_response.status_code == 429:
+                    retry_after_seconds = get_retry_after_seconds(http_response)
+                    token_bucket.throttle(retry_after_seconds)
+                    retry_delay = retry_after_seconds
+                    retryable = True
+
+                elif http_response is None or http_response.status_code >= 500:
+                    circuit_breaker.record_failure()
+                    retry_delay = get_backoff_seconds(attempt)
+                    retryable = idempotent or (http_response is None and is_connect_failure(failure))
+
+                else:
+                    circuit_breaker.record_success()
+                    token_bucket.record_success()
+                    http_response.retry_count = attempt
+                    return http_response
+
+                # Give up if the request can't be retried, we are out of retries, or if waiting would take us past the deadline
+                if not retryable or attempt >= REQUEST_MAX_RETRIES or time.time() + retry_delay > deadline:
+                    if http_response is None:
+                        raise RequestFailedError("{} - {}".format(url, failure))
+                    http_response.retry_count = attempt
+                    return http_response
+
+                # The response is discarded - a streamed one would otherwise hold on to its connection
+                if http_response is not None:
+                    http_response.close()
+
+            finally:
+                circuit_breaker.end_trial()
+
+            time.sleep(retry_delay)
+            attempt += 1
+
+#############################################################################
+def get_retry_after_seconds(http_response):
+
+    try:
+        return max(float(http_response.headers.get('Retry-After', REQUEST_DEFAULT_RETRY_AFTER_SECONDS)), 0)
+    except ValueError:
+        # Retry-After can also be an HTTP date - just fall back to the default
+        return REQUEST_DEFAULT_RETRY_AFTER_SECONDS
+
+#############################################################################
+# A connection failure that happened before any of the request was sent - which makes it safe to
+# retry whatever the request was
+def is_connect_failure(failure):
+
+    if isinstance(failure, requests.exceptions.ConnectTimeout):
+        return True
+
+    if isinstance(failure, requests.exceptions.Timeout):
+        return False
+
+    reason = getattr(failure.args[0], 'reason', None) if failure.args else None
+    return isinstance(reason, NewConnectionError)
+
+#############################################################################
+# Full jitter - a random delay between 0 and the capped exponential backoff
+def get_backoff_seconds(attempt):
+    return random.uniform(0, min(REQUEST_BACKOFF_MAX_SECONDS, REQUEST_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+#############################################################################
@@ -0,0 +1,83 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import threading
+import time
+
+#############################################################################
+# Local name -> uri index of the resources in an org's collections (fields, assets, ...)
+#
+# Each collection uri (e.g. an org's fields link) gets its own index: a dict keyed by name plus a
+# self uri -> name map so that a delete can be applied without knowing the name. An index is
+# populated once from a full listing and then kept up to date in place by our own creates and
+# deletes, so that a lookup is a dict probe rather than a collection download. Indexes older
+# than max_age_seconds are treated as unpopulated so changes made outside of the demo are
+# eventually picked up.
+
+class ResourceDirectory:
+
+    #############################################################################
+    def __init__(self, max_age_seconds):
+
+        self.max_age_seconds = max_age_seconds
+
+        self._indexes = dict()
+        self._lock = threading.RLock()
+
+    #############################################################################
+    def is_populated(self, collection_uri):
+
+        with self._lock:
+            index = self._indexes.get(collection_uri)
+            return index is not None and index['populated_at'] + self.max_age_seconds > time.time()
+
+    #############################################################################
+    # Replace the index for a collection with the given (name, uri) pairs
+    def populate(self, collection_uri, named_uris):
+
+        index = {'by_name': dict(), 'by_uri': dict(), 'populated_at': time.time()}
+        for name, uri in named_uris:
+            index['by_name'][name] = uri
+            index['by_uri'][uri] = name
+
+        with self._lock:
+            self._indexes[collection_uri] = index
+
+    #############################################################################
+    # Returns the uri of the named resource, or "" if it isn't in the index
+    def lookup(self, collection_uri, name):
+
+        with self._lock:
+            index = self._indexes.get(collection_uri)
+            if index is None:
+                return ""
+            return index['by_name'].get(name, "")
+
+    #############################################################################
+    def add(self, collection_uri, name, uri):
+
+        with self._lock:
+            index = self._indexes.get(collection_uri)
+            if index is not None:
+                index['by_name'][name] = uri
+                index['by_uri'][uri] = name
+
+    #############################################################################
+    # Remove the resource with the given self uri from whichever index holds it
+    def remove_uri(self, uri):
+
+        with self._lock:
+            for index in self._indexes.values():
+                if uri in index['by_uri']:
+                    name = index['by_uri'].pop(uri)
+                    if index['by_name'].get(name) == uri:
+                        del index['by_name'][name]
+
+    #############################################################################
+    def invalidate(self, collection_uri):
+
+        with self._lock:
+            self._indexes.pop(collection_uri, None)
+
+#############################################################################
@@ -0,0 +1,158 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _collection_sync import is_removed_value
+import json
+
+#############################################################################
+# An API object as the demo holds on to it - its links indexed by rel, the few members the demo
+# looks at as attributes, and the rest of it kept as the JSON text it arrived as
+#
+# The links are turned into a rel -> uri dict once, when the object is decoded (see the Best
+# Practices notebook's convert_links_array_to_dictionary), so get_link() is a dict probe rather than
+# a scan of the links list. The payload is only decoded when it is asked for - the text of an
+# object takes a fraction of the memory its dicts and lists do, and listed objects are mostly only
+# needed for their links and names. Subclasses name the members they keep in __slots__ and read
+# them in read_members(). (__slots__ needs a new style class - hence object.)
+#
+#   field = Field.from_json(value, text)
+#   field.name, field.get_link('self'), field['farms']
+
+class Resource(object):
+
+    __slots__ = ('id', 'links', 'removed', '_payload')
+
+    #############################################################################
+    # value - the decoded object, text - its JSON text (utf-8), kept instead of value if given
+    @classmethod
+    def from_json(cls, value, text=None):
+
+        resource = cls()
+        resource.id = value.get('id')
+        resource.links = index_links(value.get('links', []))
+        resource.removed = is_removed_value(value)
+        resource._payload = text if text is not None else value
+        resource.read_members(value)
+
+        return resource
+
+    #############################################################################
+    # Copy the members the resource type keeps from the decoded object
+    def read_members(self, value):
+        pass
+
+    #############################################################################
+    # The uri of the given relationship - "" if the resource has no such link
+    def get_link(self, relationship):
+        return self.links.get(relationship, "")
+
+    #############################################################################
+    # The whole object - decoded again each time it is asked for, so keep it if it's needed more than once
+    @property
+    def payload(self):
+
+        if isinstance(self._payload, str):
+            return json.loads(self._payload)
+
+        return self._payload
+
+    #############################################################################
+    def __getitem__(self, key):
+        return self.payload[key]
+
+    #############################################################################
+    def get(self, key, default=None):
+        return self.payload.get(key, default)
+
+    #############################################################################
+    # The same object, as far as syncing a collection is concerned (see CollectionSync)
+    def __eq__(self, other):
+        return type(other) is type(self) and other.links == self.links and other._payload == self._payload
+
+    #############################################################################
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    #############################################################################
+    def __repr__(self):
+        return "<{} {}>".format(type(self).__name__, self.get_link('self') or self.id)
+
+#############################################################################
+class Organization(Resource):
+
+    __slots__ = ('name',)
+
+    #############################################################################
+    def read_members(self, value):
+        self.name = value.get('name', "")
+
+#############################################################################
+class Field(Resource):
+
+    __slots__ = ('name',)
+    name_key = 'name'           # What the demo finds it by - see DemoHelper.find_resource_uri
+
+    #############################################################################
+    def read_members(self, value):
+        self.name = value.get('name', "")
+
+#############################################################################
+class Asset(Resource):
+
+    __slots__ = ('title',)
+    name_key = 'title'
+
+    #############################################################################
+    def read_members(self, value):
+        self.title = value.get('title', "")
+
+#############################################################################
+class MapLayerSummary(Resource):
+
+    __slots__ = ('title',)
+
+    #############################################################################
+    def read_members(self, value):
+        self.title = value.get('title', "")
+
+#############################################################################
+class MapLayer(Resource):
+
+    __slots__ = ('title',)
+
+    #############################################################################
+    def read_members(self, value):
+        self.title = value.get('title', "")
+
+#############################################################################
+class FileResource(Resource):
+
+    __slots__ = ('mime_type',)
+
+    #############################################################################
+    def read_members(self, value):
+        self.mime_type = value.get('mimeType', "")
+
+#############################################################################
+# What delete_notifications filters on - see is_matching_notification
+class Notification(Resource):
+
+    __slots__ = ('title', 'severity', 'start_date', 'source_event')
+
+    #############################################################################
+    def read_members(self, value):
+
+        self.title = value.get('title', "")
+        self.severity = value.get('severity')
+        self.start_date = (value.get('timeRange') or {}).get('startDate') or ""
+        self.source_event = value.get('sourceEvent')
+
+#############################################################################
+# A JSON links list as a rel -> uri dict - the first link wins if a rel appears more than once
+def index_links(links):
+    return dict((link['rel'], link['uri']) for link in reversed(links))
+
+#############################################################################
@@ -0,0 +1,325 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _common_setup import *
+from collections import deque
+from contextlib import contextmanager
+import functools
+import itertools
+import re
+import threading
+import time
+import urlparse
+
+#############################################################################
+# Spans
+#
+# Every lambda_handler invocation is the root of a span tree - the helpers it calls, the HTTP
+# requests they send and the caches that answered instead are spans beneath it. The current span
+# is kept per thread, so work handed to another thread has to be bound to it (bind_to_current_span)
+# to land in the right tree.
+
+_thread_state = threading.local()
+_span_ids = itertools.count(1)
+
+class Span:
+
+    #############################################################################
+    def __init__(self, name, parent, attributes):
+
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent = parent
+        self.attributes = attributes
+        self.thread_id = threading.current_thread().ident
+        self.started_at = time.time()
+        self.finished_at = None
+
+        # Every span of a tree is collected on its root - ready to export once the root finishes
+        self.root = parent.root if parent else self
+        self.root_spans = None if parent else []
+        self.root.root_spans.append(self)
+
+    #############################################################################
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    #############################################################################
+    def finish(self):
+        self.finished_at = time.time()
+
+    #############################################################################
+    def get_duration_ms(self):
+        return ((self.finished_at or time.time()) - self.started_at) * 1000.0
+
+    #############################################################################
+    def to_dict(self):
+
+        return {
+            'trace_id': self.root.span_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent else None,
+            'name': self.name,
+            'start': self.started_at,
+            'duration_ms': round(self.get_duration_ms(), 3),
+            'thread_id': self.thread_id,
+            'attributes': self.attributes
+        }
+
+#############################################################################
+def get_current_span():
+    return getattr(_thread_state, 'span', None)
+
+#############################################################################
+@contextmanager
+def trace_span(name, **attributes):
+
+    parent = get_current_span()
+    span = Span(name, parent, attributes)
+    _thread_state.span = span
+
+    try:
+        yield span
+    except Exception as failure:
+        span.set(error="{}".format(failure))
+        raise
+    finally:
+        span.finish()
+        _thread_state.span = parent
+
+#############################################################################
+# Wrap function so that, whichever thread runs it, its spans are children of the current span
+def bind_to_current_span(function):
+
+    parent = get_current_span()
+
+    @functools.wraps(function)
+    def run_in_span(*args, **kwargs):
+        previous_span = get_current_span()
+        _thread_state.span = parent
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _thread_state.span = previous_span
+
+    return run_in_span
+
+#############################################################################
+def set_current_span_attributes(**attributes):
+
+    span = get_current_span()
+    if span:
+        span.set(**attributes)
+
+#############################################################################
+# A cache answered instead of the API - recorded as an (instant) span of its own
+def record_cache_hit(cache_layer, key=None):
+
+    parent = get_current_span()
+    if parent is None:
+        return
+
+    span = Span("cache hit - {}".format(cache_layer), parent, {'cache': cache_layer, 'key': "{}".format(key)})
+    span.finish()
+
+#############################################################################
+# Wraps a scheduled request in a span and records its latency - see DemoHelper.send_scheduled_request
+@contextmanager
+def trace_request(method, url):
+
+    endpoint = get_endpoint_template(method, url)
+
+    with trace_span(endpoint, method=method, url=url) as span:
+        try:
+            yield span
+        finally:
+            LATENCY_HISTOGRAMS.record(endpoint, span.get_duration_ms())
+
+#############################################################################
+# A streamed response hasn't been read yet (and reading it here would defeat the streaming) - its
+# bytes_received are recorded once whatever reads it has (see record_body_read)
+def record_response(span, http_response, streamed=False):
+
+    request_body = http_response.request.body
+    if hasattr(request_body, 'bytes_read'):
+        bytes_sent = request_body.bytes_read    # A ProgressStream - see _upload_stream
+    else:
+        bytes_sent = len(request_body) if request_body else 0
+
+    span.set(status=http_response.status_code,
+             retries=getattr(http_response, 'retry_count', 0),
+             bytes_sent=bytes_sent,
+             bytes_received=0 if streamed else len(http_response.content or ''))
+
+    if streamed:
+        on_body_read(http_response, lambda bytes_read: span.set(bytes_received=bytes_read))
+
+#############################################################################
+# Have callback(bytes_read) called once the body of a streamed response has been read
+#
+# Its Content-Length can't stand in for that - it is the compressed size of a gzipped body, and
+# a chunked response has none - so whatever reads the body reports the bytes it decoded.
+def on_body_read(http_response, callback):
+    http_response.body_read_callbacks = getattr(http_response, 'body_read_callbacks', []) + [callback]
+
+#############################################################################
+# Called by whatever read the body of a streamed response (e.g. a CollectionPageStream) when it is done
+def record_body_read(http_response, bytes_read):
+
+    callbacks = getattr(http_response, 'body_read_callbacks', [])
+    http_response.body_read_callbacks = []
+
+    for callback in callbacks:
+        callback(bytes_read)
+
+#############################################################################
+# "GET https://sandboxapi.deere.com/platform/organizations/1234/fields;start=0;count=100"
+#   -> "GET sandboxapi.deere.com/platform/organizations/{id}/fields"
+def get_endpoint_template(method, url):
+
+    parsed_url = urlparse.urlparse(url)
+    path_segments = [re.sub(r';.*$', '', path_segment) for path_segment in parsed_url.path.split('/')]
+
+    return "{} {}{}".format(method, parsed_url.netloc,
+                            '/'.join('{id}' if re.search(r'\d', path_segment) else path_segment for path_segment in path_segments))
+
+#############################################################################
+# Latency histograms - the most recent request times of every endpoint template
+
+class LatencyHistograms:
+
+    #############################################################################
+    def __init__(self, max_samples):
+
+        self.max_samples = max_samples
+
+        self._samples = dict()
+        self._counts = dict()
+        self._lock = threading.Lock()
+
+    #############################################################################
+    def record(self, endpoint, duration_ms):
+
+        with self._lock:
+            if endpoint not in self._samples:
+                self._samples[endpoint] = deque(maxlen=self.max_samples)
+                self._counts[endpoint] = 0
+
+            self._samples[endpoint].append(duration_ms)
+            self._counts[endpoint] += 1
+
+    #############################################################################
+    # {endpoint: {'count', 'p50', 'p95', 'p99'}} - percentiles in ms
+    def get_percentiles(self):
+
+        with self._lock:
+            samples_by_endpoint = dict((endpoint, sorted(samples)) for endpoint, samples in self._samples.items())
+            counts = dict(self._counts)
+
+        return dict((endpoint, {
+                        'count': counts[endpoint],
+                        'p50': get_percentile(samples, 50),
+                        'p95': get_percentile(samples, 95),
+                        'p99': get_percentile(samples, 99)
+                    }) for endpoint, samples in samples_by_endpoint.items())
+
+    #############################################################################
+    def clear(self):
+
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+#############################################################################
+# Nearest rank percentile of already sorted samples
+def get_percentile(sorted_samples, percent):
+    return sorted_samples[max(int(-(-len(sorted_samples) * percent // 100)) - 1, 0)]
+
+# Kept across warm invocations
+LATENCY_HISTOGRAMS = LatencyHistograms(LATENCY_HISTOGRAM_MAX_SAMPLES)
+
+#############################################################################
+# Trace a whole lambda_handler invocation - logs a summary of its requests and appends its span
+# tree to TRACE_FILE (if set)
+def trace_handler(handler):
+
+    @functools.wraps(handler)
+    def traced_handler(event, context):
+
+        invocation_span = None
+        try:
+            with trace_span("{}.lambda_handler".format(handler.__module__)) as invocation_span:
+                return handler(event, context)
+        finally:
+            if invocation_span is not None:
+                log_trace_summary(invocation_span)
+                export_trace(invocation_span)
+
+    return traced_handler
+
+#############################################################################
+def log_trace_summary(invocation_span):
+
+    request_spans = [span for span in invocation_span.root_spans if 'status' in span.attributes]
+    cache_hit_spans = [span for span in invocation_span.root_spans if 'cache' in span.attributes]
+
+    logging.getLogger().info("{} - Trace - {} requests ({} retries, {} bytes sent, {} bytes received) - {} cache hits - {:.0f} ms".format(
+        invocation_span.attributes.get('iot_button_serial_number', ''),
+        len(request_spans),
+        sum(span.attributes['retries'] for span in request_spans),
+        sum(span.attributes['bytes_sent'] for span in request_spans),
+        sum(span.attributes['bytes_received'] for span in request_spans),
+        len(cache_hit_spans),
+        invocation_span.get_duration_ms()))
+
+#############################################################################
+# Append the span tree to TRACE_FILE - either a JSON object per line, or Chrome trace events
+#
+# The Chrome trace JSON array format allows the closing ] to be left off, so events from later
+# invocations can simply be appended.
+def export_trace(invocation_span, file_path=None, trace_format=None):
+
+    file_path = file_path if file_path is not None else TRACE_FILE
+    trace_format = trace_format or TRACE_FORMAT
+
+    if not file_path:
+        return
+
+    spans = [span.to_dict() for span in invocation_span.root_spans]
+
+    try:
+        if trace_format == 'chrome':
+            is_new_file = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+            with open(file_path, 'a') as trace_file:
+                if is_new_file:
+                    trace_file.write("[\n")
+                for span in spans:
+                    trace_file.write(json.dumps(get_chrome_trace_event(span), separators=(',', ':')) + ",\n")
+        else:
+            with open(file_path, 'a') as trace_file:
+                for span in spans:
+                    trace_file.write(json.dumps(span, separators=(',', ':')) + "\n")
+
+    except (IOError, OSError) as failure:
+        # Tracing must never fail an invocation
+        logging.getLogger().info("ERROR   - Could not export trace to {} - {}".format(file_path, failure))
+
+#############################################################################
+def get_chrome_trace_event(span):
+
+    arguments = dict(span['attributes'])
+    arguments.update(span_id=span['span_id'], parent_id=span['parent_id'])
+
+    return {
+        'name': span['name'],
+        'cat': 'request' if 'status' in span['attributes'] else 'cache' if 'cache' in span['attributes'] else 'span',
+        'ph': 'X',
+        'ts': int(span['start'] * 1000000),
+        'dur': int(span['duration_ms'] * 1000),
+        'pid': span['trace_id'],
+        'tid': span['thread_id'],
+        'args': arguments
+    }
+
+#############################################################################
@@ -0,0 +1,86 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _common_setup import *
+from requests.adapters import HTTPAdapter
+import threading
+
+#############################################################################
+# Pooled, keep-alive HTTP sessions shared across warm Lambda invocations
+#
+# Building a new session per invocation throws away its connection pool, so every invocation pays
+# for new TCP + TLS handshakes. Sessions created here are kept at module level - one OAuth session
+# per credential set plus one plain session for the non-MyJohnDeere calls (Google Maps, images) -
+# and each host gets a connection pool sized by TRANSPORT_HOST_POOL_SIZES.
+
+_sessions = dict()
+_sessions_lock = threading.Lock()
+
+#############################################################################
+def get_oauth_session(client_key, client_secret, resource_owner_key, resource_owner_secret):
+
+    session_key = ('oauth', client_key, client_secret, resource_owner_key, resource_owner_secret)
+
+    with _sessions_lock:
+        if session_key not in _sessions:
+            # Only the MyJohnDeere calls need it - imported on first use
+            from requests_oauthlib.oauth1_session import OAuth1Session
+
+            _sessions[session_key] = configure_session(OAuth1Session(client_key, client_secret=client_secret,
+                                                                     resource_owner_key=resource_owner_key,
+                                                                     resource_owner_secret=resource_owner_secret))
+        return _sessions[session_key]
+
+#############################################################################
+def get_plain_session():
+
+    session_key = ('plain',)
+
+    with _sessions_lock:
+        if session_key not in _sessions:
+            _sessions[session_key] = configure_session(requests.Session())
+        return _sessions[session_key]
+
+#############################################################################
+# Mount a pooled adapter per configured host, plus a default one for every other host
+def configure_session(session):
+
+    session.mount('https://', HTTPAdapter(pool_maxsize=TRANSPORT_DEFAULT_POOL_SIZE))
+    session.mount('http://', HTTPAdapter(pool_maxsize=TRANSPORT_DEFAULT_POOL_SIZE))
+
+    for host, pool_size in TRANSPORT_HOST_POOL_SIZES.items():
+        session.mount("https://{}/".format(host), HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    return session
+
+#############################################################################
+# How many requests were sent over all sessions, and how many of those reused an open connection
+def get_connection_stats():
+
+    request_count = 0
+    new_connection_count = 0
+
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+
+    for session in sessions:
+
+        # The same adapter can be mounted for several prefixes - only count it once
+        adapters = dict((id(adapter), adapter) for adapter in session.adapters.values())
+
+        for adapter in adapters.values():
+            connection_pools = adapter.poolmanager.pools
+            for pool_key in connection_pools.keys():
+                connection_pool = connection_pools.get(pool_key)
+                if connection_pool is not None:
+                    request_count += connection_pool.num_requests
+                    new_connection_count += connection_pool.num_connections
+
+    return {
+        'requests': request_count,
+        'new_connections': new_connection_count,
+        'reused_connections': max(request_count - new_connection_count, 0),
+    }
+
+#############################################################################
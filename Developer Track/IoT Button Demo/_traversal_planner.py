@@ -0,0 +1,191 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from collections import OrderedDict
+import re
+import threading
+import urllib
+import urlparse
+
+#############################################################################
+# Traversal planner constants
+
+# The links a collection page needs whatever its values are followed for
+COLLECTION_PAGE_LINKS = ('self', 'nextPage')
+
+CATALOG_KIND = ('', True)       # The API catalog (BASE_URI) - as if it were the one member of a collection named ''
+
+#############################################################################
+# Works out the showLinks request parameter for the GETs of a link traversal
+#
+# Every resource the API returns comes with all of its links (an organization has dozens), although
+# the demo only ever follows one or two of them - and the notebook shows that asking for just those
+# (showLinks) can halve a response. Callers declare the paths they follow, as the relationships
+# followed from the API catalog:
+#
+#   planner.add_path('organizations', 'fields', 'mapLayerSummaries')
+#
+# plan(uri) then adds the smallest showLinks that serves every declared path to a GET of
+# the uri. The kind of resource a uri is comes from its path - "organizations/4321" is a member of
+# the organizations collection, "organizations/4321/fields" is the fields collection (segments with
+# digits in them are ids, as in _tracing.get_endpoint_template). Resources of kinds no path goes
+# through are requested with all of their links, as before.
+#
+# The links listed with a collection's values are only the planned ones, so they are all the
+# traversal needs from those resources - remember_listed_links() keeps them, and links_listed()
+# answers from them instead of GETting the resource (each such answer is a request saved).
+#
+# record_response() counts the bytes of every API GET response - towards the planned requests if
+# the uri carries a plan, otherwise towards the unplanned ones. With the planner disabled every
+# request is unplanned, so the two sets of stats give the bytes received with and without the plan.
+
+class TraversalPlanner:
+
+    #############################################################################
+    def __init__(self, base_uri, enabled=True, max_listed_links=1024):
+
+        self.base_uri = base_uri
+        self.enabled = enabled
+        self._base_uri = urlparse.urlparse(base_uri)
+        self.max_listed_links = max_listed_links
+
+        self._shown_links = dict()              # Resource kind -> the relationships followed from it
+        self._collections = set()               # Collections some path goes through
+        self._listed_links = OrderedDict()      # Self uri of a listed resource -> its rel -> uri links
+        self._lock = threading.Lock()
+
+        self.reset_stats()
+
+    #############################################################################
+    # relationships - followed one after the other from the API catalog, each leading to a collection
+    def add_path(self, *relationships):
+
+        with self._lock:
+            kind = CATALOG_KIND
+            for relationship in relationships:
+                self._shown_links.setdefault(kind, set()).add(relationship)
+                self._collections.add(relationship)
+                kind = (relationship, True)
+
+    #############################################################################
+    # The uri to GET - with the showLinks parameter of the plan added
+    #
+    # relationships - the links the caller is about to follow from the resource (in case no declared
+    #                 path says so)
+    def plan(self, uri, relationships=()):
+
+        if not self.enabled:
+            return uri
+
+        # e.g. a nextPage link of a planned page already has them
+        if re.search(r'[?&]showLinks=', uri):
+            return uri
+
+        kind = self.get_resource_kind(uri)
+        if kind is None:
+            return uri
+
+        params = []
+        with self._lock:
+            name, is_member = kind
+
+            if is_member and kind in self._shown_links:
+                params.append(('showLinks', self._shown_links[kind].union(relationships)))
+
+            elif not is_member and name in self._collections:
+                params.append(('showLinks', self._shown_links.get((name, True), set()).union(COLLECTION_PAGE_LINKS)))
+
+        if not params:
+            return uri
+
+        return "{}{}{}".format(uri, '&' if '?' in uri else '?', urllib.urlencode([(key, ','.join(sorted(values))) for key, values in params]))
+
+    #############################################################################
+    # Count a GET response (or bytes_received of it) - uri is the one requested, plan included
+    def record_response(self, uri, bytes_received):
+
+        if self.get_resource_kind(uri) is None:
+            return
+
+        planning = 'planned' if re.search(r'[?&]showLinks=', uri) else 'unplanned'
+
+        with self._lock:
+            self._stats['{}_requests'.format(planning)] += 1
+            self._stats['{}_bytes'.format(planning)] += bytes_received
+
+    #############################################################################
+    # Keep the links a resource was listed with, if the plan follows links from it - resource is a
+    # _resources.Resource
+    def remember_listed_links(self, resource):
+
+        self_uri = resource.get_link('self')
+        if not self.enabled or not self_uri:
+            return
+
+        kind = self.get_resource_kind(self_uri)
+
+        with self._lock:
+            if kind not in self._shown_links:
+                return
+
+            self._listed_links.pop(self_uri, None)
+            self._listed_links[self_uri] = resource.links
+
+            while len(self._listed_links) > self.max_listed_links:
+                self._listed_links.popitem(last=False)
+
+    #############################################################################
+    # The links a resource was listed with, if they include the relationship - None if the resource
+    # has to be fetched for it
+    def links_listed(self, resource_uri, relationship):
+
+        with self._lock:
+            links = self._listed_links.get(resource_uri)
+            if links is None or relationship not in links:
+                return None
+
+            # A GET would have cached all of them too - so the resource is only ever answered for once
+            del self._listed_links[resource_uri]
+            self._stats['requests_saved'] += 1
+
+            return links
+
+    #############################################################################
+    def forget(self, resource_uri):
+
+        with self._lock:
+            self._listed_links.pop(resource_uri, None)
+
+    #############################################################################
+    # ("fields", True) for a field, ("fields", False) for a fields collection, CATALOG_KIND for
+    # the catalog - None for a uri outside of the API
+    def get_resource_kind(self, uri):
+
+        parsed_uri = urlparse.urlparse(uri)
+        base_path = self._base_uri.path
+
+        if parsed_uri.netloc != self._base_uri.netloc or not parsed_uri.path.startswith(base_path.rstrip('/')):
+            return None
+
+        segments = [re.sub(r';.*$', '', segment) for segment in parsed_uri.path[len(base_path):].split('/') if segment]
+        if not segments:
+            return CATALOG_KIND
+
+        if re.search(r'\d', segments[-1]) is None:
+            return (segments[-1], False)
+
+        names = [segment for segment in segments if re.search(r'\d', segment) is None]
+        return (names[-1], True) if names else None
+
+    #############################################################################
+    def get_stats(self):
+
+        with self._lock:
+            return dict(self._stats)
+
+    #############################################################################
+    def reset_stats(self):
+        self._stats = {'planned_requests': 0, 'planned_bytes': 0, 'unplanned_requests': 0, 'unplanned_bytes': 0, 'requests_saved': 0}
+
+#############################################################################
@@ -0,0 +1,132 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _common_setup import *
+from _tracing import record_body_read
+import mmap
+import time
+
+#############################################################################
+# Upload streaming constants
+
+UPLOAD_CHUNK_SIZE = 64 * 1024                   # Bytes read from the source at a time
+UPLOAD_PROGRESS_INTERVAL = 16 * 1024 * 1024     # Log progress every time this many more bytes have been sent
+
+#############################################################################
+# File-like wrapper around an upload source which reports progress and throughput as it is read
+#
+# requests reads the body a chunk at a time as it writes it to the socket, so only one chunk of
+# the source is ever held in memory. When the size of the source is known it is exposed as len, so
+# that requests sends a Content-Length - otherwise the body is sent with chunked transfer encoding.
+
+class ProgressStream:
+
+    #############################################################################
+    def __init__(self, read_source, length, description, logger, close_source=None):
+
+        self.read_source = read_source
+        self.description = description
+        self.logger = logger
+        self.close_source = close_source
+
+        if length is not None:
+            self.len = length
+
+        self.bytes_read = 0
+        self.started_at = None
+        self._next_progress_at = UPLOAD_PROGRESS_INTERVAL
+
+    #############################################################################
+    def read(self, size=UPLOAD_CHUNK_SIZE):
+
+        if self.started_at is None:
+            self.started_at = time.time()
+
+        if size is None or size < 0:
+            size = UPLOAD_CHUNK_SIZE
+
+        chunk = self.read_source(size)
+        self.bytes_read += len(chunk)
+
+        if not chunk:
+            self.log_progress("finished")
+            self.close()
+        elif self.bytes_read >= self._next_progress_at:
+            self._next_progress_at += UPLOAD_PROGRESS_INTERVAL
+            self.log_progress("in progress")
+
+        return chunk
+
+    #############################################################################
+    def __iter__(self):
+
+        chunk = self.read()
+        while chunk:
+            yield chunk
+            chunk = self.read()
+
+    #############################################################################
+    def close(self):
+
+        if self.close_source is not None:
+            self.close_source()
+            self.close_source = None
+
+    #############################################################################
+    def get_throughput(self):
+
+        elapsed_seconds = time.time() - self.started_at if self.started_at else 0
+        return self.bytes_read / elapsed_seconds if elapsed_seconds > 0 else 0.0
+
+    #############################################################################
+    def log_progress(self, status):
+
+        total = "{:.1f} MB".format(self.len / 1048576.0) if hasattr(self, 'len') else "unknown size"
+        self.logger.info("{} - Upload {} - {:.1f} MB of {} - {:.2f} MB/s".format(
+            self.description, status, self.bytes_read / 1048576.0, total, self.get_throughput() / 1048576.0))
+
+#############################################################################
+# Open an upload source - either an http(s) url, which is streamed straight from the response, or
+# a local file, which is memory mapped so that the OS pages it in (and out) as it is sent
+#
+# The url is fetched through demo_helper (see DemoHelper.process_http_get_request) - a source that
+# can't be fetched raises a RequestFailedError.
+def open_upload_source(source, demo_helper, description=None):
+
+    description = description or source
+    logger = demo_helper.logger
+
+    if source.startswith('http://') or source.startswith('https://'):
+
+        http_response = demo_helper.process_http_get_request(source, "Upload source opened", stream=True)
+        http_response.raw.decode_content = True
+
+        content_length = http_response.headers.get('Content-Length')
+        length = int(content_length) if content_length and not http_response.headers.get('Content-Encoding') else None
+
+        upload_stream = ProgressStream(http_response.raw.read, length, description, logger)
+
+        def close_response():
+            http_response.close()
+            record_body_read(http_response, upload_stream.bytes_read)
+
+        upload_stream.close_source = close_response
+        return upload_stream
+
+    source_file = open(source, 'rb')
+    length = os.fstat(source_file.fileno()).st_size
+
+    if length == 0:
+        # An empty file can't be memory mapped
+        return ProgressStream(source_file.read, 0, description, logger, source_file.close)
+
+    mapped_file = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close_mapped_file():
+        mapped_file.close()
+        source_file.close()
+
+    return ProgressStream(mapped_file.read, length, description, logger, close_mapped_file)
+
+#############################################################################
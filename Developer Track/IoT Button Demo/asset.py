@@ -3,7 +3,13 @@
 # of the MIT license.  See the LICENSE file for details.
 
 from _common_setup import *
-from _demo_helper import DemoHelper
+from _async_demo_helper import AsyncDemoHelper
+from _demo_helper import is_batch_event, BATCH_SERIAL_NUMBER
+from _tracing import trace_handler
+from _asset_location_writer import AssetLocationWriter
+from _json_encoding import PayloadTemplate, Slot
+from _resources import Asset
+import threading
 
 #############################################################################
 # Modify the params below to customize your demo
@@ -35,25 +41,128 @@ DEMO_PARAMS = {
 }
 
 
+#############################################################################
+# Payload templates - see _json_encoding.PayloadTemplate
+
+# The GeoJSON of an asset location - sent as a string within the location
+ASSET_GEOMETRY_TEMPLATE = PayloadTemplate({
+    "type": "Feature",
+    "geometry": {
+        "geometries": [
+            {
+                "coordinates": [Slot('longitude'), Slot('latitude')],
+                "type": "Point"
+            }
+        ],
+        "type": "GeometryCollection"
+    }
+})
+
+ASSET_LOCATION_PAYLOAD_TEMPLATE = PayloadTemplate({
+    "@type": "ContributedAssetLocation",
+    "timestamp": Slot('timestamp'),
+    "geometry": Slot('geometry'),
+    "measurementData": [{
+        "@type": "BasicMeasurement",
+        "name": Slot('measurement_1_name'),
+        "value": Slot('measurement_1_value'),
+        "unit": Slot('measurement_1_unit'),
+    }, {
+        "@type": "BasicMeasurement",
+        "name": Slot('measurement_2_name'),
+        "value": Slot('measurement_2_value'),
+        "unit": Slot('measurement_2_unit'),
+    }, {
+        "@type": "BasicMeasurement",
+        "name": Slot('measurement_3_name'),
+        "value": Slot('measurement_3_value'),
+        "unit": Slot('measurement_3_unit'),
+    }]
+})
+
+# The measurements of an asset are the same for every location - ASSET_LOCATION_PAYLOAD_TEMPLATE
+# with them filled in, keyed by their values
+ASSET_MEASUREMENT_SLOT_NAMES = tuple(name for name in ASSET_LOCATION_PAYLOAD_TEMPLATE.slot_names if name.startswith('measurement_'))
+asset_location_templates = dict()
+
 #############################################################################
 # Lambda entry/invocation point
 
-demo_helper = DemoHelper()
+demo_helper = AsyncDemoHelper()
+
+# The links this handler follows besides the ones every handler does - see DemoHelper.plan_traversal
+demo_helper.plan_traversal('organizations', 'assets', 'locations')
 
+# With OUTBOX_ENABLED presses are only recorded here and replayed in the background - see DemoHelper.open_outbox
+demo_helper.open_outbox('asset', lambda batch_event: process_press_batch(batch_event), lambda press_event: get_press_compaction_key(press_event))
+
+@trace_handler
 def lambda_handler(event, context):
 
+    # Many presses at once (e.g. from an SQS queue) - returns the outcome of each one
+    if is_batch_event(event):
+        demo_helper.setup(BATCH_SERIAL_NUMBER)
+
+        if demo_helper.outbox is not None:
+            return demo_helper.record_in_outbox(event)
+
+        return process_press_batch(event)
+
     demo_helper.setup(event['serialNumber'])
     event_type = event['clickType']
     demo_helper.logger.info("{} - {} press event received".format(demo_helper.iot_button_serial_number, event_type))
 
+    if demo_helper.outbox is not None:
+        return demo_helper.record_in_outbox(event)
+
+    # The field for the notification doesn't depend on the asset - look it up/create it in the meantime
+    field_name = demo_helper.iot_button_serial_number
+    field_uri = demo_helper.create_field_async(field_name)
+
+    process_button_press(event_type, field_uri)
+
+    flush_asset_locations()
+    demo_helper.flush_notifications()
+
+    demo_helper.log_connection_stats()
+    demo_helper.log_traversal_plan_stats()
+    demo_helper.log_latency_histograms()
+
+    return 'SUCCESS'
+
+#############################################################################
+# A button's presses are processed in order, as a DOUBLE press undoes a SINGLE press
+def process_press_batch(batch_event):
+
+    batch_results = demo_helper.process_event_batch(batch_event, demo_helper.create_field,
+                                                    lambda press_event, field_uri: process_button_press(press_event['clickType'], field_uri, press_event.get('pressedAt')),
+                                                    ordered=True)
+
+    # Send the batch's asset locations before the Lambda is frozen (its notifications have been sent)
+    flush_asset_locations()
+
+    return batch_results
+
+#############################################################################
+# A SINGLE press only moves the asset - a later SINGLE press waiting in the outbox supersedes it
+# (a DOUBLE press in between doesn't let it, see _outbox.Outbox)
+def get_press_compaction_key(press_event):
+    return 'location' if press_event['clickType'] == 'SINGLE' else None
+
+#############################################################################
+# Note - field_uri can still be pending (see AsyncDemoHelper.create_field_async)
+# pressed_at - when the press was made, if it is being replayed (see DemoHelper.record_in_outbox)
+def process_button_press(event_type, field_uri, pressed_at=None):
+
     asset_title = demo_helper.iot_button_serial_number
     asset_location = DEMO_PARAMS['asset_location']
     asset_details = DEMO_PARAMS['asset_details']
 
     # Upon a SINGLE press - create an asset if it doesn't already exist and update its location
     if 'SINGLE' == event_type:
+        gps = demo_helper.submit(demo_helper.determine_gps_coordinates, asset_location)
         asset_uri = create_asset(asset_title, asset_details)
-        update_asset(asset_title, asset_uri, asset_location, asset_details)
+        update_asset(asset_title, asset_uri, asset_location, asset_details, demo_helper.wait(gps), pressed_at)
         notification_text = 'Asset Updated'
 
     # Upon a DOUBLE press - remove the asset completely
@@ -61,120 +170,140 @@ def lambda_handler(event, context):
         delete_asset(asset_title)
         notification_text = 'Asset Deleted'
 
-    elif 'LONG' == event_type:
-        print "Nothing to do - no action defined for LONG event..."
+    # Nothing is done upon any other press - so there is nothing to notify about either
+    else:
+        demo_helper.logger.info("{} - Nothing to do - no action defined for {} event".format(demo_helper.iot_button_serial_number, event_type))
+        return
 
     # Post a notification to alert the user that a map layer has been created
-    field_name = demo_helper.iot_button_serial_number
-    field_uri = demo_helper.create_field(field_name)
     notification_title = "{} - {} - {} - {}".format(demo_helper.iot_button_serial_number, notification_text, asset_details['category'], asset_details['type'])
-    demo_helper.contribute_notification(field_uri, notification_title, {'severity' : 'LOW', 'type' : 'ANNOUNCEMENT', 'text' : notification_text})
-
-    return 'SUCCESS'
+    demo_helper.queue_notification(demo_helper.wait(field_uri), notification_title, {'severity' : 'LOW', 'type' : 'ANNOUNCEMENT', 'text' : notification_text})
 
 #############################################################################
 def get_asset(asset_name):
 
-    asset_uri = ''
-
     # Get this list of assets for this org
     demo_org_uri = demo_helper.get_demo_org_uri()
     assets_uri = demo_helper.get_relationship_uri(demo_org_uri, 'assets')
-    http_response = demo_helper.process_http_oauth_get_request(assets_uri  + ';count=100', "Asset list retrieved")
-    json_response = http_response.json()
 
     # Check if the asset exist and return it if it does
-    if json_response['total'] > 0:
-        asset_list = json_response['values']
-        for asset in asset_list:
-            if asset['title'] == asset_name:
-                if asset['links'] > 0:
-                    link_list = asset['links']
-                    for link in link_list:
-                        if link['rel'] == "self":
-                            asset_uri = link['uri']
-                            break
-
-    return asset_uri
+    return demo_helper.find_resource_uri(assets_uri, Asset, asset_name, "Asset list retrieved")
 
 #############################################################################
 def create_asset(asset_title, asset_details):
 
-    # First check to see if the asset already exists
-    asset_uri = get_asset(asset_title)
-
-    # If the asset doesn't exist - create it...
-    if asset_uri == '':
-
-        # Prep the contribution uris
-        contribution_definitions_uri = demo_helper.get_relationship_uri(BASE_URI, "contributionDefinitions")
-        notification_contribution_definition_uri = "{}/{}".format(contribution_definitions_uri, ASSET_CONTRIBUTION_DEFINITION)
-
-        body = {
-            "title": asset_title,
-            "text": asset_details['text'],
-            "assetCategory": asset_details['category'],
-            "assetType": asset_details['type'],
-            "assetSubType": asset_details['sub_type'],
-            "links": [
-                {
-                    "@type": "Link",
-                    "rel": "contributionDefinition",
-                    "uri": notification_contribution_definition_uri
-                }
-            ]
-        }
-
-        # Post the asset - retrieve the asset guid from the response header
-        demo_org_uri = demo_helper.get_demo_org_uri()
-        assets_uri = demo_helper.get_relationship_uri(demo_org_uri, 'assets')
-        http_response = demo_helper.process_http_oauth_post_request(assets_uri, body, "New asset created")
-        asset_uri =  http_response.headers['Location']
+    assets_uri = demo_helper.get_relationship_uri(demo_helper.get_demo_org_uri(), 'assets')
+
+    return demo_helper.create_or_get("assets", asset_title, assets_uri,
+                                     lambda: get_asset(asset_title) or post_asset(assets_uri, asset_title, asset_details))
+
+#############################################################################
+def post_asset(assets_uri, asset_title, asset_details):
+
+    # Prep the contribution uris
+    contribution_definitions_uri = demo_helper.get_relationship_uri(BASE_URI, "contributionDefinitions")
+    notification_contribution_definition_uri = "{}/{}".format(contribution_definitions_uri, ASSET_CONTRIBUTION_DEFINITION)
+
+    body = {
+        "title": asset_title,
+        "text": asset_details['text'],
+        "assetCategory": asset_details['category'],
+        "assetType": asset_details['type'],
+        "assetSubType": asset_details['sub_type'],
+        "links": [
+            {
+                "@type": "Link",
+                "rel": "contributionDefinition",
+                "uri": notification_contribution_definition_uri
+            }
+        ]
+    }
+
+    # Post the asset - retrieve the asset guid from the response header
+    http_response = demo_helper.process_http_oauth_post_request(assets_uri, body, "New asset created")
+    asset_uri =  http_response.headers['Location']
+    demo_helper.resource_directory.add(assets_uri, asset_title, asset_uri)
 
     return asset_uri
 
 #############################################################################
-def update_asset(asset_title, asset_uri, asset_location, asset_details):
+def update_asset(asset_title, asset_uri, asset_location, asset_details, gps=None, timestamp=None):
 
     #############################################################################
     # Determine GPS Coordinates for location
-    # Determine the GPS coordinates for the address specified by MAP_LAYER_LOCATION
-    gps = demo_helper.determine_gps_coordinates(asset_location)
+    # Determine the GPS coordinates for the address specified by MAP_LAYER_LOCATION (unless the caller already has)
+    if gps is None:
+        gps = demo_helper.determine_gps_coordinates(asset_location)
 
     # For the purpose of this demo, randomly alter the location of the asset to make it appear that has
     # changed location in OpsCenter
-    latitude = str(float(gps['lat']) + random.uniform(-0.1,0.1))
-    longitude = str(float(gps['lon']) + random.uniform(-0.1,0.1))
+    latitude = float(gps['lat']) + random.uniform(-0.1,0.1)
+    longitude = float(gps['lon']) + random.uniform(-0.1,0.1)
 
     #############################################################################
     # Update the asset location and associated measurement
 
-    body = [{
-        "@type": "ContributedAssetLocation",
-        "timestamp": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-        "geometry": "{\"type\": \"Feature\",\"geometry\": {\"geometries\": [{\"coordinates\": [" + longitude + "," + latitude + "],\"type\": \"Point\"}],\"type\": \"GeometryCollection\"}}",
-        "measurementData": [{
-            "@type": "BasicMeasurement",
-            "name": asset_details['measurement_1_name'],
-            "value":asset_details['measurement_1_value'],
-            "unit": asset_details['measurement_1_unit'],
-        }, {
-            "@type": "BasicMeasurement",
-            "name": asset_details['measurement_2_name'],
-            "value": asset_details['measurement_2_value'],
-            "unit": asset_details['measurement_2_unit'],
-        }, {
-            "@type": "BasicMeasurement",
-            "name": asset_details['measurement_3_name'],
-            "value": asset_details['measurement_3_value'],
-            "unit": asset_details['measurement_3_unit'],
-        }]
+    # str() - the geometry is a string value of the location, not spliced into it as JSON
+    geometry = str(ASSET_GEOMETRY_TEMPLATE.fill(longitude=longitude, latitude=latitude))
 
-    }]
+    location = get_asset_location_template(asset_details).fill(
+        timestamp=timestamp or datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        geometry=geometry)
+
+    # Queue an update to the asset's location - it is posted along with any other readings for the asset
+    get_asset_location_writer(asset_uri).add(location)
+
+#############################################################################
+def get_asset_location_template(asset_details):
+
+    measurements = tuple(asset_details[name] for name in ASSET_MEASUREMENT_SLOT_NAMES)
+
+    asset_location_template = asset_location_templates.get(measurements)
+    if asset_location_template is None:
+        asset_location_template = ASSET_LOCATION_PAYLOAD_TEMPLATE.partial(**dict(zip(ASSET_MEASUREMENT_SLOT_NAMES, measurements)))
+        asset_location_templates[measurements] = asset_location_template
+
+    return asset_location_template
+
+#############################################################################
+# Asset location writers - one per asset, kept across warm invocations
+
+asset_location_writers = dict()
+asset_location_writers_lock = threading.Lock()
+
+def get_asset_location_writer(asset_uri):
+
+    with asset_location_writers_lock:
+        asset_location_writer = asset_location_writers.get(asset_uri)
+
+    if asset_location_writer is None:
+        asset_locations_uri = demo_helper.get_relationship_uri(asset_uri, "locations")
+
+        with asset_location_writers_lock:
+            if asset_uri not in asset_location_writers:
+                asset_location_writers[asset_uri] = AssetLocationWriter(demo_helper, asset_locations_uri)
+            asset_location_writer = asset_location_writers[asset_uri]
+
+    return asset_location_writer
+
+#############################################################################
+def flush_asset_locations():
+
+    with asset_location_writers_lock:
+        writers_to_flush = list(asset_location_writers.values())
+
+    for asset_location_writer in writers_to_flush:
+        asset_location_writer.flush()
+
+#############################################################################
+# Send any readings still buffered for an asset and stop buffering for it
+def close_asset_location_writer(asset_uri):
+
+    with asset_location_writers_lock:
+        asset_location_writer = asset_location_writers.pop(asset_uri, None)
 
-    # Post an update to the asset's location
-    asset_locations_uri = demo_helper.get_relationship_uri(asset_uri, "locations")
-    http_response = demo_helper.process_http_oauth_post_request(asset_locations_uri, body, "Asset location updated")
+    if asset_location_writer is not None:
+        asset_location_writer.close()
 
 #############################################################################
 def delete_asset(asset_title):
@@ -182,6 +311,7 @@ def delete_asset(asset_title):
     asset_to_delete_uri = get_asset(asset_title)
 
     if asset_to_delete_uri:
+        close_asset_location_writer(asset_to_delete_uri)
         demo_helper.process_http_oauth_delete_request(asset_to_delete_uri, "Asset deleted")
 
 #############################################################################
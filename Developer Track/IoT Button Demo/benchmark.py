@@ -0,0 +1,339 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _fake_myjohndeere_server import FakeMyJohnDeereServer
+import argparse
+import glob
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import traceback
+
+#############################################################################
+# Benchmark constants
+
+BENCHMARK_HANDLERS = ('notification', 'asset', 'map_layer')
+BENCHMARK_SERIAL_NUMBER_FORMAT = "BENCH{:04d}"
+BENCHMARK_OUTBOX_FILE_NAME = 'outbox.sqlite'
+BENCHMARK_OUTBOX_DRAIN_TIMEOUT_SECONDS = 120.0
+
+#############################################################################
+# Offline benchmark of the lambda handlers - runs against FakeMyJohnDeereServer, no network needed
+#
+# Each worker process stands in for a warm Lambda container - it imports the handler once, keeps
+# its caches in a /tmp of its own and handles one press (or batch) at a time - so --concurrency is
+# the number of containers handling presses at the same time. The first press a container handles
+# is a cold one, just as in Lambda (use --warmup to leave those out). For every handler it reports
+# the throughput, the press latency percentiles and the requests the server saw per press.
+#
+# With --traversal-plan compare every handler is run twice from the same server state - without and
+# with the traversal planner (see _traversal_planner) - and the requests and bytes it saved are reported.
+#
+# With --outbox the handlers only record the presses in an outbox of their container (see _outbox),
+# so the latency is that of acknowledging a press - the time the outboxes took to drain (replaying
+# the presses against the server) is reported along with it.
+#
+# With --fail-endpoint the server answers every request to that endpoint with a 500. Pick one every
+# press calls (e.g. "POST notificationEvents") along with --outbox, and the benchmark checks that no
+# press was lost - once every button's next press has been tried, each press must either still be
+# in the outbox or have been superseded by a later one.
+#
+#   python benchmark.py --presses 200 --concurrency 8 --latency-ms 30 --jitter-ms 20 --throttle-rate 0.01
+#   python benchmark.py --existing-fields 250 --traversal-plan compare
+#   python benchmark.py --handlers asset --click-types SINGLE --latency-ms 200 --outbox
+#   python benchmark.py --outbox --fail-endpoint "POST notificationEvents"
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the IoT button lambda handlers against a local fake MyJohnDeere API")
+    parser.add_argument('--handlers', default=','.join(BENCHMARK_HANDLERS), help="comma separated handler modules to benchmark")
+    parser.add_argument('--presses', type=int, default=100, help="button presses per handler")
+    parser.add_argument('--concurrency', type=int, default=4, help="presses handled at the same time (one process each)")
+    parser.add_argument('--buttons', type=int, default=10, help="distinct button serial numbers pressing")
+    parser.add_argument('--click-types', default='SINGLE', help="comma separated click types, used in turn")
+    parser.add_argument('--batch-size', type=int, default=0, help="send the presses as batch events of this many presses")
+    parser.add_argument('--warmup', type=int, default=0, help="presses per handler sent before measuring")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="latency the fake server adds to every request")
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help="random extra latency of up to this much")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument('--retry-after-ms', type=float, default=100.0, help="Retry-After sent with a 429")
+    parser.add_argument('--existing-fields', type=int, default=0, help="fields the organization already has")
+    parser.add_argument('--request-rate', type=float, default=None, help="requests per second the demo allows itself per host (default REQUEST_RATE_PER_SECOND)")
+    parser.add_argument('--image-kb', type=int, default=64, help="size of the map layer image")
+    parser.add_argument('--traversal-plan', choices=('on', 'off', 'compare'), default='on', help="ask for only the links the handlers follow")
+    parser.add_argument('--outbox', action='store_true', help="record the presses in an outbox and replay them in the background")
+    parser.add_argument('--fail-endpoint', action='append', default=[], help="answer every request to this endpoint (e.g. \"POST notificationEvents\") with a 500")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default="", help="also write the results as JSON to this file")
+    parser.add_argument('--verbose', action='store_true', help="keep the handlers' logging")
+    args = parser.parse_args()
+
+    server = FakeMyJohnDeereServer(latency_seconds=args.latency_ms / 1000.0, latency_jitter_seconds=args.jitter_ms / 1000.0,
+                                   throttle_rate=args.throttle_rate, retry_after_seconds=args.retry_after_ms / 1000.0,
+                                   existing_field_count=args.existing_fields, image_size=args.image_kb * 1024, seed=args.seed,
+                                   failing_endpoints=args.fail_endpoint).start()
+
+    # Point the demo at the fake server - before anything imports _common_setup, as the workers inherit it
+    os.environ['MYJOHNDEERE_BASE_URI'] = server.base_uri
+    os.environ['GOOGLE_MAPS_GEOCODE_URI'] = server.geocode_uri
+    os.environ['no_proxy'] = '127.0.0.1,localhost'
+
+    cache_directory = tempfile.mkdtemp(prefix='myjohndeere_benchmark_')
+    click_types = args.click_types.split(',')
+    traversal_plans = {'on': [True], 'off': [False], 'compare': [False, True]}[args.traversal_plan]
+    results = []
+
+    try:
+        for handler_name in args.handlers.split(','):
+            events = [{'serialNumber': BENCHMARK_SERIAL_NUMBER_FORMAT.format(index % args.buttons), 'clickType': click_types[index % len(click_types)]}
+                      for index in range(args.warmup + args.presses)]
+
+            handler_results = []
+            for traversal_plan in traversal_plans:
+
+                # Both runs of a comparison start from the same resources
+                if len(traversal_plans) > 1:
+                    server.reset()
+
+                result = run_handler_benchmark(server, handler_name, events[:args.warmup], events[args.warmup:], args, cache_directory, traversal_plan)
+                log_benchmark_result(result)
+                handler_results.append(result)
+
+            if len(handler_results) > 1:
+                log_traversal_plan_savings(*handler_results)
+
+            results.extend(handler_results)
+    finally:
+        server.stop()
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'arguments': vars(args), 'results': results}, output_file, indent=4)
+
+#############################################################################
+# Press the handler with every event, concurrency presses (or batches) at a time, on a fresh set of
+# worker processes - returns its result
+def run_handler_benchmark(server, handler_name, warmup_events, events, args, cache_directory, traversal_plan=True):
+
+    pool = multiprocessing.Pool(args.concurrency, initialize_worker,
+                                (handler_name, cache_directory, server.image_uri, args.request_rate, args.verbose, traversal_plan, args.outbox))
+    try:
+        warmup_outcomes = pool.map(run_press, [(handler_name, event) for event in warmup_events], chunksize=1)
+
+        server.reset_stats()
+        start_time = time.time()
+
+        # A batch is timed as a whole - its presses share that time
+        if args.batch_size > 0:
+            tasks = [(handler_name, events[start:start + args.batch_size]) for start in range(0, len(events), args.batch_size)]
+        else:
+            tasks = [(handler_name, event) for event in events]
+
+        press_outcomes = list(pool.imap_unordered(run_press, tasks, chunksize=1))
+
+        elapsed_seconds = time.time() - start_time
+
+        # The presses have only been recorded - wait for the workers' outboxes to be replayed (or,
+        # with an endpoint failing, for them to have been tried)
+        if args.outbox:
+            outbox_counts = wait_for_outboxes(cache_directory, handler_name, BENCHMARK_OUTBOX_DRAIN_TIMEOUT_SECONDS, settle=bool(args.fail_endpoint))
+            drain_seconds = time.time() - start_time
+
+        server_stats = server.get_stats()
+    finally:
+        pool.close()
+        pool.join()
+
+    result = get_benchmark_result(handler_name, len(events), press_outcomes, elapsed_seconds, server_stats)
+    result['traversal_plan'] = traversal_plan
+    result['outbox'] = args.outbox
+
+    if args.outbox:
+        result['drain_seconds'] = drain_seconds
+        result['outbox_unsent'] = outbox_counts.get('pending', 0) + outbox_counts.get('sending', 0) + outbox_counts.get('failed', 0)
+
+    # Every press (warmup ones included) that wasn't superseded must still be in an outbox
+    if args.outbox and args.fail_endpoint:
+        result['outbox_superseded'] = sum(superseded_count for _, _, _, superseded_count in warmup_outcomes + press_outcomes)
+        result['outbox_lost'] = len(warmup_events) + len(events) - result['outbox_superseded'] - result['outbox_unsent']
+
+    return result
+
+#############################################################################
+# Worker processes - each imports the handler once and keeps it (and its caches) across presses
+#
+# The pool starts a new worker whenever its initializer raises, so a handler that can't be imported
+# would have it respawning workers forever. The failure is kept instead, and run_press raises it -
+# which ends the benchmark with the reason.
+
+_worker_handler = None
+_worker_failure = None
+
+def initialize_worker(*args):
+
+    global _worker_failure
+
+    try:
+        set_up_worker(*args)
+    except Exception:
+        _worker_failure = traceback.format_exc()
+
+def set_up_worker(handler_name, cache_directory, image_uri, request_rate, verbose, traversal_plan, outbox):
+
+    global _worker_handler
+
+    # Every container has its own /tmp - the caches persisted there must not be shared
+    import _common_setup
+    worker_cache_directory = tempfile.mkdtemp(dir=cache_directory)
+    _common_setup.LINK_CACHE_FILE = os.path.join(worker_cache_directory, 'link_cache.json')
+    _common_setup.GEOCODE_CACHE_FILE = os.path.join(worker_cache_directory, 'geocode_cache.json')
+    _common_setup.CREATED_RESOURCE_CACHE_FILE = os.path.join(worker_cache_directory, 'created_resources.json')
+
+    # The rate limiter would otherwise hide whatever is being measured behind its own pace
+    if request_rate is not None:
+        _common_setup.REQUEST_RATE_PER_SECOND = request_rate
+
+    _common_setup.TRAVERSAL_PLANNER_ENABLED = traversal_plan
+
+    _common_setup.OUTBOX_ENABLED = outbox
+    _common_setup.OUTBOX_FILE = os.path.join(worker_cache_directory, BENCHMARK_OUTBOX_FILE_NAME)
+
+    if not verbose:
+        logging.disable(logging.INFO)
+
+    _worker_handler = importlib.import_module(handler_name)
+
+    # The demo map layer images are served by the fake server too
+    for button_event in getattr(_worker_handler, 'DEMO_PARAMS', {}).get('button_event', {}).values():
+        if 'map_layer_image_uri' in button_event.get('map_layer_details', {}):
+            button_event['map_layer_details']['map_layer_image_uri'] = image_uri
+
+#############################################################################
+# Returns (press count, seconds, failure, superseded count) - failure is None if the handler
+# succeeded, the superseded count is that of the earlier presses in the outbox the press replaced
+def run_press(task):
+
+    handler_name, event = task
+    press_count = len(event) if isinstance(event, list) else 1
+
+    if _worker_failure is not None:
+        raise RuntimeError("Could not set up a worker for {}:\n{}".format(handler_name, _worker_failure))
+
+    outbox = _worker_handler.demo_helper.outbox
+    compacted_count = outbox.get_stats()['compacted'] if outbox else 0
+
+    start_time = time.time()
+    try:
+        handler_result = _worker_handler.lambda_handler(event, None)
+        failure = None
+
+        if isinstance(handler_result, dict) and handler_result.get('batchItemFailures'):
+            failure = "{} of {} presses failed".format(len(handler_result['batchItemFailures']), press_count)
+    except Exception as exception:
+        failure = "{}: {}".format(type(exception).__name__, exception)
+
+    elapsed_seconds = time.time() - start_time
+
+    return (press_count, elapsed_seconds, failure, (outbox.get_stats()['compacted'] - compacted_count) if outbox else 0)
+
+#############################################################################
+# Wait until no press of the handler is left to replay in any worker's outbox - or, if settle is set, until no
+# press is in flight and every button's next press has been tried. Returns the number of press
+# events in each state (see get_outbox_counts), summed over the outboxes.
+def wait_for_outboxes(cache_directory, handler_name, timeout, settle=False):
+
+    # Imported here so that _common_setup is only imported once the environment points at the fake server
+    from _outbox import get_outbox_counts
+
+    deadline = time.time() + timeout
+
+    while True:
+        outbox_counts = dict()
+        for outbox_file in glob.glob(os.path.join(cache_directory, '*', BENCHMARK_OUTBOX_FILE_NAME)):
+            for state, count in get_outbox_counts(outbox_file, handler_name).items():
+                outbox_counts[state] = outbox_counts.get(state, 0) + count
+
+        if settle:
+            waiting_count = outbox_counts.get('sending', 0) + outbox_counts.get('untried', 0)
+        else:
+            waiting_count = outbox_counts.get('pending', 0) + outbox_counts.get('sending', 0)
+
+        if not waiting_count or time.time() >= deadline:
+            return outbox_counts
+
+        time.sleep(0.05)
+
+#############################################################################
+def get_benchmark_result(handler_name, press_count, press_outcomes, elapsed_seconds, server_stats):
+
+    # Imported here so that _common_setup is only imported once the environment points at the fake server
+    from _tracing import get_percentile
+
+    latencies_ms = sorted(seconds * 1000.0 for _, seconds, _, _ in press_outcomes)
+    failures = [failure for _, _, failure, _ in press_outcomes if failure is not None]
+
+    return {
+        'handler': handler_name,
+        'presses': press_count,
+        'failed': len(failures),
+        'failures': sorted(set(failures))[:10],
+        'seconds': elapsed_seconds,
+        'presses_per_second': press_count / elapsed_seconds if elapsed_seconds > 0 else 0.0,
+        'latency_ms': {
+            'p50': get_percentile(latencies_ms, 50),
+            'p95': get_percentile(latencies_ms, 95),
+            'p99': get_percentile(latencies_ms, 99),
+            'max': latencies_ms[-1],
+        },
+        'requests': server_stats['requests'],
+        'requests_per_press': float(server_stats['requests']) / press_count,
+        'throttled': server_stats['throttled'],
+        'bytes_sent': server_stats['bytes_received'],
+        'bytes_received': server_stats['bytes_sent'],
+        'requests_per_press_by_endpoint': dict((endpoint, float(count) / press_count) for endpoint, count in server_stats['by_endpoint'].items())
+    }
+
+#############################################################################
+def log_benchmark_result(result):
+
+    print "{} - traversal plan {} - {} presses ({} failed) in {:.2f}s - {:.1f} presses/s".format(
+        result['handler'], 'on' if result['traversal_plan'] else 'off', result['presses'], result['failed'], result['seconds'], result['presses_per_second'])
+    print "    latency      - p50 {p50:.0f} ms - p95 {p95:.0f} ms - p99 {p99:.0f} ms - max {max:.0f} ms".format(**result['latency_ms'])
+    if result['outbox']:
+        print "    outbox       - {} in {:.2f}s - {} presses not sent".format(
+            'settled' if 'outbox_lost' in result else 'drained', result['drain_seconds'], result['outbox_unsent'])
+    if 'outbox_lost' in result:
+        print "    check        - {} - {} presses kept in the outbox, {} superseded - {} lost".format(
+            'passed' if result['outbox_lost'] == 0 else 'FAILED', result['outbox_unsent'], result['outbox_superseded'], result['outbox_lost'])
+    print "    requests     - {:.2f} per press - {} in total, {} throttled - {} bytes sent, {} bytes received".format(
+        result['requests_per_press'], result['requests'], result['throttled'], result['bytes_sent'], result['bytes_received'])
+
+    for endpoint, requests_per_press in sorted(result['requests_per_press_by_endpoint'].items(), key=lambda item: -item[1]):
+        print "        {:6.2f}   {}".format(requests_per_press, endpoint)
+
+    for failure in result['failures']:
+        print "    failure      - {}".format(failure)
+
+#############################################################################
+def log_traversal_plan_savings(unplanned_result, planned_result):
+
+    unplanned_bytes_per_press = float(unplanned_result['bytes_received']) / unplanned_result['presses']
+    planned_bytes_per_press = float(planned_result['bytes_received']) / planned_result['presses']
+
+    print "{} - traversal plan saved {:.2f} requests and {:.0f} bytes received per press ({:.0f}% of the bytes)".format(
+        planned_result['handler'],
+        unplanned_result['requests_per_press'] - planned_result['requests_per_press'],
+        unplanned_bytes_per_press - planned_bytes_per_press,
+        100.0 * (unplanned_bytes_per_press - planned_bytes_per_press) / unplanned_bytes_per_press if unplanned_bytes_per_press else 0.0)
+
+#############################################################################
+
+if __name__ == '__main__':
+    main()
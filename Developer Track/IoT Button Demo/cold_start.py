@@ -0,0 +1,177 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _fake_myjohndeere_server import FakeMyJohnDeereServer
+import argparse
+import compileall
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+#############################################################################
+# Cold start measurement constants
+
+# Startup configurations measured - environment settings for each
+COLD_START_CONFIGURATIONS = (
+    ('per press', {'MYJOHNDEERE_COLD_START_PRELOAD': '0', 'MYJOHNDEERE_LINK_BUNDLE_FILE': ''}),
+    ('preload', {'MYJOHNDEERE_COLD_START_PRELOAD': '1', 'MYJOHNDEERE_LINK_BUNDLE_FILE': ''}),
+    ('preload + link bundle', {'MYJOHNDEERE_COLD_START_PRELOAD': '1'}),
+)
+
+COLD_START_SERIAL_NUMBER = 'COLDSTART'
+
+# Run in a fresh interpreter for every measurement: argv is the demo directory, handler module, cache
+# directory, click type, serial number and map layer image uri - prints the import time, the first (cold) and second (warm) press times
+# and the requests the first press sent
+COLD_START_CHILD = r'''
+import sys, os, time, json
+demo_directory, handler_name, cache_directory, click_type, serial_number, image_uri = sys.argv[1:7]
+os.chdir(demo_directory)
+sys.path.insert(0, demo_directory)
+
+start_time = time.time()
+import _common_setup
+for cache_file in ('LINK_CACHE_FILE', 'GEOCODE_CACHE_FILE', 'CREATED_RESOURCE_CACHE_FILE'):
+    setattr(_common_setup, cache_file, os.path.join(cache_directory, cache_file.lower() + '.json'))
+handler = __import__(handler_name)
+imported_time = time.time()
+
+for button_event in getattr(handler, 'DEMO_PARAMS', {}).get('button_event', {}).values():
+    if 'map_layer_image_uri' in button_event.get('map_layer_details', {}):
+        button_event['map_layer_details']['map_layer_image_uri'] = image_uri
+
+def get_request_count():
+    try:
+        from _tracing import LATENCY_HISTOGRAMS
+    except ImportError:
+        return None
+    return sum(percentiles['count'] for percentiles in LATENCY_HISTOGRAMS.get_percentiles().values())
+
+press_times = []
+for press in range(2):
+    press_start_time = time.time()
+    handler.lambda_handler({'serialNumber': serial_number, 'clickType': click_type}, None)
+    press_times.append(time.time() - press_start_time)
+    if press == 0:
+        first_press_requests = get_request_count()
+
+print json.dumps({'import_ms': (imported_time - start_time) * 1000.0, 'first_press_ms': press_times[0] * 1000.0,
+                  'warm_press_ms': press_times[1] * 1000.0, 'first_press_requests': first_press_requests})
+'''
+
+#############################################################################
+# Cold start measurement - how long a fresh container takes to load a handler and serve its first press
+#
+# Every measurement runs in a new interpreter with empty caches, against FakeMyJohnDeereServer (so no
+# network is needed), once for each startup configuration - everything done per press, the sessions
+# and logger built at load (COLD_START_PRELOAD) and that plus the link bundle. Pass --baseline-dir
+# to measure another checkout of the demo the same way (e.g. git worktree add /tmp/baseline <commit> -
+# it needs MYJOHNDEERE_BASE_URI support, so no older than the benchmark).
+# Reports the median of --trials runs.
+#
+#   python cold_start.py --handlers notification,map_layer --latency-ms 50 --trials 7
+#
+# With --write-link-bundle it resolves the links of the API configured in _common_setup instead and
+# writes them to the link bundle shipped with the handlers.
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Measure the cold start of the IoT button lambda handlers")
+    parser.add_argument('--handlers', default='notification,asset,map_layer', help="comma separated handler modules to measure")
+    parser.add_argument('--click-type', default='SINGLE')
+    parser.add_argument('--trials', type=int, default=5, help="runs per handler and configuration - the median is reported")
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="latency the fake server adds to every request")
+    parser.add_argument('--baseline-dir', default="", help="another checkout of the demo to measure as well")
+    parser.add_argument('--write-link-bundle', action='store_true', help="resolve the link bundle from the configured API and write it")
+    parser.add_argument('--link-bundle-file', default="", help="where to write the link bundle (default LINK_BUNDLE_FILE)")
+    args = parser.parse_args()
+
+    if args.write_link_bundle:
+        write_link_bundle(args.link_bundle_file)
+        return
+
+    demo_directory = os.path.dirname(os.path.abspath(__file__))
+    work_directory = tempfile.mkdtemp(prefix='myjohndeere_cold_start_')
+
+    server = FakeMyJohnDeereServer(latency_seconds=args.latency_ms / 1000.0).start()
+
+    server_environment = dict(os.environ, MYJOHNDEERE_BASE_URI=server.base_uri, GOOGLE_MAPS_GEOCODE_URI=server.geocode_uri,
+                              no_proxy='127.0.0.1,localhost')
+
+    try:
+        # The link bundle of the fake server - resolved the same way as the one that is shipped
+        link_bundle_file = os.path.join(work_directory, 'link_bundle.json')
+        subprocess.check_call([sys.executable, os.path.abspath(__file__), '--write-link-bundle', '--link-bundle-file', link_bundle_file],
+                              cwd=demo_directory, env=server_environment, stderr=open(os.devnull, 'w'))
+
+        configurations = [(name, dict(dict(server_environment, MYJOHNDEERE_LINK_BUNDLE_FILE=link_bundle_file), **settings), demo_directory)
+                          for name, settings in COLD_START_CONFIGURATIONS]
+        if args.baseline_dir:
+            configurations.insert(0, ('baseline', server_environment, os.path.abspath(args.baseline_dir)))
+
+        # Bytecode is compiled ahead of time, so it isn't counted against whichever configuration runs first
+        for _, _, directory in configurations:
+            compileall.compile_dir(directory, maxlevels=0, quiet=1)
+
+        print "{:<12} {:<24} {:>10} {:>16} {:>10} {:>15}".format('handler', 'configuration', 'import ms', 'first press ms', 'requests', 'warm press ms')
+
+        for handler_name in args.handlers.split(','):
+            for name, environment, directory in configurations:
+                measurements = [measure_cold_start(directory, handler_name, args.click_type, server.image_uri, environment, work_directory)
+                                for _ in range(args.trials)]
+
+                print "{:<12} {:<24} {:>10.0f} {:>16.0f} {:>10} {:>15.0f}".format(handler_name, name,
+                    get_median([measurement['import_ms'] for measurement in measurements]),
+                    get_median([measurement['first_press_ms'] for measurement in measurements]),
+                    measurements[0]['first_press_requests'] if measurements[0]['first_press_requests'] is not None else '-',
+                    get_median([measurement['warm_press_ms'] for measurement in measurements]))
+    finally:
+        server.stop()
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+#############################################################################
+# One fresh interpreter, with empty caches, importing the handler and pressing the button twice
+def measure_cold_start(directory, handler_name, click_type, image_uri, environment, work_directory):
+
+    cache_directory = tempfile.mkdtemp(dir=work_directory)
+    try:
+        output = subprocess.check_output([sys.executable, '-c', COLD_START_CHILD, directory, handler_name, cache_directory, click_type, COLD_START_SERIAL_NUMBER, image_uri],
+                                         env=environment, stderr=open(os.devnull, 'w'))
+    finally:
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+    return json.loads(output.strip().splitlines()[-1])
+
+#############################################################################
+def write_link_bundle(file_path):
+
+    # Resolve every link afresh - not from a link cache left behind by an earlier run
+    import _common_setup
+    _common_setup.LINK_CACHE_FILE = ""
+
+    from _demo_helper import DemoHelper
+    from _link_bundle import save_link_bundle
+    from _common_setup import LINK_BUNDLE_FILE
+
+    demo_helper = DemoHelper()
+    demo_helper.setup('LINK_BUNDLE')
+
+    links = demo_helper.resolve_link_bundle()
+    save_link_bundle(links, file_path or LINK_BUNDLE_FILE)
+
+    print "Wrote {} links to {}".format(len(links), file_path or LINK_BUNDLE_FILE)
+
+#############################################################################
+def get_median(values):
+
+    values = sorted(values)
+    return values[len(values) // 2]
+
+#############################################################################
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _json_stream import CollectionPageStream, JSON_STREAM_CHUNK_SIZE
+from _resources import Field
+import argparse
+import json
+import multiprocessing
+import random
+import os
+import resource
+import tempfile
+import time
+
+#############################################################################
+# Collection page decoding benchmark - json.loads of the whole page vs CollectionPageStream
+#
+# Builds a page of fields with their boundaries embedded (as with embed=activeBoundary), which
+# comes to several MB, and looks for the field named in --match-index the way the demo does: by
+# decoding the whole page and scanning it, by streaming it and stopping at the match, and by
+# streaming all of it keeping only the keys the field index needs. Then it holds on to every field
+# of the page, as dicts and as _resources.Field objects (which keep their payload as text). For each
+# it reports the time to the match, the time to decode the whole page and the peak memory it took -
+# every method runs in a process of its own, reading the page a chunk at a time from a file as it
+# would from the response, so the peaks don't mix.
+#
+#   python decode_benchmark.py --fields 100 --boundary-points 2000 --match-index 10
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare decoding a large collection page whole and streamed")
+    parser.add_argument('--fields', type=int, default=100, help="fields on the page")
+    parser.add_argument('--boundary-points', type=int, default=2000, help="points in each field's boundary")
+    parser.add_argument('--match-index', type=int, default=10, help="position of the field looked for")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per method - the best is reported")
+    args = parser.parse_args()
+
+    page_file, page_file_name = tempfile.mkstemp(suffix='.json')
+    try:
+        os.write(page_file, build_page_body(args.fields, args.boundary_points))
+        os.close(page_file)
+
+        print "Page of {} fields with {} boundary points each - {:.1f} MB".format(args.fields, args.boundary_points, os.path.getsize(page_file_name) / 1048576.0)
+        print "{:<26} {:>14} {:>14} {:>16}".format('method', 'match ms', 'whole page ms', 'peak memory MB')
+
+        for method_name in ('json.loads', 'stream, stop at match', 'stream, projected', 'stream, kept as dicts', 'stream, kept as resources'):
+            results = [run_in_process(method_name, page_file_name, args.match_index) for _ in range(args.repeat)]
+
+            print "{:<26} {:>14.1f} {:>14} {:>16.1f}".format(method_name,
+                min(result['match_seconds'] for result in results) * 1000.0,
+                "{:.1f}".format(min(result['page_seconds'] for result in results) * 1000.0) if results[0]['page_seconds'] is not None else '-',
+                min(result['peak_kb'] for result in results) / 1024.0)
+    finally:
+        os.remove(page_file_name)
+
+#############################################################################
+def build_page_body(field_count, boundary_points, seed=0):
+
+    random_numbers = random.Random(seed)
+
+    def build_field(index):
+        ring = [[8.4 + random_numbers.random() / 100.0, 49.4 + random_numbers.random() / 100.0] for _ in range(boundary_points)]
+        return {
+            "@type": "Field",
+            "name": "Field {:04d}".format(index),
+            "id": "{:08d}-0000-0000-0000-000000000000".format(index),
+            "links": [
+                {"@type": "Link", "rel": "self", "uri": "https://sandboxapi.deere.com/platform/organizations/4321/fields/{:08d}".format(index)},
+                {"@type": "Link", "rel": "boundaries", "uri": "https://sandboxapi.deere.com/platform/organizations/4321/fields/{:08d}/boundaries".format(index)},
+            ],
+            "activeBoundary": {
+                "@type": "Boundary",
+                "name": "Boundary {:04d}".format(index),
+                "area": {"@type": "MeasurementAsDouble", "valueAsDouble": random_numbers.random() * 100.0, "unit": "ha"},
+                "multipolygons": [{"@type": "Polygon", "rings": [{"@type": "Ring", "points": [{"@type": "Point", "lat": lat, "lon": lon} for lon, lat in ring]}]}],
+            },
+        }
+
+    return json.dumps({
+        "links": [{"@type": "Link", "rel": "self", "uri": "https://sandboxapi.deere.com/platform/organizations/4321/fields;start=0;count=100"}],
+        "total": field_count,
+        "values": [build_field(index) for index in range(field_count)],
+    })
+
+#############################################################################
+def run_in_process(method_name, page_file_name, match_index):
+
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_method, args=(method_name, page_file_name, match_index, results))
+    process.start()
+    result = results.get()
+    process.join()
+
+    return result
+
+#############################################################################
+# The page's bytes arrive a chunk at a time, as they would from the response
+def run_method(method_name, page_file_name, match_index, results):
+
+    page_file = open(page_file_name, 'rb')
+    match_name = "Field {:04d}".format(match_index)
+    chunks = iter(lambda: page_file.read(JSON_STREAM_CHUNK_SIZE), b"")
+
+    starting_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.time()
+    page_seconds = None
+
+    if method_name == 'json.loads':
+        page = json.loads("".join(chunks))
+        page_seconds = time.time() - start_time
+        match = next(value for value in page['values'] if value['name'] == match_name)
+        match_seconds = time.time() - start_time
+
+    elif method_name == 'stream, stop at match':
+        page = CollectionPageStream(chunks)
+        match = next(value for value in page['values'] if value['name'] == match_name)
+        match_seconds = time.time() - start_time
+        page.close()
+
+    elif method_name == 'stream, projected':
+        page = CollectionPageStream(chunks, keys=('name', 'id', 'links'))
+        match = None
+        for value in page['values']:
+            if match is None and value['name'] == match_name:
+                match = value
+                match_seconds = time.time() - start_time
+        page_seconds = time.time() - start_time
+
+    else:
+        resource_type = Field if method_name == 'stream, kept as resources' else None
+        page = CollectionPageStream(chunks, resource_type=resource_type)
+        kept_values = []
+        for value in page['values']:
+            kept_values.append(value)
+            if len(kept_values) == match_index + 1:
+                match_seconds = time.time() - start_time
+        page_seconds = time.time() - start_time
+
+    page_file.close()
+    results.put({
+        'match_seconds': match_seconds,
+        'page_seconds': page_seconds,
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - starting_peak_kb,
+    })
+
+#############################################################################
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,17 @@
 # of the MIT license.  See the LICENSE file for details.
 
 from _common_setup import *
-from _demo_helper import DemoHelper
+from _async_demo_helper import AsyncDemoHelper
+from _demo_helper import is_batch_event, get_link, finishing_thread_pool, BATCH_SERIAL_NUMBER
+from _upload_stream import open_upload_source
+from _map_layer_raster import render_map_layer
+from _checkpoint import Checkpoint
+from _tracing import trace_handler, bind_to_current_span
+from _json_encoding import encode_json, PayloadTemplate, Slot
+from _request_scheduler import RequestFailedError
+from _resources import Field, MapLayerSummary, MapLayer, FileResource
+import multiprocessing
+import time
 
 #############################################################################
 # Modify the params below to customize your demo
@@ -13,6 +23,16 @@ DEMO_PARAMS = {
     'delete_existing_map_layers' : False,
 
     # A button press can be either SINGLE, DOUBLE, or LONG
+    #
+    # Instead of a map_layer_image_uri, map_layer_details can hold a 'map_layer_grid' of values
+    # (needs numpy) - the image and legend are then rendered locally, see _map_layer_raster:
+    #   'map_layer_grid' : {
+    #       'values' : "/tmp/elevation.npy",        # 2-D array or .npy file
+    #       'bin_edges' : [150, 170, 190, 210, 230],
+    #       'hex_colors' : ["#0BA74A", "#00BFFF", "#DC143C", "#FFFFFF"],
+    #       'unit_id' : "m",
+    #       'georeference' : {'north_latitude': 49.48, 'west_longitude': 8.47, 'cell_height': 0.00001, 'cell_width': 0.00001}
+    #   }
     'button_event' : {
         'SINGLE': {
             'map_layer_details' :
@@ -62,26 +82,113 @@ DEMO_PARAMS = {
     }
 }
 
+#############################################################################
+# Legend used with the pre-rendered demo images
+
+DEMO_MAP_LAYER_LEGEND = {
+    "unitId": "seeds1ha-1",
+    "ranges": [
+        {
+            #"label": "Custom Range 1",
+            "minimum": 0,
+            "maximum": 99,
+            "hexColor": "#0BA74A",
+            "percent": 0.25
+        },
+        {
+            #"label": "Custom Range 2",
+            "minimum": 100,
+            "maximum": 199,
+            "hexColor": "#00BFFF",
+            "percent": 0.40
+        },
+        {
+            #"label": " Custom Range 3",
+            "minimum": 200,
+            "maximum": 299,
+            "hexColor": "#DC143C",
+            "percent": 0.15
+        },
+        {
+            #"label": "Custom Range 4",
+            "minimum": 300,
+            "maximum": 399,
+            "hexColor": "#FFFFFF",
+            "percent": 0.2
+        }
+    ]
+}
+
+# It never changes - so it is only encoded once
+DEMO_MAP_LAYER_LEGEND_JSON = encode_json(DEMO_MAP_LAYER_LEGEND)
+
+#############################################################################
+# Teardown constants
+
+TEARDOWN_MAX_WORKERS = 8    # Lists/deletes sent at the same time when clearing out existing map layers
+
+#############################################################################
+# Bulk contribution constants
+
+BULK_MAX_WORKERS = 8                                        # Fields whose summary/layer/file resource chains run at the same time
+MAP_LAYER_CHECKPOINT_FILE = "/tmp/map_layer_checkpoint.json" # Map layers already contributed - lets a re-run skip them
+
+#############################################################################
+# Payload templates - see _json_encoding.PayloadTemplate
+
+MAP_LAYER_PAYLOAD_TEMPLATE = PayloadTemplate({
+   "links": [
+      {
+         "rel": "owningOrganization",
+         "uri": Slot('organization_uri')
+      }
+   ],
+   "title": Slot('title'),
+   "extent": Slot('extent'),
+   "sortName": "02",
+   "legends": Slot('legends')
+})
+
 #############################################################################
 # Lambda entry/invocation point
 
-demo_helper = DemoHelper()
+demo_helper = AsyncDemoHelper()
 
+# The links this handler follows besides the ones every handler does - see DemoHelper.plan_traversal
+demo_helper.plan_traversal('organizations', 'fields', 'mapLayerSummaries', 'mapLayers', 'fileResources')
+
+# With OUTBOX_ENABLED presses are only recorded here and replayed in the background - see DemoHelper.open_outbox
+demo_helper.open_outbox('map_layer', lambda batch_event: process_press_batch(batch_event))
+
+@trace_handler
 def lambda_handler(event, context):
 
+    # Many presses at once (e.g. from an SQS queue) - returns the outcome of each one
+    if is_batch_event(event):
+        demo_helper.setup(BATCH_SERIAL_NUMBER)
+
+        if demo_helper.outbox is not None:
+            return demo_helper.record_in_outbox(event)
+
+        return process_press_batch(event)
+
     demo_helper.setup(event['serialNumber'])
     event_type = event['clickType']
     demo_helper.logger.info("{} - {} press event received".format(demo_helper.iot_button_serial_number, event_type))
 
+    if demo_helper.outbox is not None:
+        return demo_helper.record_in_outbox(event)
+
     map_layer_details = DEMO_PARAMS['button_event'][event_type]['map_layer_details']
 
     # Create a field to assign a map layer to (if it doesn't already exist)
     # Use the serial number of the IoT button for the field name to uniquely distinguish your field
     field_name = demo_helper.iot_button_serial_number
-    field_uri= demo_helper.create_field(field_name)
+    field_uri = demo_helper.create_field_async(field_name)
 
     # Delete any previous Map Layer Summaries and underlying Map Layers / File Resources assigned to the field
     if DEMO_PARAMS['delete_existing_map_layers']:
+        field_uri = demo_helper.wait(field_uri)
         delete_map_layer_summaries(field_uri)
 
     # Contribute a map layer for your field with a given image
@@ -89,71 +196,294 @@ def lambda_handler(event, context):
 
     # Post a notification to alert the user that a map layer has been created
     notification_title = "{} - Map Layer Contributed - {}".format(demo_helper.iot_button_serial_number, map_layer_details['map_layer_title'])
-    demo_helper.contribute_notification(field_uri, notification_title, {'severity' : 'LOW', 'type' : 'ANNOUNCEMENT', 'text' : "Map layer contributed!"})
+    demo_helper.queue_notification(demo_helper.wait(field_uri), notification_title, {'severity' : 'LOW', 'type' : 'ANNOUNCEMENT', 'text' : "Map layer contributed!"})
+    demo_helper.flush_notifications()
+
+    demo_helper.log_connection_stats()
+    demo_helper.log_traversal_plan_stats()
+    demo_helper.log_latency_histograms()
 
     return 'SUCCESS'
 
+#############################################################################
+# Batch processing - the field (and clearing out its old map layers) is shared by all of a button's presses
+
+def process_press_batch(batch_event):
+
+    return demo_helper.process_event_batch(batch_event, prepare_button_presses, process_button_press)
+
+def prepare_button_presses(serial_number):
+
+    field_uri = demo_helper.create_field(serial_number)
+
+    if DEMO_PARAMS['delete_existing_map_layers']:
+        delete_map_layer_summaries(field_uri)
+
+    return field_uri
+
+def process_button_press(event, field_uri):
+
+    map_layer_details = DEMO_PARAMS['button_event'][event['clickType']]['map_layer_details']
+
+    contribute_map_layer(field_uri, map_layer_details)
+
+    notification_title = "{} - Map Layer Contributed - {}".format(demo_helper.iot_button_serial_number, map_layer_details['map_layer_title'])
+    demo_helper.queue_notification(field_uri, notification_title, {'severity' : 'LOW', 'type' : 'ANNOUNCEMENT', 'text' : "Map layer contributed!"})
+
 #################################################################################
-def contribute_map_layer(field_uri, map_layer_details):
+# Note - field_uri can still be pending (see AsyncDemoHelper.create_field_async), as can
+# map_layer_raster - the grid rendered elsewhere (see contribute_map_layers), otherwise it is rendered here
+def contribute_map_layer(field_uri, map_layer_details, map_layer_raster=None):
 
     map_layer_location = map_layer_details['map_layer_location']
     map_layer_title = map_layer_details['map_layer_title']
-    map_layer_image_uri = map_layer_details['map_layer_image_uri']
+    map_layer_grid = map_layer_details.get('map_layer_grid')
+
+    # Neither the rendered grid nor the GPS coordinates depend on the summary/layer chain - start them straight away
+    if map_layer_grid and map_layer_raster is None:
+        map_layer_raster = demo_helper.submit(render_map_layer, map_layer_grid['values'], map_layer_grid['bin_edges'],
+                                              map_layer_grid['hex_colors'], map_layer_grid['georeference'])
+    elif not map_layer_grid:
+        gps = demo_helper.submit(demo_helper.determine_gps_coordinates, map_layer_location)
 
     # Create a Map Layer Summary for your field
-    map_layer_summary_uri = create_map_layer_summary(field_uri, map_layer_details)
+    map_layer_summary_uri = create_map_layer_summary(demo_helper.wait(field_uri), map_layer_details)
 
-    # Determine the GPS coordinates for the map layer location specified in DEMO_PARAMS
-    gps = demo_helper.determine_gps_coordinates(map_layer_location)
+    # A rendered grid brings its own extent and legend, otherwise place the demo image at the map layer location
+    if map_layer_grid:
+        map_layer_raster = demo_helper.wait(map_layer_raster)
+        extent = map_layer_raster['extent']
+        legend = {"unitId": map_layer_grid.get('unit_id', DEMO_MAP_LAYER_LEGEND['unitId']), "ranges": map_layer_raster['legend_ranges']}
+    else:
+        gps = demo_helper.wait(gps)
+        extent = get_demo_map_layer_extent(float(gps['lat']), float(gps['lon']))
+        legend = DEMO_MAP_LAYER_LEGEND_JSON
 
     # Create a Map Layer for the Map Layer Summary
-    map_layer_uri = create_map_layer(map_layer_summary_uri, map_layer_title, float(gps['lat']), float(gps['lon']))
+    map_layer_uri = create_map_layer(map_layer_summary_uri, map_layer_title, extent, legend)
 
     # Create a File Resource for the Map Layer
     file_resource_uri = create_map_layer_file_resource(map_layer_uri, map_layer_title)
 
-    # Upload content to the Map Layer File Resource
-    upload_map_layer_file_resource(file_resource_uri, map_layer_image_uri)
+    # Upload the image to the Map Layer File Resource
+    if map_layer_grid:
+        demo_helper.process_http_oauth_put_request(file_resource_uri, map_layer_raster['png'], "File resource uploaded", 204)
+    else:
+        upload_map_layer_file_resource(file_resource_uri, map_layer_details['map_layer_image_uri'])
+
+    return map_layer_uri
+
+#################################################################################
+# Contribute a map layer to each of many fields of an org - e.g. from a nightly job
+#
+# field_map_layers is a list of (field, map_layer_details) pairs, where field is a field uri or the
+# name of a field in the org. Grids are rendered on a process pool (rendering is CPU bound) while
+# the HTTP chains run on a pool of threads, each chain picking up its image as soon as it is
+# rendered. Every contributed map layer is recorded in the checkpoint file, so a re-run after a
+# crash skips the fields that are already done.
+#
+# Returns the outcome of every pair, in the order given - each is also logged in that order.
+def contribute_map_layers(org_uri, field_map_layers, checkpoint_file=MAP_LAYER_CHECKPOINT_FILE, max_workers=BULK_MAX_WORKERS):
+
+    field_map_layers = list(field_map_layers)
+    if not field_map_layers:
+        return []
+
+    checkpoint = Checkpoint(checkpoint_file)
+    completed_count = len(checkpoint)
+    started_at = time.time()
+    iot_button_serial_number = demo_helper.iot_button_serial_number
+
+    # The render processes are started before the chains' threads - forking is safest with the fewest threads running
+    render_pool = get_render_pool() if any(map_layer_details.get('map_layer_grid') for _, map_layer_details in field_map_layers) else None
+
+    # Start rendering every grid still to do straight away - a chain only waits for its own image
+    pending_rasters = []
+    for field, map_layer_details in field_map_layers:
+        map_layer_grid = map_layer_details.get('map_layer_grid')
+
+        if render_pool and map_layer_grid and not checkpoint.get(get_checkpoint_key(org_uri, field, map_layer_details)):
+            pending_rasters.append(render_pool.apply_async(render_map_layer, (map_layer_grid['values'], map_layer_grid['bin_edges'],
+                                                                               map_layer_grid['hex_colors'], map_layer_grid['georeference'])))
+        else:
+            pending_rasters.append(None)
+
+    @bind_to_current_span
+    def contribute_for_field(index):
+
+        field, map_layer_details = field_map_layers[index]
+        checkpoint_key = get_checkpoint_key(org_uri, field, map_layer_details)
+        result = {'field': field, 'title': map_layer_details['map_layer_title'], 'map_layer_uri': checkpoint.get(checkpoint_key), 'skipped': False, 'error': None}
+
+        demo_helper.set_thread_serial_number(iot_button_serial_number)
+        try:
+            if result['map_layer_uri']:
+                result['skipped'] = True
+            else:
+                field_uri = get_org_field_uri(org_uri, field)
+                result['map_layer_uri'] = contribute_map_layer(field_uri, map_layer_details, pending_rasters[index])
+                checkpoint.record(checkpoint_key, result['map_layer_uri'])
+
+        except Exception as failure:
+            result['error'] = "{}".format(failure)
+
+        finally:
+            demo_helper.set_thread_serial_number(None)
+
+        return result
+
+    results = []
+    try:
+        with finishing_thread_pool(min(max_workers, len(field_map_layers))) as chain_pool:
+            for result in chain_pool.imap(contribute_for_field, range(len(field_map_layers))):
+                if result['error']:
+                    status = "FAILED  - {}".format(result['error'])
+                else:
+                    status = "SKIPPED - already contributed" if result['skipped'] else "SUCCESS - {}".format(result['map_layer_uri'])
+
+                demo_helper.logger.info("{} - Map layer {} of {} - {} - {} - {}".format(
+                    demo_helper.iot_button_serial_number, len(results) + 1, len(field_map_layers), result['field'], result['title'], status))
+                results.append(result)
+
+    except BaseException:
+        # Python 2's Pool.terminate() can hang while a worker is still sending back a result - only
+        # risk it when we're bailing out anyway
+        if render_pool:
+            render_pool.terminate()
+        raise
+
+    # Let any renders nobody waited for (their field failed first) finish before the processes go
+    if render_pool:
+        render_pool.close()
+        render_pool.join()
+
+    demo_helper.logger.info("{} - Map layers contributed - {} new, {} skipped, {} failed in {:.1f}s".format(
+        demo_helper.iot_button_serial_number,
+        len(checkpoint) - completed_count,
+        len([result for result in results if result['skipped']]),
+        len([result for result in results if result['error']]),
+        time.time() - started_at))
+
+    return results
 
 #############################################################################
-def get_map_layer_summary_list(field_uri):
+# One process per CPU - or None where processes can't be started (e.g. AWS Lambda has no
+# /dev/shm for the pool's semaphores), in which case the grids are rendered on threads instead
+def get_render_pool():
 
-    # Prep the map layer summaries uri for the given field
-    map_layer_summaries_uri = demo_helper.get_relationship_uri(field_uri, "mapLayerSummaries")
+    try:
+        return multiprocessing.Pool()
+    except (OSError, ImportError) as failure:
+        demo_helper.logger.info("{} - Rendering map layers on threads - no process pool ({})".format(demo_helper.iot_button_serial_number, failure))
+        return None
+
+#############################################################################
+# Field names are only unique within an org - the same checkpoint file can be used for several
+def get_checkpoint_key(org_uri, field, map_layer_details):
+    return "{} - {} - {}".format(org_uri, field, map_layer_details['map_layer_title'])
 
-    # Request the map summary list
-    http_response = demo_helper.process_http_oauth_get_request(map_layer_summaries_uri + ';count=100', "Existing map layer summary list retrieved")
-    json_response = http_response.json()
+#############################################################################
+def get_org_field_uri(org_uri, field):
 
-    if json_response['total'] > 0:
-        map_layer_summary_list = json_response['values']
-    else:
-        map_layer_summary_list = []
+    if field.startswith('https://') or field.startswith('http://'):
+        return field
 
-    return map_layer_summary_list
+    fields_uri = demo_helper.get_relationship_uri(org_uri, "fields")
+    field_uri = demo_helper.find_resource_uri(fields_uri, Field, field, "Field list retrieved")
+
+    if not field_uri:
+        raise RequestFailedError("Field {} not found in {}".format(field, org_uri))
+
+    return field_uri
 
 #############################################################################
-def delete_map_layer_summaries(field_uri):
+def get_map_layer_summary_list(field_uri):
 
-    map_layer_summary_list = get_map_layer_summary_list(field_uri)
+    # Prep the map layer summaries uri for the given field
+    map_layer_summaries_uri = demo_helper.get_relationship_uri(field_uri, "mapLayerSummaries")
 
-    # Loop through all map layer summaries
-    for map_layer_summary in map_layer_summary_list:
+    # Request the map summary list - every page of it
+    return list(demo_helper.iterate_collection_values(map_layer_summaries_uri, "Existing map layer summary list retrieved", resource_type=MapLayerSummary))
 
-        map_layer_summary_to_delete_uri = ""
+#############################################################################
+# Delete every Map Layer Summary on the field, along with their Map Layers and File Resources
+#
+# The whole summary -> layer -> file resource tree is listed first (every page, in parallel), then
+# the deletes are run in parallel leaves first - file resources, then layers, then summaries. A
+# failed delete is reported rather than ending the teardown, and only stops its own ancestors
+# from being deleted. Returns a report of what was deleted and what failed.
+def delete_map_layer_summaries(field_uri, max_workers=TEARDOWN_MAX_WORKERS):
+
+    start_time = time.time()
+    report = {'deleted': {'fileResources': 0, 'mapLayers': 0, 'mapLayerSummaries': 0}, 'failed': []}
+
+    # Build the tree - map layers are listed for all summaries at once, then file resources for all layers
+    # The links that come with each listed object are cached, so they don't have to be fetched again
+    map_layer_summaries = []
+    for map_layer_summary in get_map_layer_summary_list(field_uri):
+        map_layer_summary_uri = demo_helper.cache_links(map_layer_summary)
+        if map_layer_summary_uri:
+            map_layer_summaries.append({'uri': map_layer_summary_uri, 'blocked': False})
+
+    listed_map_layers = demo_helper.map_concurrently(lambda map_layer_summary: get_map_layers_list(map_layer_summary['uri']), map_layer_summaries, max_workers)
+
+    map_layers = []
+    for map_layer_summary, (map_layer_list, failure) in zip(map_layer_summaries, listed_map_layers):
+        if failure is not None:
+            report['failed'].append({'uri': map_layer_summary['uri'], 'error': str(failure)})
+            map_layer_summary['blocked'] = True
+            continue
+        for map_layer in map_layer_list:
+            map_layer_uri = demo_helper.cache_links(map_layer)
+            if map_layer_uri:
+                map_layers.append({'uri': map_layer_uri, 'parent': map_layer_summary, 'blocked': False})
+
+    listed_file_resources = demo_helper.map_concurrently(lambda map_layer: get_map_layer_file_resource(map_layer['uri']), map_layers, max_workers)
+
+    file_resources = []
+    for map_layer, (file_resource_uri, failure) in zip(map_layers, listed_file_resources):
+        if failure is not None:
+            report['failed'].append({'uri': map_layer['uri'], 'error': str(failure)})
+            block_ancestors(map_layer)
+        elif file_resource_uri:
+            file_resources.append({'uri': file_resource_uri, 'parent': map_layer})
+
+    demo_helper.logger.info("{} - Teardown - {} map layer summaries, {} map layers, {} file resources to delete".format(
+        demo_helper.iot_button_serial_number, len(map_layer_summaries), len(map_layers), len(file_resources)))
+
+    # Delete leaves first - anything whose children couldn't all be deleted is left in place
+    for kind, custom_text, nodes in [('fileResources', "Map layer file resource deleted", file_resources),
+                                     ('mapLayers', "Map layer deleted", map_layers),
+                                     ('mapLayerSummaries', "Delete existing map layer summary", map_layer_summaries)]:
+
+        nodes_to_delete = [node for node in nodes if not node.get('blocked')]
+        deletions = demo_helper.map_concurrently(
+            lambda node: demo_helper.process_http_oauth_delete_request(node['uri'], custom_text), nodes_to_delete, max_workers)
+
+        for node, (_, failure) in zip(nodes_to_delete, deletions):
+            if failure is None:
+                report['deleted'][kind] += 1
+            else:
+                report['failed'].append({'uri': node['uri'], 'error': str(failure)})
+                block_ancestors(node)
+
+        demo_helper.logger.info("{} - Teardown - deleted {} of {} {}".format(
+            demo_helper.iot_button_serial_number, report['deleted'][kind], len(nodes), kind))
+
+    report['seconds'] = round(time.time() - start_time, 3)
+
+    demo_helper.logger.info("{} - Teardown finished in {}s - {} deleted - {} failed".format(
+        demo_helper.iot_button_serial_number, report['seconds'], sum(report['deleted'].values()), len(report['failed'])))
+
+    return report
 
-        # Delete any underlying map layers for this map layer summary if they exist
-        if map_layer_summary['links'] > 0:
-            link_list = map_layer_summary['links']
-            for link in link_list:
-                if link['rel'] == "self":
-                    map_layer_summary_to_delete_uri = link['uri']
-                    break
+#############################################################################
+def block_ancestors(node):
 
-        # If we found a map layer summary - first delete all of its underlying map layer before deleting the summary itself
-        if map_layer_summary_to_delete_uri:
-            delete_map_layers(map_layer_summary_to_delete_uri)
-            demo_helper.process_http_oauth_delete_request(map_layer_summary_to_delete_uri, "Delete existing map layer summary")
+    node = node.get('parent')
+    while node is not None:
+        node['blocked'] = True
+        node = node.get('parent')
 
 #############################################################################
 def create_map_layer_summary(field_uri, map_layer_details):
@@ -196,99 +526,24 @@ def create_map_layer_summary(field_uri, map_layer_details):
     map_layer_summaries_uri = demo_helper.get_relationship_uri(field_uri, "mapLayerSummaries")
 
     # Post a new map layer summary - pull the new map layer summary uri from the response header
-    http_response = demo_helper.process_http_oauth_post_request(map_layer_summaries_uri, body, "Map layer summary created")
-    map_layer_summary_uri = http_response.headers['Location']
+    # Repeated presses reuse the summary already created for this map layer rather than piling up new ones
+    def post_map_layer_summary():
+        http_response = demo_helper.process_http_oauth_post_request(map_layer_summaries_uri, body, "Map layer summary created")
+        return http_response.headers['Location']
 
-    return map_layer_summary_uri
+    return demo_helper.create_or_get("mapLayerSummaries", map_layer_details['map_layer_title'], map_layer_summaries_uri, post_map_layer_summary)
 
 #############################################################################
 def get_map_layers_list(map_layer_summary_uri):
 
     map_layers_uri = demo_helper.get_relationship_uri(map_layer_summary_uri, "mapLayers")
-    http_response = demo_helper.process_http_oauth_get_request(map_layers_uri + ';count=100', "Existing map layers retrieved")
-    json_response = http_response.json()
-
-    if json_response['total'] > 0:
-        map_layer_list = json_response['values']
-    else:
-        map_layer_list = []
-
-    return map_layer_list
-
-#############################################################################
-def delete_map_layers (map_layer_summary_uri):
-
-    map_layer_list = get_map_layers_list(map_layer_summary_uri)
-
-    for map_layer in map_layer_list:
 
-        map_layer_to_delete_uri = ""
-
-        # Delete any underlying map layers for this map layer summary if they exist
-        if map_layer['links'] > 0:
-            link_list = map_layer['links']
-            for link in link_list:
-                if link['rel'] == "self":
-                    map_layer_to_delete_uri = link['uri']
-                    break
-
-        # If we found a map layer delete its underlying file resource before deleting the map layer itself
-        if map_layer_to_delete_uri:
-            delete_map_layer_file_resource(map_layer_to_delete_uri)
-            demo_helper.process_http_oauth_delete_request(map_layer_to_delete_uri, "Map layer deleted")
+    return list(demo_helper.iterate_collection_values(map_layers_uri, "Existing map layers retrieved", resource_type=MapLayer))
 
 #############################################################################
-def create_map_layer(map_layer_summary_uri, map_layer_title, latitude, longitude):
+def create_map_layer(map_layer_summary_uri, map_layer_title, extent, legend):
 
-    body = {
-       "links": [
-          {
-             "rel": "owningOrganization",
-             "uri": demo_helper.get_demo_org_uri()
-          }
-       ],
-       "title": map_layer_title,
-       "extent": {
-           "minimumLatitude": latitude,
-           "maximumLatitude": latitude + 0.005,  # For this demo - arbitrarily adjust by a small amount to define the extend of the layer
-           "minimumLongitude": longitude,
-           "maximumLongitude": longitude + 0.01  # For this demo - arbitrarily adjust by a small amount to define the extend of the layer
-       },
-       "sortName": "02",
-       "legends": {
-          "unitId": "seeds1ha-1",
-          "ranges": [
-             {
-                #"label": "Custom Range 1",
-                "minimum": 0,
-                "maximum": 99,
-                "hexColor": "#0BA74A",
-                "percent": 0.25
-             },
-             {
-                  #"label": "Custom Range 2",
-                  "minimum": 100,
-                  "maximum": 199,
-                  "hexColor": "#00BFFF",
-                  "percent": 0.40
-            },
-            {
-                  #"label": " Custom Range 3",
-                  "minimum": 200,
-                  "maximum": 299,
-                  "hexColor": "#DC143C",
-                  "percent": 0.15
-            },
-            {
-                  #"label": "Custom Range 4",
-                  "minimum": 300,
-                  "maximum": 399,
-                  "hexColor": "#FFFFFF",
-                  "percent": 0.2
-            }
-          ]
-       }
-    }
+    body = MAP_LAYER_PAYLOAD_TEMPLATE.fill(organization_uri=demo_helper.get_demo_org_uri(), title=map_layer_title, extent=extent, legends=legend)
 
     # Create a new map layer
     map_layers_uri = demo_helper.get_relationship_uri(map_layer_summary_uri, "mapLayers")
@@ -298,30 +553,27 @@ def create_map_layer(map_layer_summary_uri, map_layer_title, latitude, longitude
     return map_layer_uri
 
 #############################################################################
-def get_map_layer_file_resource(map_layer_uri):
-
-    file_resources_uri = demo_helper.get_relationship_uri(map_layer_uri, "fileResources")
-    http_response = demo_helper.process_http_oauth_get_request(file_resources_uri, "Map layer file resource retrieved")
-    json_response = http_response.json()
+def get_demo_map_layer_extent(latitude, longitude):
 
-    file_resource_uri = ""
-
-    if 'links' in json_response:
-        link_list = json_response['links']
-        for link in link_list:
-            if link['rel'] == "self":
-                file_resource_uri = link['uri']
-                break
-
-    return file_resource_uri
+    return {
+        "minimumLatitude": latitude,
+        "maximumLatitude": latitude + 0.005,  # For this demo - arbitrarily adjust by a small amount to define the extend of the layer
+        "minimumLongitude": longitude,
+        "maximumLongitude": longitude + 0.01  # For this demo - arbitrarily adjust by a small amount to define the extend of the layer
+    }
 
 #############################################################################
-def delete_map_layer_file_resource(map_layer_uri):
+def get_map_layer_file_resource(map_layer_uri):
 
-    file_resource_uri = get_map_layer_file_resource(map_layer_uri)
+    file_resources_uri = demo_helper.get_relationship_uri(map_layer_uri, "fileResources")
+    # Only the links of the list are needed - its values aren't read
+    file_resources = demo_helper.open_collection_page(file_resources_uri, "Map layer file resource retrieved", resource_type=FileResource)
+    try:
+        file_resource_uri = get_link(file_resources, "self")
+    finally:
+        file_resources.close()
 
-    if file_resource_uri:
-        demo_helper.process_http_oauth_delete_request(file_resource_uri, "Map layer file resource deleted")
+    return file_resource_uri
 
 #############################################################################
 def create_map_layer_file_resource(map_layer_uri, map_layer_file_resource_title):
@@ -350,13 +602,24 @@ def create_map_layer_file_resource(map_layer_uri, map_layer_file_resource_title)
     return file_resource_uri
 
 #############################################################################
-def upload_map_layer_file_resource(file_resource_uri, map_layer_image_uri):
-
-    # Retrieve the demo  image
-    http_response = demo_helper.process_http_request(requests.get(map_layer_image_uri), "Demo image retrieved", 200)
-
-    # Upload the demo image to the file resource for the map layer
-    demo_helper.process_http_oauth_put_request(file_resource_uri, http_response.content, "File resource uploaded", 204)
+# map_layer_image_source is either the url of the image or a local file path - the image is
+# streamed straight from it into the PUT, so the whole image is never held in memory
+def upload_map_layer_file_resource(file_resource_uri, map_layer_image_source):
+
+    # A stream can only be read once - so every attempt (see RequestScheduler) opens the source again
+    upload_streams = []
+
+    def open_map_layer_image():
+        upload_stream = open_upload_source(map_layer_image_source, demo_helper,
+                                           "{} - {}".format(demo_helper.iot_button_serial_number, map_layer_image_source))
+        upload_streams.append(upload_stream)
+        return upload_stream
+
+    try:
+        demo_helper.process_http_oauth_put_request(file_resource_uri, open_map_layer_image, "File resource uploaded", 204)
+    finally:
+        for upload_stream in upload_streams:
+            upload_stream.close()
 
 #############################################################################
 
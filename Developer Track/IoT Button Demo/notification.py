@@ -3,7 +3,9 @@
 # of the MIT license.  See the LICENSE file for details.
 
 from _common_setup import *
-from _demo_helper import DemoHelper
+from _async_demo_helper import AsyncDemoHelper
+from _demo_helper import is_batch_event, BATCH_SERIAL_NUMBER
+from _tracing import trace_handler
 
 #############################################################################
 # Modify the params below to customize your demo
@@ -40,27 +42,66 @@ DEMO_PARAMS = {
 #############################################################################
 # Lambda entry/invocation point
 
-demo_helper = DemoHelper()
+demo_helper = AsyncDemoHelper()
 
+# With OUTBOX_ENABLED presses are only recorded here and replayed in the background - see DemoHelper.open_outbox
+demo_helper.open_outbox('notification', lambda batch_event: process_press_batch(batch_event))
+
+@trace_handler
 def lambda_handler(event, context):
 
+    # Many presses at once (e.g. from an SQS queue) - returns the outcome of each one
+    if is_batch_event(event):
+        demo_helper.setup(BATCH_SERIAL_NUMBER)
+
+        if demo_helper.outbox is not None:
+            return demo_helper.record_in_outbox(event)
+
+        return process_press_batch(event)
+
     demo_helper.setup(event['serialNumber'])
     event_type = event['clickType']
     demo_helper.logger.info("{} - {} press event received".format(demo_helper.iot_button_serial_number, event_type))
 
+    if demo_helper.outbox is not None:
+        return demo_helper.record_in_outbox(event)
+
     notification_details = DEMO_PARAMS['button_event'][event_type]['notification_details']
     notification_title = "{} - {} - {}".format(demo_helper.iot_button_serial_number, notification_details['severity'], notification_details['type'])
 
     # Notifications are assigned to a target resource - create a field to be used as our target resource (if it doesn't already exist)
     # Use the serial number of the IoT button for the field name to uniquely distinguish your field
     field_name = demo_helper.iot_button_serial_number
-    field_uri = demo_helper.create_field(field_name)
+    field_uri = demo_helper.create_field_async(field_name)
 
     # Post a notification with specified parameters for the given button press type
-    demo_helper.contribute_notification(field_uri, notification_title, notification_details)
+    demo_helper.queue_notification(demo_helper.wait(field_uri), notification_title, notification_details)
+    demo_helper.flush_notifications()
+
+    demo_helper.log_connection_stats()
+    demo_helper.log_traversal_plan_stats()
+    demo_helper.log_latency_histograms()
 
     return 'SUCCESS'
 
+#############################################################################
+# Batch processing - the field is shared by all of a button's presses, so it is only resolved once
+
+def process_press_batch(batch_event):
+
+    # A button's repeated presses are merged into one notification - sent before the batch returns
+    return demo_helper.process_event_batch(batch_event, prepare_button_presses, process_button_press)
+
+def prepare_button_presses(serial_number):
+    return demo_helper.create_field(serial_number)
+
+def process_button_press(event, field_uri):
+
+    notification_details = DEMO_PARAMS['button_event'][event['clickType']]['notification_details']
+    notification_title = "{} - {} - {}".format(demo_helper.iot_button_serial_number, notification_details['severity'], notification_details['type'])
+
+    demo_helper.queue_notification(field_uri, notification_title, notification_details)
+
 
 #############################################################################
 # Test Code
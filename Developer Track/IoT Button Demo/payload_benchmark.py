@@ -0,0 +1,94 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _json_encoding import encode_json, get_json_encoder_name, ujson, UJSON_DOUBLE_PRECISION
+from _demo_helper import NOTIFICATION_PAYLOAD_TEMPLATE
+from asset import ASSET_GEOMETRY_TEMPLATE, get_asset_location_template, DEMO_PARAMS as ASSET_DEMO_PARAMS
+from map_layer import MAP_LAYER_PAYLOAD_TEMPLATE, DEMO_MAP_LAYER_LEGEND_JSON, get_demo_map_layer_extent
+from _asset_location_writer import LOCATION_BATCH_MAX_SIZE
+import argparse
+import json
+import timeit
+
+#############################################################################
+# Request body encoding microbenchmark - bytes on the wire and encode time per payload
+#
+# For each of the hot payloads it compares the way bodies used to be encoded (json.dumps with
+# indent=4), compact json.dumps, ujson (if it is installed) and the payload template. The dict the
+# first three encode is decoded from the template's output, so every method sends the same content
+# - and building that dict isn't counted against them, though the handlers used to build it per
+# request too.
+#
+#   python payload_benchmark.py --number 20000
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the size and encode time of the demo's request bodies")
+    parser.add_argument('--number', type=int, default=10000, help="encodes timed per payload and method")
+    parser.add_argument('--repeat', type=int, default=3, help="timings taken - the best is reported")
+    args = parser.parse_args()
+
+    print "Request bodies encoded with {}".format(get_json_encoder_name())
+    print "{:<28} {:<16} {:>10} {:>12}".format('payload', 'method', 'bytes', 'us/encode')
+
+    for payload_name, fill_template, payload_count in get_payloads():
+        body = json.loads(fill_template())
+        number = max(args.number // payload_count, 1)
+
+        methods = [
+            ('json indent=4', lambda: json.dumps(body, indent=4)),
+            ('json compact', lambda: json.dumps(body, separators=(',', ':'))),
+        ]
+        if ujson is not None:
+            methods.append(('ujson', lambda: ujson.dumps(body, escape_forward_slashes=False, double_precision=UJSON_DOUBLE_PRECISION)))
+        methods.append(('template', fill_template))
+
+        for method_name, encode in methods:
+            seconds = min(timeit.repeat(encode, number=number, repeat=args.repeat)) / number
+
+            print "{:<28} {:<16} {:>10} {:>12.1f}".format(payload_name, method_name, len(encode()), seconds * 1000000.0)
+
+#############################################################################
+# (payload name, function encoding the payload with its template, payloads it holds) for each of the hot payloads
+def get_payloads():
+
+    asset_details = ASSET_DEMO_PARAMS['asset_details']
+
+    def fill_notification():
+        return NOTIFICATION_PAYLOAD_TEMPLATE.fill(
+            contribution_definition_uri="https://sandboxapi.deere.com/platform/contributionDefinitions/00000000-0000-0000-0000-000000000000",
+            field_uri="https://sandboxapi.deere.com/platform/organizations/4321/fields/00000000-0000-0000-0000-000000000000",
+            title="G030PM0000000000 - Map Layer Created - SINGLE",
+            text="Map Layer Created",
+            severity="MEDIUM",
+            event_type="ANNOUNCEMENT",
+            start_date="2018-06-01T12:00:00.000Z",
+            end_date="2018-06-02T12:00:00.000Z")
+
+    def fill_asset_location():
+        return get_asset_location_template(asset_details).fill(
+            timestamp="2018-06-01T12:00:00.000Z",
+            geometry=str(ASSET_GEOMETRY_TEMPLATE.fill(longitude=8.476208999999999, latitude=49.4728807)))
+
+    def fill_asset_location_batch():
+        return encode_json([fill_asset_location() for _ in range(LOCATION_BATCH_MAX_SIZE)])
+
+    def fill_map_layer():
+        return MAP_LAYER_PAYLOAD_TEMPLATE.fill(
+            organization_uri="https://sandboxapi.deere.com/platform/organizations/4321",
+            title="DwD Conference - Map Layer",
+            extent=get_demo_map_layer_extent(49.4728807, 8.476208999999999),
+            legends=DEMO_MAP_LAYER_LEGEND_JSON)
+
+    return [
+        ('notification', fill_notification, 1),
+        ('asset location', fill_asset_location, 1),
+        ('asset locations ({})'.format(LOCATION_BATCH_MAX_SIZE), fill_asset_location_batch, LOCATION_BATCH_MAX_SIZE),
+        ('map layer', fill_map_layer, 1),
+    ]
+
+#############################################################################
+
+if __name__ == '__main__':
+    main()
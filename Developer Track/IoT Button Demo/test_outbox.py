@@ -0,0 +1,150 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _outbox import Outbox
+import _outbox
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+#############################################################################
+# Offline tests of the outbox - presses are replayed through a stub batch handler, nothing is sent
+#
+#   python -m unittest discover -p "test_*.py"
+
+TEST_OUTBOX_KIND = 'test'
+
+#############################################################################
+# Just what the outbox uses of a DemoHelper
+
+class StubDemoHelper:
+
+    logger = logging.getLogger('test_outbox')
+    iot_button_serial_number = 'BATCH'
+
+#############################################################################
+# The handler's batch path - records the presses in the order they were replayed, and fails the ones
+# named in fail_once the first time they are
+
+class StubReplay:
+
+    #############################################################################
+    def __init__(self, fail_once=()):
+
+        self.fail_once = set(fail_once)
+        self.attempts = []
+        self._lock = threading.Lock()
+
+    #############################################################################
+    def __call__(self, batch_event):
+
+        results = []
+        for record in batch_event['Records']:
+            press_name = json.loads(record['body'])['name']
+
+            with self._lock:
+                self.attempts.append(press_name)
+                failed = press_name in self.fail_once
+                self.fail_once.discard(press_name)
+
+            results.append({'itemIdentifier': record['messageId'], 'status': 'FAILED' if failed else 'SUCCESS', 'error': 'Stub failure'})
+
+        return {'results': results}
+
+    #############################################################################
+    # The replay attempts of a button's presses, in order
+    def get_button_attempts(self, serial_number):
+        return [press_name for press_name in self.attempts if press_name.startswith(serial_number)]
+
+#############################################################################
+class OutboxTest(unittest.TestCase):
+
+    #############################################################################
+    def setUp(self):
+
+        self.saved_retry_base_seconds = _outbox.OUTBOX_RETRY_BASE_SECONDS
+        _outbox.OUTBOX_RETRY_BASE_SECONDS = 0.05
+
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'outbox.sqlite')
+        self.outboxes = []
+
+    #############################################################################
+    def tearDown(self):
+
+        for outbox in self.outboxes:
+            outbox.close()
+
+        _outbox.OUTBOX_RETRY_BASE_SECONDS = self.saved_retry_base_seconds
+        shutil.rmtree(self.directory)
+
+    #############################################################################
+    def open_outbox(self, replay_batch, **options):
+
+        outbox = Outbox(StubDemoHelper(), self.file_path, TEST_OUTBOX_KIND, replay_batch, **options)
+        self.outboxes.append(outbox)
+        return outbox
+
+    #############################################################################
+    def append_presses(self, outbox, *press_names):
+
+        for press_name in press_names:
+            outbox.append([{'serialNumber': press_name.split('-')[0], 'clickType': 'SINGLE', 'name': press_name}])
+
+    #############################################################################
+    # A press waiting for its retry holds back the button's later presses - other buttons carry on
+    def test_each_buttons_presses_are_replayed_in_order(self):
+
+        replay_batch = StubReplay(fail_once=['A-2'])
+        outbox = self.open_outbox(replay_batch, drain_workers=2, batch_max_size=2)
+
+        self.append_presses(outbox, 'A-1', 'B-1', 'A-2', 'B-2', 'A-3', 'B-3', 'A-4')
+
+        self.assertTrue(outbox.flush(timeout=10.0))
+        self.assertEqual(replay_batch.get_button_attempts('A'), ['A-1', 'A-2', 'A-2', 'A-3', 'A-4'])
+        self.assertEqual(replay_batch.get_button_attempts('B'), ['B-1', 'B-2', 'B-3'])
+
+        # A worker counts its batch once it has been removed from the file - closing waits for that
+        outbox.close()
+        self.assertEqual(outbox.get_stats()['replayed'], 7)
+        self.assertEqual(outbox.get_stats()['retried'], 1)
+
+    #############################################################################
+    # A button with a batch in flight gets no other batch - until the claim on it expires, when the
+    # process that claimed it is taken to have died and its presses are replayed again
+    def test_expired_claim_is_replayed_again(self):
+
+        outbox = self.open_outbox(StubReplay(), drain_workers=0, batch_max_size=1)
+        self.append_presses(outbox, 'A-1', 'A-2')
+
+        claimed_entries = outbox._claim_batch()
+        self.assertEqual([json.loads(press_event)['name'] for _, press_event in claimed_entries], ['A-1'])
+        self.assertEqual(outbox._claim_batch(), [])
+
+        connection = sqlite3.connect(self.file_path)
+        connection.execute("UPDATE outbox_entries SET claimed_at = claimed_at - ? WHERE state = 'sending'", (_outbox.OUTBOX_CLAIM_TIMEOUT_SECONDS + 1,))
+        connection.commit()
+        connection.close()
+
+        self.assertEqual(outbox._claim_batch(), claimed_entries)
+
+    #############################################################################
+    # The presses recorded by an outbox whose process died are replayed by the next one to open the file
+    def test_presses_survive_the_outbox_that_recorded_them(self):
+
+        self.append_presses(self.open_outbox(StubReplay(), drain_workers=0), 'A-1', 'A-2')
+
+        replay_batch = StubReplay()
+        self.assertTrue(self.open_outbox(replay_batch).flush(timeout=10.0))
+        self.assertEqual(replay_batch.attempts, ['A-1', 'A-2'])
+
+#############################################################################
+
+if __name__ == '__main__':
+    unittest.main()
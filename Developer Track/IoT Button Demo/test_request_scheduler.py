@@ -0,0 +1,224 @@
+# Copyright (c) 2018 Deere & Company
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from _request_scheduler import RequestScheduler, CircuitBreaker, RequestFailedError, CircuitOpenError
+import _request_scheduler
+import requests
+import threading
+import time
+import unittest
+
+#############################################################################
+# Offline tests of the request scheduler - the requests are stubbed, nothing is sent
+#
+#   python -m unittest discover -p "test_*.py"
+
+TEST_URL = "https://api.test/platform/organizations"
+
+# Backoffs and rates short enough for the tests not to wait on them
+TEST_SCHEDULER_CONSTANTS = {
+    'REQUEST_BACKOFF_BASE_SECONDS': 0.001,
+    'REQUEST_BACKOFF_MAX_SECONDS': 0.01,
+    'REQUEST_RATE_PER_SECOND': 1000.0,
+    'REQUEST_BURST_SIZE': 1000,
+}
+
+#############################################################################
+# Just what the scheduler looks at of a response
+
+class StubResponse:
+
+    #############################################################################
+    def __init__(self, status_code, headers=None):
+
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    #############################################################################
+    def close(self):
+        self.closed = True
+
+#############################################################################
+# A send_request that gives the outcomes in turn - a response, or an exception to raise
+
+class StubSend:
+
+    #############################################################################
+    def __init__(self, *outcomes):
+
+        self.outcomes = list(outcomes)
+        self.call_times = []
+
+    #############################################################################
+    def __call__(self, timeout):
+
+        self.call_times.append(time.time())
+
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        return outcome
+
+#############################################################################
+class RequestSchedulerTest(unittest.TestCase):
+
+    #############################################################################
+    def setUp(self):
+
+        self.saved_constants = dict((name, getattr(_request_scheduler, name)) for name in TEST_SCHEDULER_CONSTANTS)
+        for name, value in TEST_SCHEDULER_CONSTANTS.items():
+            setattr(_request_scheduler, name, value)
+
+        self.scheduler = RequestScheduler()
+
+    #############################################################################
+    def tearDown(self):
+
+        for name, value in self.saved_constants.items():
+            setattr(_request_scheduler, name, value)
+
+    #############################################################################
+    def test_429_is_retried_after_retry_after(self):
+
+        throttled_response = StubResponse(429, {'Retry-After': '0.2'})
+        send_request = StubSend(throttled_response, StubResponse(200))
+
+        http_response = self.scheduler.send(TEST_URL, send_request)
+
+        self.assertEqual(http_response.status_code, 200)
+        self.assertEqual(http_response.retry_count, 1)
+        self.assertTrue(throttled_response.closed)
+        self.assertGreaterEqual(send_request.call_times[1] - send_request.call_times[0], 0.2)
+
+        # The rate was halved by the 429 - and only a little of it given back by the success
+        token_bucket = self.scheduler.get_token_bucket('api.test')
+        self.assertLess(token_bucket.rate_per_second, token_bucket.max_rate_per_second)
+
+    #############################################################################
+    # The API can't have acted on a throttled request - so even a POST is retried
+    def test_429_is_retried_for_a_post(self):
+
+        send_request = StubSend(StubResponse(429, {'Retry-After': '0'}), StubResponse(201))
+
+        http_response = self.scheduler.send(TEST_URL, send_request, idempotent=False)
+
+        self.assertEqual(http_response.status_code, 201)
+        self.assertEqual(len(send_request.call_times), 2)
+
+    #############################################################################
+    def test_5xx_is_retried_for_a_get(self):
+
+        send_request = StubSend(StubResponse(503), StubResponse(200))
+
+        http_response = self.scheduler.send(TEST_URL, send_request)
+
+        self.assertEqual(http_response.status_code, 200)
+        self.assertEqual(http_response.retry_count, 1)
+
+    #############################################################################
+    # The resource may have been created before the 5xx - retrying would create it twice
+    def test_5xx_is_not_retried_for_a_post(self):
+
+        send_request = StubSend(StubResponse(500), StubResponse(201))
+
+        http_response = self.scheduler.send(TEST_URL, send_request, idempotent=False)
+
+        self.assertEqual(http_response.status_code, 500)
+        self.assertEqual(http_response.retry_count, 0)
+        self.assertEqual(len(send_request.call_times), 1)
+
+    #############################################################################
+    def test_read_timeout_is_not_retried_for_a_post(self):
+
+        send_request = StubSend(requests.exceptions.ReadTimeout("read timed out"), StubResponse(201))
+
+        self.assertRaises(RequestFailedError, self.scheduler.send, TEST_URL, send_request, idempotent=False)
+        self.assertEqual(len(send_request.call_times), 1)
+
+    #############################################################################
+    # Nothing was sent if the connection couldn't be made - so a POST can be retried
+    def test_connect_timeout_is_retried_for_a_post(self):
+
+        send_request = StubSend(requests.exceptions.ConnectTimeout("connect timed out"), StubResponse(201))
+
+        http_response = self.scheduler.send(TEST_URL, send_request, idempotent=False)
+
+        self.assertEqual(http_response.status_code, 201)
+        self.assertEqual(len(send_request.call_times), 2)
+
+    #############################################################################
+    # Once the host has failed failure_threshold times in a row, the request fails without being sent again
+    def test_circuit_opens_after_consecutive_failures(self):
+
+        self.scheduler._circuit_breakers['api.test'] = CircuitBreaker(3, 60.0)
+        send_request = StubSend(*[StubResponse(500) for _ in range(10)])
+
+        self.assertRaises(CircuitOpenError, self.scheduler.send, TEST_URL, send_request)
+        self.assertEqual(len(send_request.call_times), 3)
+
+        self.assertRaises(CircuitOpenError, self.scheduler.send, TEST_URL, StubSend(StubResponse(200)))
+
+#############################################################################
+class CircuitBreakerTest(unittest.TestCase):
+
+    #############################################################################
+    # Whether another thread would be let through right now
+    def allows_other_thread(self, circuit_breaker):
+
+        allowed = []
+        other_thread = threading.Thread(target=lambda: allowed.append(circuit_breaker.allow_request()))
+        other_thread.start()
+        other_thread.join()
+
+        return allowed[0]
+
+    #############################################################################
+    def test_half_open_lets_a_single_trial_through(self):
+
+        circuit_breaker = CircuitBreaker(1, 0.05)
+        circuit_breaker.record_failure()
+        self.assertFalse(circuit_breaker.allow_request())
+
+        time.sleep(0.06)
+
+        # This thread gets the trial - no other request is let through while it is out
+        self.assertTrue(circuit_breaker.allow_request())
+        self.assertFalse(self.allows_other_thread(circuit_breaker))
+
+        # The trial succeeded - the circuit is closed again
+        circuit_breaker.record_success()
+        self.assertTrue(self.allows_other_thread(circuit_breaker))
+
+    #############################################################################
+    def test_failed_trial_opens_the_circuit_again(self):
+
+        circuit_breaker = CircuitBreaker(1, 0.05)
+        circuit_breaker.record_failure()
+        time.sleep(0.06)
+
+        self.assertTrue(circuit_breaker.allow_request())
+        circuit_breaker.record_failure()
+
+        self.assertFalse(circuit_breaker.allow_request())
+        self.assertFalse(self.allows_other_thread(circuit_breaker))
+
+    #############################################################################
+    # e.g. the trial was throttled - the next request becomes the trial instead
+    def test_trial_ended_without_an_outcome_lets_the_next_request_through(self):
+
+        circuit_breaker = CircuitBreaker(1, 0.05)
+        circuit_breaker.record_failure()
+        time.sleep(0.06)
+
+        self.assertTrue(circuit_breaker.allow_request())
+        circuit_breaker.end_trial()
+
+        self.assertTrue(self.allows_other_thread(circuit_breaker))
+
+#############################################################################
+
+if __name__ == '__main__':
+    unittest.main()